@@ -38,13 +38,23 @@ export const api = {
         });
     },
 
-    // Получить результат проверки по ID
-    async getCheckResult(checkId) {
-        return request(`/check/${checkId}`);
+    // Получить результат проверки по ID (wait - ждать изменений до N секунд, long-poll)
+    async getCheckResult(checkId, wait) {
+        return request(wait ? `/check/${checkId}?wait=${wait}` : `/check/${checkId}`);
+    },
+
+    // Адрес SSE потока результатов проверки
+    checkEventsUrl(checkId) {
+        return `${API_BASE_URL}/check/${checkId}/events`;
     },
 
     // Получить список агентов (для будущей страницы статуса)
     async getAgents() {
         return request('/agents');
     },
+
+    // Число агентов по статусам: total, healthy, statuses
+    async getAgentsSummary() {
+        return request('/agents/summary');
+    },
 };
\ No newline at end of file
@@ -1,6 +1,6 @@
 import { api } from './api.js';
 import { initHistory, addToHistory } from './history.js';
-import { showResultsSection, pollCheckResults, renderResults } from './ui.js';
+import { showResultsSection, watchCheckResults, renderResults } from './ui.js';
 import { setupButtonAnimations, validateForm, setButtonState } from './utils.js';
 
 // Получаем элементы DOM
@@ -15,7 +15,7 @@ const historyList = document.getElementById('historyList');
 // Колбэк для клика по истории
 function onHistoryItemClick(checkId) {
     showResultsSection(checkId, checkIdSpan, resultsSection, resultsContainer);
-    pollCheckResults(checkId, resultsContainer);
+    watchCheckResults(checkId, resultsContainer);
 }
 
 // Инициализация при загрузке
@@ -58,8 +58,8 @@ checkForm.addEventListener('submit', async (event) => {
         // Показываем секцию с результатами
         showResultsSection(result.checkId, checkIdSpan, resultsSection, resultsContainer);
         
-        // Начинаем опрашивать бэкенд для получения результатов
-        pollCheckResults(result.checkId, resultsContainer);
+        // Подписываемся на результаты проверки
+        watchCheckResults(result.checkId, resultsContainer);
 
     } catch (error) {
         console.error('Ошибка при создании проверки:', error);
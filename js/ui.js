@@ -36,26 +36,57 @@ export function renderResults(data, resultsContainer) {
     resultsContainer.innerHTML = html;
 }
 
-// Функция для опроса результатов проверки
-export async function pollCheckResults(checkId, resultsContainer) {
-    const maxAttempts = 30;
-    const interval = 2000;
-    
-    for (let attempt = 0; attempt < maxAttempts; attempt++) {
+// Получение результатов через поток SSE: результаты приходят по мере готовности
+export function watchCheckResults(checkId, resultsContainer) {
+    if (!window.EventSource) {
+        return longPollCheckResults(checkId, resultsContainer);
+    }
+
+    const source = new EventSource(api.checkEventsUrl(checkId));
+    let check = null;
+
+    source.addEventListener('snapshot', (event) => {
+        check = JSON.parse(event.data);
+        renderResults(check, resultsContainer);
+    });
+
+    source.addEventListener('result', (event) => {
+        const data = JSON.parse(event.data);
+        check.results[data.type] = data.result;
+        renderResults(check, resultsContainer);
+    });
+
+    source.addEventListener('status', (event) => {
+        check.status = JSON.parse(event.data).status;
+    });
+
+    source.addEventListener('done', (event) => {
+        console.log('Проверка завершена');
+        source.close();
+        renderResults(JSON.parse(event.data), resultsContainer);
+    });
+
+    source.onerror = () => {
+        // Поток оборвался - дожидаемся результата через long-poll
+        source.close();
+        longPollCheckResults(checkId, resultsContainer);
+    };
+}
+
+// Запасной вариант: long-poll, сервер отвечает, как только проверка изменилась
+async function longPollCheckResults(checkId, resultsContainer) {
+    const maxRequests = 10;
+    const wait = 30;
+
+    for (let attempt = 0; attempt < maxRequests; attempt++) {
         try {
-            console.log(`Опрос результатов, попытка ${attempt + 1}`);
-            const result = await api.getCheckResult(checkId);
+            const result = await api.getCheckResult(checkId, wait);
             renderResults(result, resultsContainer);
-            
-            // Если все проверки завершены, прекращаем опрос
+
             if (isCheckComplete(result)) {
                 console.log('Проверка завершена');
                 break;
             }
-            
-            // Ждём перед следующим запросом
-            await new Promise(resolve => setTimeout(resolve, interval));
-            
         } catch (error) {
             console.error('Ошибка при получении результатов:', error);
             resultsContainer.innerHTML = `<p class="status-error">Ошибка: ${error.message}</p>`;
@@ -64,12 +95,9 @@ export async function pollCheckResults(checkId, resultsContainer) {
     }
 }
 
-// Проверяем, все ли проверки завершены
+// Проверяем, завершена ли проверка
 function isCheckComplete(result) {
-    if (!result.results) return false;
-    return result.results.every(agentResult => 
-        agentResult.status === 'completed' || agentResult.status === 'error'
-    );
+    return result.status !== 'queued' && result.status !== 'in_progress';
 }
 
 // Вспомогательные функции
@@ -6,10 +6,13 @@
 
 import asyncio
 import aiohttp
+import gzip
 import json
+import random
 import time
 import uuid
 import socket
+import signal
 import platform
 import subprocess
 import sys
@@ -17,40 +20,103 @@ import os
 from typing import Dict, List, Any
 import logging
 
+# Модули проверок лежат в app/checks
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app', 'checks'))
+
+from check_results import CHECK_TIMEOUTS, DEFAULT_CHECK_TIMEOUT
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+TASKS_PER_REQUEST = 10  # сколько задач брать в аренду за один запрос
+AGENT_MAX_CONCURRENCY = 32  # сколько задач агент выполняет одновременно
+# Лимиты одновременных задач по типам: DNS и TCP пробы дешевые, traceroute держит много сокетов
+TYPE_CONCURRENCY = {
+    'ping': 16,
+    'http': 16,
+    'https': 16,
+    'tcp': 32,
+    'dns': 32,
+    'traceroute': 2,
+}
+DRAIN_TIMEOUT = 60  # сколько ждать выполняющиеся задачи при остановке, секунды
+
+# Соединение с сервером: одна сессия на агента с keep-alive
+HTTP_TIMEOUT = 30  # таймаут запроса к серверу, секунды
+HTTP_KEEPALIVE = 60  # сколько держать простаивающее соединение, секунды
+HTTP_POOL_LIMIT = 8  # соединений к серверу одновременно
+RETRY_ATTEMPTS = 4  # попыток запроса при сетевой ошибке или 5xx/429
+RETRY_BASE_DELAY = 0.5  # базовая задержка повтора, секунды
+RETRY_MAX_DELAY = 10
+GZIP_MIN_SIZE = 1024  # сжимать тела запросов не меньше этого размера, байты
+
+# Пакетная отправка результатов (режим опроса)
+RESULT_BATCH_SIZE = 200  # результатов в одном пакете
+RESULT_BATCH_BYTES = 256 * 1024  # размер пакета до сжатия, байты
+RESULT_FLUSH_INTERVAL = 1.0  # как часто отправлять накопленные результаты, секунды
+RESULT_BUFFER_LIMIT = 10000  # сколько результатов держать, пока сервер недоступен
+WS_HEARTBEAT = 20  # интервал ping WebSocket, секунды
+WS_RECONNECT_MIN = 1  # задержка переподключения, секунды
+WS_RECONNECT_MAX = 30
+
 class NetworkAgent:
     """Агент для выполнения сетевых проверок"""
     
-    def __init__(self, server_url: str = "http://localhost:8000", agent_name: str = None):
-        self.server_url = server_url
+    def __init__(self, server_url: str = "http://localhost:8000", agent_name: str = None,
+                 transport: str = "ws", max_concurrency: int = AGENT_MAX_CONCURRENCY,
+                 type_concurrency: Dict[str, int] = None, compress: bool = False):
+        self.server_url = server_url.rstrip('/')
+        self.transport = transport
+        self.compress = compress
+        self._session = None
+        self.max_concurrency = max_concurrency
         self.agent_name = agent_name or f"agent-{platform.node()}"
         self.agent_token = str(uuid.uuid4())
         self.location = self._get_location()
         self.ip = self._get_local_ip()
         self.agent_id = None
         self.running = False
+        self._stopping = asyncio.Event()
+        
+        # Общий лимит и лимиты по типам проверок
+        self._slots = asyncio.Semaphore(max_concurrency)
+        limits = {**TYPE_CONCURRENCY, **(type_concurrency or {})}
+        self._type_limits = {t: min(n, max_concurrency) for t, n in limits.items()}
+        self._type_slots = {t: asyncio.Semaphore(n) for t, n in self._type_limits.items()}
+        # Взятые, но не завершенные задачи по типам: задачу берем, только если она начнется сразу
+        self._type_claimed = {}
+        self._running = set()  # выполняющиеся задачи (asyncio.Task)
+        
+        # Результаты, ожидающие пакетной отправки: (task_id, строка NDJSON)
+        self._results = []
+        self._results_bytes = 0
+        self._results_ready = asyncio.Event()
+        self._batch_supported = True
         
-        # Добавляем путь к модулям проверок
-        sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app', 'checks'))
+        # Состояние WebSocket канала (сохраняется между переподключениями)
+        self._ws = None
+        self._ws_tasks = asyncio.Queue()  # полученные, но еще не начатые задачи
+        self._inflight = {}  # task_id -> задача, полученная и еще не выполненная
+        self._unsent = {}  # task_id -> сообщение с результатом, еще не подтвержденным сервером
+        self._cancelled = set()  # task_id отмененных сервером задач
+        self._handles = {}  # task_id -> asyncio.Task выполняющейся задачи канала
         
-        # Импортируем функции проверок
+        # Импортируем асинхронные функции проверок: они выполняются в event loop агента без потоков
         try:
-            from PING import advanced_ping_check
-            from HTTP import http_ping_check
-            from TCP_connect import simple_tcp_ping
-            from DNS import check_all_records
-            from traceroute import execute_traceroute
+            from PING import async_ping_check
+            from HTTP import async_http_ping_check
+            from TCP_connect import async_tcp_ping
+            from DNS import async_check_all_records
+            from traceroute import async_traceroute
             
             self.check_functions = {
-                'ping': advanced_ping_check,
-                'http': http_ping_check,
-                'https': http_ping_check,
-                'tcp': simple_tcp_ping,
-                'dns': check_all_records,
-                'traceroute': execute_traceroute
+                'ping': async_ping_check,
+                'http': async_http_ping_check,
+                'https': async_http_ping_check,
+                'tcp': async_tcp_ping,
+                'dns': async_check_all_records,
+                'traceroute': async_traceroute
             }
         except ImportError as e:
             logger.error(f"Ошибка импорта модулей проверок: {e}")
@@ -81,27 +147,90 @@ class NetworkAgent:
         except:
             return "127.0.0.1"
     
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Одна долгоживущая сессия на все запросы к серверу (keep-alive)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                keepalive_timeout=HTTP_KEEPALIVE,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+                # Токен в заголовке дает агенту отдельный лимит запросов на сервере
+                headers={
+                    'User-Agent': f"network-agent/{self.agent_name}",
+                    'X-Agent-Token': self.agent_token
+                }
+            )
+        return self._session
+    
+    async def _close_session(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+    
+    @staticmethod
+    def _retry_delay(attempt: int) -> float:
+        """Экспоненциальная задержка с полным джиттером"""
+        return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    
+    async def _request(self, method: str, path: str, json_data: Any = None,
+                       params: Dict[str, Any] = None, body: bytes = None,
+                       content_type: str = None):
+        """
+        Запрос к серверу через общую сессию. Возвращает (статус, JSON или текст ответа).
+        Сетевые ошибки, 5xx и 429 повторяются с экспоненциальной задержкой: все запросы
+        агента идемпотентны (регистрация по токену, результат по аренде принимается один раз)
+        """
+        headers = {}
+        data = body
+        if json_data is not None:
+            data = json.dumps(json_data).encode()
+            content_type = 'application/json'
+        if data is not None:
+            headers['Content-Type'] = content_type
+            if self.compress and len(data) >= GZIP_MIN_SIZE:
+                data = gzip.compress(data)
+                headers['Content-Encoding'] = 'gzip'
+        
+        url = f"{self.server_url}{path}"
+        for attempt in range(RETRY_ATTEMPTS):
+            last = attempt == RETRY_ATTEMPTS - 1
+            try:
+                async with self._get_session().request(method, url, data=data, params=params,
+                                                       headers=headers) as response:
+                    if (response.status >= 500 or response.status == 429) and not last:
+                        logger.warning(f"{method} {path}: {response.status}, повтор")
+                    else:
+                        if response.content_type == 'application/json':
+                            return response.status, await response.json()
+                        return response.status, await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if last:
+                    raise
+                logger.warning(f"{method} {path}: {e!r}, повтор")
+            await asyncio.sleep(self._retry_delay(attempt))
+    
     async def register(self) -> bool:
         """Регистрация агента в базе данных"""
         try:
-            async with aiohttp.ClientSession() as session:
-                data = {
-                    'name': self.agent_name,
-                    'location': self.location,
-                    'ip': self.ip,
-                    'token': self.agent_token
-                }
-                
-                async with session.post(f"{self.server_url}/api/agents", json=data) as response:
-                    if response.status == 201:
-                        result = await response.json()
-                        self.agent_id = result.get('agent_id')
-                        logger.info(f"Агент зарегистрирован с ID: {self.agent_id}")
-                        return True
-                    else:
-                        error = await response.text()
-                        logger.error(f"Ошибка регистрации: {error}")
-                        return False
+            data = {
+                'name': self.agent_name,
+                'location': self.location,
+                'ip': self.ip,
+                'token': self.agent_token
+            }
+            
+            status, result = await self._request('POST', '/api/agents', data)
+            if status == 201:
+                self.agent_id = result.get('agent_id')
+                logger.info(f"Агент зарегистрирован с ID: {self.agent_id}")
+                return True
+            else:
+                logger.error(f"Ошибка регистрации: {result}")
+                return False
         except Exception as e:
             logger.error(f"Ошибка при регистрации: {e}")
             return False
@@ -109,138 +238,426 @@ class NetworkAgent:
     async def send_heartbeat(self) -> bool:
         """Отправка heartbeat серверу"""
         try:
-            async with aiohttp.ClientSession() as session:
-                data = {
-                    'agent_id': self.agent_id,
-                    'token': self.agent_token
-                }
-                
-                async with session.post(f"{self.server_url}/api/agents/heartbeat", json=data) as response:
-                    if response.status == 200:
-                        logger.debug("Heartbeat отправлен успешно")
-                        return True
-                    else:
-                        logger.warning(f"Heartbeat не отправлен: {response.status}")
-                        return False
+            data = {
+                'agent_id': self.agent_id,
+                'token': self.agent_token
+            }
+            
+            status, _ = await self._request('POST', '/api/agents/heartbeat', data)
+            if status == 200:
+                logger.debug("Heartbeat отправлен успешно")
+                return True
+            else:
+                logger.warning(f"Heartbeat не отправлен: {status}")
+                return False
         except Exception as e:
             logger.error(f"Ошибка при отправке heartbeat: {e}")
             return False
     
-    def _capture_output(self, func, *args, **kwargs):
-        """Выполняет функцию и перехватывает stdout"""
-        from io import StringIO
-        import sys
-        
-        old_stdout = sys.stdout
-        sys.stdout = captured_output = StringIO()
-        
+    async def _run_check(self, check_type: str, target: str) -> Dict[str, Any]:
+        """Выполняет проверку со своим дедлайном и возвращает структурированный результат"""
+        timeout = CHECK_TIMEOUTS.get(check_type, DEFAULT_CHECK_TIMEOUT)
+        args = (5,) if check_type in ['ping', 'http', 'https', 'tcp'] else ()
         try:
-            func(*args, **kwargs)
-            output = captured_output.getvalue()
-            return {"success": True, "output": output}
+            record = await asyncio.wait_for(self.check_functions[check_type](target, *args), timeout)
+            return {"success": record.success, **record.to_dict()}
+        except asyncio.TimeoutError:
+            return {"success": False, "error": f"Превышен таймаут проверки ({timeout} с)"}
         except Exception as e:
             return {"success": False, "error": str(e)}
-        finally:
-            sys.stdout = old_stdout
     
     async def execute_check(self, check_type: str, target: str) -> Dict[str, Any]:
-        """Выполнение проверки"""
-        logger.info(f"Выполняю проверку {check_type} для {target}")
-        
+        """Выполнение проверки с учетом лимитов одновременных задач"""
         if check_type not in self.check_functions:
             return {
                 "success": False,
                 "error": f"Тип проверки {check_type} не поддерживается"
             }
         
-        try:
-            # Выполняем проверку в отдельном потоке
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None,
-                self._capture_output,
-                self.check_functions[check_type],
-                target,
-                5 if check_type in ['ping', 'http', 'https', 'tcp'] else None
-            )
-            
-            return {
-                "type": check_type,
-                "target": target,
-                **result
-            }
-        except Exception as e:
-            return {
-                "success": False,
-                "error": str(e)
-            }
+        if check_type == 'https' and not target.startswith(('http://', 'https://')):
+            target = f"https://{target}"
+        
+        # Сначала слот типа, затем общий: задача, ждущая свой тип, не занимает общий слот
+        type_slots = self._type_slots.setdefault(check_type, asyncio.Semaphore(self.max_concurrency))
+        async with type_slots, self._slots:
+            logger.info(f"Выполняю проверку {check_type} для {target}")
+            result = await self._run_check(check_type, target)
+        
+        return {
+            "type": check_type,
+            "target": target,
+            **result
+        }
     
-    async def get_tasks(self) -> List[Dict[str, Any]]:
-        """Получение задач от сервера"""
+    def _type_free(self) -> Dict[str, int]:
+        """Свободные слоты по типам проверок (без учета общего лимита)"""
+        free = {}
+        for check_type in self.check_functions:
+            limit = self._type_limits.get(check_type, self.max_concurrency)
+            free[check_type] = max(limit - self._type_claimed.get(check_type, 0), 0)
+        return free
+    
+    def _claim_type(self, check_type: str, count: int = 1):
+        self._type_claimed[check_type] = self._type_claimed.get(check_type, 0) + count
+    
+    def _spawn(self, coro) -> asyncio.Task:
+        """Запускает задачу агента и учитывает ее до завершения"""
+        task = asyncio.ensure_future(coro)
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+        return task
+    
+    async def drain(self, timeout: float = DRAIN_TIMEOUT):
+        """Дожидается выполняющихся задач, по истечении timeout отменяет оставшиеся"""
+        if not self._running:
+            return
+        logger.info(f"Завершение: ожидаю задач: {len(self._running)}")
+        done, pending = await asyncio.wait(set(self._running), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Отменено незавершенных задач: {len(pending)}")
+            await asyncio.gather(*pending, return_exceptions=True)
+    
+    def stop(self):
+        """Останавливает агента: новые задачи не берутся, текущие дорабатываются"""
+        self._stopping.set()
+    
+    async def get_tasks(self, limit: int = TASKS_PER_REQUEST) -> List[Dict[str, Any]]:
+        """Получение задач от сервера: только тех типов, для которых есть свободные слоты"""
+        type_free = {t: n for t, n in self._type_free().items() if n > 0}
+        if not type_free:
+            return []
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{self.server_url}/api/agent/tasks") as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get('tasks', [])
-                    else:
-                        logger.warning(f"Не удалось получить задачи: {response.status}")
-                        return []
+            params = {
+                'token': self.agent_token,
+                'types': ','.join(type_free),
+                'limits': ','.join(f'{t}:{n}' for t, n in type_free.items()),
+                'limit': limit
+            }
+            status, data = await self._request('GET', '/api/agent/tasks', params=params)
+            if status == 200:
+                return data.get('tasks', [])
+            else:
+                logger.warning(f"Не удалось получить задачи: {status}")
+                return []
         except Exception as e:
             logger.error(f"Ошибка при получении задач: {e}")
             return []
     
-    async def send_results(self, task_id: str, results: Dict[str, Any]) -> bool:
+    async def send_results(self, task_id: str, lease_id: str, results: Dict[str, Any]) -> bool:
         """Отправка результатов выполнения задачи"""
         try:
-            async with aiohttp.ClientSession() as session:
-                data = {
-                    'task_id': task_id,
-                    'agent_id': self.agent_id,
-                    'results': results
-                }
-                
-                async with session.post(f"{self.server_url}/api/agent/results", json=data) as response:
-                    if response.status == 200:
-                        logger.info(f"Результаты для задачи {task_id} отправлены")
-                        return True
-                    else:
-                        logger.error(f"Ошибка отправки результатов: {response.status}")
-                        return False
+            data = {
+                'task_id': task_id,
+                'lease_id': lease_id,
+                'token': self.agent_token,
+                'results': results
+            }
+            
+            status, result = await self._request('POST', '/api/agent/results', data)
+            if status == 200:
+                if result.get('status') == 'rejected':
+                    logger.warning(f"Результаты для задачи {task_id} отклонены: аренда истекла")
+                else:
+                    logger.info(f"Результаты для задачи {task_id} отправлены")
+                return True
+            else:
+                logger.error(f"Ошибка отправки результатов: {status}")
+                return False
         except Exception as e:
             logger.error(f"Ошибка при отправке результатов: {e}")
             return False
     
+    async def _poll_execute(self, task: Dict[str, Any]):
+        """Выполняет задачу, полученную опросом, и отправляет результат"""
+        try:
+            logger.info(f"Обрабатываю задачу {task['id']}: {task['type']} {task['target']}")
+            result = await self.execute_check(task['type'], task['target'])
+        finally:
+            self._claim_type(task['type'], -1)
+        await self.queue_results(task['id'], task['lease_id'], result)
+    
+    async def queue_results(self, task_id: str, lease_id: str, results: Dict[str, Any]):
+        """Ставит результат в пакет; пакет уходит по размеру или раз в RESULT_FLUSH_INTERVAL"""
+        if not self._batch_supported:
+            await self.send_results(task_id, lease_id, results)
+            return
+        
+        line = json.dumps({'task_id': task_id, 'lease_id': lease_id, 'results': results}).encode() + b'\n'
+        self._results.append((task_id, line))
+        self._results_bytes += len(line)
+        
+        self._trim_results()
+        if len(self._results) >= RESULT_BATCH_SIZE or self._results_bytes >= RESULT_BATCH_BYTES:
+            self._results_ready.set()
+    
+    def _trim_results(self):
+        """Отбрасывает самые старые результаты сверх RESULT_BUFFER_LIMIT"""
+        while len(self._results) > RESULT_BUFFER_LIMIT:
+            dropped, line = self._results.pop(0)
+            self._results_bytes -= len(line)
+            logger.warning(f"Буфер результатов переполнен, результат задачи {dropped} отброшен")
+    
+    async def flush_results(self) -> bool:
+        """Отправляет накопленные результаты пакетами, возвращает False при ошибке"""
+        while self._results:
+            # Берем пакет с начала буфера, не больше RESULT_BATCH_SIZE и RESULT_BATCH_BYTES
+            count, size = 0, 0
+            for _, line in self._results:
+                if count and (count >= RESULT_BATCH_SIZE or size + len(line) > RESULT_BATCH_BYTES):
+                    break
+                count += 1
+                size += len(line)
+            # Пакет забирается из буфера до отправки: пока идет запрос, в буфер
+            # добавляются и из него отбрасываются другие результаты
+            batch = self._results[:count]
+            self._results = self._results[count:]
+            self._results_bytes -= size
+            
+            try:
+                status, data = await self._request(
+                    'POST', '/api/agent/results/batch', params={'token': self.agent_token},
+                    body=b''.join(line for _, line in batch), content_type='application/x-ndjson'
+                )
+            except Exception as e:
+                logger.error(f"Ошибка при отправке пакета результатов: {e}")
+                self._return_results(batch, size)
+                return False
+            
+            if status == 404:
+                # Сервер без пакетного приема - отправляем по одному
+                logger.warning("Сервер не принимает пакеты результатов, отправка по одному")
+                self._batch_supported = False
+                pending, self._results, self._results_bytes = batch + self._results, [], 0
+                for _, line in pending:
+                    item = json.loads(line)
+                    await self.send_results(item['task_id'], item['lease_id'], item['results'])
+                return True
+            if status != 200:
+                logger.error(f"Ошибка отправки пакета результатов: {status} {data}")
+                self._return_results(batch, size)
+                return False
+            
+            logger.info(f"Отправлено результатов: {data.get('received')}, отклонено: {data.get('rejected')}")
+        return True
+    
+    def _return_results(self, batch, size: int):
+        """Возвращает неотправленный пакет в начало буфера"""
+        self._results = batch + self._results
+        self._results_bytes += size
+        self._trim_results()
+    
+    async def _result_flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._results_ready.wait(), RESULT_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._results_ready.clear()
+            await self.flush_results()
+    
     async def process_tasks(self):
-        """Обработка задач"""
+        """Обработка задач: берет столько задач, сколько есть свободных слотов"""
         while self.running:
             try:
+                free = self.max_concurrency - len(self._running)
+                if free <= 0 or not any(self._type_free().values()):
+                    # Все слоты заняты - ждем завершения любой задачи; если ничего
+                    # не выполняется (лимиты типов нулевые), ждем интервал опроса
+                    if self._running:
+                        await asyncio.wait(set(self._running), return_when=asyncio.FIRST_COMPLETED)
+                    else:
+                        await asyncio.sleep(5)
+                    continue
+                
                 # Получаем задачи
-                tasks = await self.get_tasks()
+                tasks = await self.get_tasks(min(free, TASKS_PER_REQUEST))
                 
                 for task in tasks:
-                    task_id = task.get('id')
-                    check_type = task.get('type')
-                    target = task.get('target')
-                    
-                    if not all([task_id, check_type, target]):
+                    if not all([task.get('id'), task.get('lease_id'), task.get('type'), task.get('target')]):
                         continue
                     
-                    logger.info(f"Обрабатываю задачу {task_id}: {check_type} {target}")
-                    
-                    # Выполняем проверку
-                    result = await self.execute_check(check_type, target)
-                    
-                    # Отправляем результаты
-                    await self.send_results(task_id, result)
+                    # Выполняем проверку параллельно с остальными
+                    self._claim_type(task['type'])
+                    self._spawn(self._poll_execute(task))
                 
-                # Пауза между проверками задач
-                await asyncio.sleep(5)
+                # Пауза, если очередь пуста
+                if not tasks:
+                    await asyncio.sleep(5)
                 
             except Exception as e:
                 logger.error(f"Ошибка при обработке задач: {e}")
                 await asyncio.sleep(10)
     
+    async def _poll_loop(self):
+        """Получение задач опросом и отдельный heartbeat"""
+        await asyncio.gather(self.process_tasks(), self._heartbeat_loop())
+    
+    def _ws_url(self) -> str:
+        if self.server_url.startswith('https://'):
+            return 'wss://' + self.server_url[len('https://'):] + '/api/agent/ws'
+        return 'ws://' + self.server_url.split('://', 1)[-1] + '/api/agent/ws'
+    
+    async def _ws_send(self, message: Dict[str, Any]) -> bool:
+        ws = self._ws
+        if ws is None or ws.closed:
+            return False
+        try:
+            await ws.send_json(message)
+            return True
+        except (ConnectionError, RuntimeError):
+            return False
+    
+    async def _ws_session(self):
+        """Одно подключение WebSocket: задачи приходят сразу, без опроса"""
+        session = self._get_session()
+        async with session.ws_connect(self._ws_url(), params={'token': self.agent_token},
+                                      heartbeat=WS_HEARTBEAT,
+                                      compress=15 if self.compress else 0) as ws:
+            self._ws = ws
+            logger.info("Канал WebSocket открыт")
+            # Сообщаем, какие задачи еще выполняются, чтобы сервер не выдал их повторно
+            await ws.send_json({
+                'type': 'hello',
+                'types': list(self.check_functions),
+                'credits': max(self.max_concurrency - len(self._inflight), 0),
+                'type_credits': self._type_free(),
+                'inflight': list(self._inflight) + list(self._unsent)
+            })
+            # Результаты, не подтвержденные до разрыва, отправляем заново
+            for message in list(self._unsent.values()):
+                await ws.send_json(message)
+            
+            heartbeat = asyncio.create_task(self._ws_heartbeat_loop())
+            try:
+                async for msg in ws:
+                    if msg.type != aiohttp.WSMsgType.TEXT:
+                        continue
+                    # Одно некорректное сообщение не должно рвать канал
+                    try:
+                        message = json.loads(msg.data)
+                    except ValueError:
+                        logger.warning("Сервер прислал некорректный JSON")
+                        continue
+                    if not isinstance(message, dict):
+                        logger.warning(f"Сервер прислал сообщение не-объект: {message!r}")
+                        continue
+                    self._on_ws_message(message)
+            finally:
+                heartbeat.cancel()
+                self._ws = None
+    
+    def _on_ws_message(self, message: Dict[str, Any]):
+        kind = message.get('type')
+        if kind == 'task':
+            task = message.get('task')
+            if not isinstance(task, dict) or not all(isinstance(task.get(key), str) for key in ('id', 'type', 'lease_id')):
+                logger.warning(f"Сервер прислал некорректную задачу: {task!r}")
+                return
+            current = self._inflight.get(task['id'])
+            if current is None:
+                self._inflight[task['id']] = task
+                self._claim_type(task['type'])
+                self._ws_tasks.put_nowait(task)
+            else:
+                # Аренда истекла и задача выдана снова, пока мы ее выполняем:
+                # результат отправим по новой аренде, лишний кредит возвращаем
+                current['lease_id'] = task['lease_id']
+                asyncio.ensure_future(self._ws_send(self._credit_message(task['type'])))
+        elif kind == 'cancel':
+            task_ids = message.get('task_ids')
+            for task_id in task_ids if isinstance(task_ids, list) else []:
+                if isinstance(task_id, str) and task_id in self._inflight:
+                    self._cancelled.add(task_id)
+                    handle = self._handles.get(task_id)
+                    if handle is not None:
+                        handle.cancel()
+        elif kind == 'ack':
+            if isinstance(message.get('task_id'), str):
+                self._unsent.pop(message['task_id'], None)
+            if message.get('status') == 'rejected':
+                logger.warning(f"Результаты для задачи {message.get('task_id')} отклонены: аренда истекла")
+        elif kind == 'error':
+            logger.error(f"Ошибка канала: {message.get('error')}")
+    
+    async def _ws_heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(30)
+            await self._ws_send({'type': 'heartbeat'})
+    
+    async def _ws_loop(self):
+        """Держит канал открытым, переподключается с экспоненциальной задержкой"""
+        delay = WS_RECONNECT_MIN
+        while self.running:
+            try:
+                await self._ws_session()
+                delay = WS_RECONNECT_MIN
+            except aiohttp.WSServerHandshakeError as e:
+                if e.status == 404:
+                    # Сервер без WebSocket - работаем опросом
+                    logger.warning("Сервер не поддерживает WebSocket, переход на опрос")
+                    self.transport = 'poll'
+                    await self._poll_loop()
+                    return
+                logger.error(f"Ошибка подключения WebSocket: {e}")
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                logger.error(f"Канал WebSocket недоступен: {e!r}")
+            if self.running:
+                # Джиттер, чтобы агенты не переподключались одновременно после рестарта сервера
+                await asyncio.sleep(random.uniform(delay / 2, delay))
+                delay = min(delay * 2, WS_RECONNECT_MAX)
+    
+    async def _ws_worker(self):
+        """Запускает полученные по каналу задачи параллельно"""
+        while True:
+            task = await self._ws_tasks.get()
+            if task['id'] in self._cancelled:
+                self._finish_ws_task(task['id'])
+                await self._ws_send(self._credit_message(task['type']))
+                continue
+            self._handles[task['id']] = self._spawn(self._ws_execute(task))
+    
+    async def _ws_execute(self, task: Dict[str, Any]):
+        """Выполняет задачу канала, отправляет результат и возвращает кредит"""
+        task_id = task['id']
+        try:
+            logger.info(f"Обрабатываю задачу {task_id}: {task['type']} {task['target']}")
+            result = await self.execute_check(task['type'], task['target'])
+            # lease_id читаем после проверки: задачу могли выдать повторно с новой арендой
+            message = {'type': 'result', 'task_id': task_id, 'lease_id': task['lease_id'], 'results': result}
+            self._unsent[task_id] = message
+            await self._ws_send(message)
+        except asyncio.CancelledError:
+            if task_id not in self._cancelled:
+                raise  # остановка агента
+            logger.info(f"Задача {task_id} отменена сервером")
+        finally:
+            self._finish_ws_task(task_id)
+        await self._ws_send(self._credit_message(task['type']))
+    
+    @staticmethod
+    def _credit_message(check_type: str) -> Dict[str, Any]:
+        """Возврат кредита за задачу: общий и кредит ее типа"""
+        return {'type': 'credit', 'credits': 1, 'type_credits': {check_type: 1}}
+    
+    def _finish_ws_task(self, task_id: str):
+        self._handles.pop(task_id, None)
+        self._cancelled.discard(task_id)
+        task = self._inflight.pop(task_id, None)
+        if task is not None:
+            self._claim_type(task['type'], -1)
+    
+    async def _release_queued(self):
+        """Возвращает серверу полученные, но не начатые задачи"""
+        released = []
+        while not self._ws_tasks.empty():
+            task = self._ws_tasks.get_nowait()
+            self._finish_ws_task(task['id'])
+            released.append({'id': task['id'], 'lease_id': task['lease_id']})
+        if released:
+            await self._ws_send({'type': 'release', 'tasks': released})
+    
     async def run(self):
         """Запуск агента"""
         logger.info(f"Запуск агента {self.agent_name}")
@@ -255,23 +672,50 @@ class NetworkAgent:
         
         self.running = True
         
-        # Запускаем обработку задач
-        task_processor = asyncio.create_task(self.process_tasks())
-        
-        # Отправляем heartbeat каждые 30 секунд
-        heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        if self.transport == 'ws':
+            # Задачи, результаты и heartbeat идут по одному WebSocket каналу
+            intake = asyncio.ensure_future(self._ws_worker())
+            channel = asyncio.ensure_future(self._ws_loop())
+        else:
+            # Опрос: обработка задач и heartbeat каждые 30 секунд
+            intake = asyncio.ensure_future(self.process_tasks())
+            channel = asyncio.ensure_future(self._heartbeat_loop())
+        flusher = asyncio.ensure_future(self._result_flush_loop())
+        stopping = asyncio.ensure_future(self._stopping.wait())
         
         try:
-            # Ждем завершения задач
-            await asyncio.gather(task_processor, heartbeat_task)
+            await asyncio.wait([intake, channel, stopping], return_when=asyncio.FIRST_COMPLETED)
         except KeyboardInterrupt:
             logger.info("Получен сигнал завершения")
         finally:
+            # Новые задачи больше не берем, выполняющиеся дорабатываем, пока канал открыт
             self.running = False
-            task_processor.cancel()
-            heartbeat_task.cancel()
+            intake.cancel()
+            await asyncio.gather(intake, return_exceptions=True)
+            await self._release_queued()
+            await self.drain()
+            
+            flusher.cancel()
+            await asyncio.gather(flusher, return_exceptions=True)
+            await self.flush_results()
+            
+            channel.cancel()
+            stopping.cancel()
+            await asyncio.gather(channel, stopping, return_exceptions=True)
+            await self._close_checks()
+            await self._close_session()
             logger.info("Агент остановлен")
     
+    async def _close_checks(self):
+        """Закрывает общие ресурсы проверок (HTTP пул, ICMP сокеты)"""
+        try:
+            from HTTP import close_http_session
+            from PING import close_pingers
+        except ImportError:
+            return
+        await close_http_session()
+        close_pingers()
+    
     async def _heartbeat_loop(self):
         """Цикл отправки heartbeat"""
         while self.running:
@@ -285,10 +729,26 @@ async def main():
     parser = argparse.ArgumentParser(description='Network Agent')
     parser.add_argument('--server', default='http://localhost:8000', help='URL сервера')
     parser.add_argument('--name', help='Имя агента')
+    parser.add_argument('--transport', choices=['ws', 'poll'], default='ws',
+                        help='Получение задач: WebSocket канал или опрос')
+    parser.add_argument('--concurrency', type=int, default=AGENT_MAX_CONCURRENCY,
+                        help='Сколько задач выполнять одновременно')
+    parser.add_argument('--gzip', action='store_true',
+                        help='Сжимать тела запросов и сообщения WebSocket')
     
     args = parser.parse_args()
     
-    agent = NetworkAgent(server_url=args.server, agent_name=args.name)
+    agent = NetworkAgent(server_url=args.server, agent_name=args.name, transport=args.transport,
+                         max_concurrency=args.concurrency, compress=args.gzip)
+    
+    # SIGINT/SIGTERM - плавная остановка с доработкой текущих задач
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, agent.stop)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows
+    
     await agent.run()
 
 if __name__ == "__main__":
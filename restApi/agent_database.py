@@ -1,12 +1,62 @@
+import asyncio
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+VERSION_FORMAT = '%Y-%m-%d %H:%M:%S.%f'  # формат updated_at: время UTC с микросекундами
+
+AGENT_COLUMNS = "id, name, location, ip, status, created_at, last_heartbeat, updated_at"
+
+def _agent_row(row):
+    return {
+        "id": row[0],
+        "name": row[1],
+        "location": row[2],
+        "ip": row[3],
+        "status": row[4],
+        "created_at": row[5],
+        "last_heartbeat": row[6],
+        "updated_at": row[7]
+    }
 
 class agent_db:
-    def __init__(self, db_path="agents.db"):
+    """
+    База агентов на SQLite (WAL).
+    Соединения долгоживущие, по одному на поток: запись идет через один
+    выделенный поток, чтение - через пул читателей. Подготовленные выражения
+    кэшируются соединением (cached_statements), поэтому SQL повторно не разбирается.
+    Асинхронные обертки async_* не блокируют event loop.
+    Каждое изменение записи ставит ей updated_at - строго возрастающее время
+    изменения. Наибольший updated_at (version) меняется при любом изменении
+    таблицы и служит версией списка агентов
+    """
+
+    def __init__(self, db_path="agents.db", readers=4):
         self.db_path = db_path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="agent-db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="agent-db-reader")
+        self._version_time = None
+        self.version = None  # наибольший updated_at, меняется только в потоке писателя
         self.init_db()
-    
+
+    def _connection(self):
+        """Долгоживущее соединение текущего потока"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False, cached_statements=256)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            with self._connections_lock:
+                self._connections.append(db)
+        return db
+
     def init_db(self):
-        db = sqlite3.connect(self.db_path)
+        db = self._connection()
         cur = db.cursor()
         cur.execute(
             """
@@ -18,30 +68,54 @@ class agent_db:
             ip TEXT,
             status TEXT DEFAULT 'inactive',
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_heartbeat TIMESTAMP
+            last_heartbeat TIMESTAMP,
+            updated_at TIMESTAMP
             )
             """
         )
+        # Миграция баз, созданных до появления updated_at
+        columns = [row[1] for row in cur.execute("PRAGMA table_info(AGENTS)")]
+        if "updated_at" not in columns:
+            cur.execute("ALTER TABLE AGENTS ADD COLUMN updated_at TIMESTAMP")
+            cur.execute("UPDATE AGENTS SET updated_at = COALESCE(last_heartbeat, created_at)")
+        # Индексы под постраничную выборку (id > курсор) с фильтрами и под версию списка
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_agents_status ON AGENTS (status, id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_agents_location ON AGENTS (location, id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_agents_updated_at ON AGENTS (updated_at)")
         db.commit()
-        db.close()
-    
+
+        cur.execute("SELECT MAX(updated_at) FROM AGENTS")
+        version = cur.fetchone()[0]
+        if version:
+            self._version_time = datetime.fromisoformat(version)
+            self.version = version
+
+    def _next_version(self):
+        """Новое значение updated_at, больше всех выданных ранее (вызывается из потока писателя)"""
+        now = datetime.utcnow()
+        if self._version_time is not None and now <= self._version_time:
+            now = self._version_time + timedelta(microseconds=1)
+        self._version_time = now
+        return now.strftime(VERSION_FORMAT)
+
     def create_agent(self, name, location, ip, token):
-        db = sqlite3.connect(self.db_path)
+        db = self._connection()
         cur = db.cursor()
+        version = self._next_version()
         cur.execute(
             """
-            REPLACE INTO AGENTS (name, location, ip, token, status)
-            VALUES (?,?,?,?, 'awaiting_heartbeat')
+            REPLACE INTO AGENTS (name, location, ip, token, status, updated_at)
+            VALUES (?,?,?,?, 'awaiting_heartbeat', ?)
             """,
-            (name, location, ip, token)
+            (name, location, ip, token, version)
         )
         agent_id = cur.lastrowid
         db.commit()
-        db.close()
+        self.version = version
         return agent_id
-    
+
     def get_agent_by_token(self, token):
-            db = sqlite3.connect(self.db_path)
+            db = self._connection()
             cur = db.cursor()
             cur.execute(
                 '''
@@ -51,7 +125,6 @@ class agent_db:
                 (token,)
             )
             row = cur.fetchone()
-            db.close()
             if row:
                 return {
                     "id": row[0],
@@ -64,47 +137,153 @@ class agent_db:
                     "last_heartbeat": row[7]
                 }
             return None
-    
+
     def update_heartbeat(self, agent_id):
-        db = sqlite3.connect(self.db_path)
+        db = self._connection()
         cur = db.cursor()
+        version = self._next_version()
         cur.execute(
             """
             UPDATE AGENTS
-            SET last_heartbeat = CURRENT_TIMESTAMP, status = 'active'
+            SET last_heartbeat = CURRENT_TIMESTAMP, status = 'active', updated_at = ?
             WHERE id = ?
             """,
-            (agent_id,)
+            (version, agent_id)
         )
         db.commit()
-        db.close()
-    
-    def get_all_agents(self):
-        db = sqlite3.connect(self.db_path)
+        self.version = version
+
+    def update_heartbeats(self, heartbeats):
+        """
+        Записывает пачку heartbeat [(agent_id, время), ...] одной транзакцией.
+        Более старое время не перетирает уже записанное, а повтор того же
+        heartbeat не меняет updated_at
+        """
+        db = self._connection()
+        version = self._next_version()
+        changes = db.total_changes
+        with db:
+            db.executemany(
+                """
+                UPDATE AGENTS
+                SET last_heartbeat = ?2, status = 'active', updated_at = ?3
+                WHERE id = ?1 AND (last_heartbeat IS NULL OR last_heartbeat < ?2
+                                   OR (last_heartbeat = ?2 AND status != 'active'))
+                """,
+                [(agent_id, timestamp, version) for agent_id, timestamp in heartbeats]
+            )
+        if db.total_changes != changes:
+            self.version = version
+
+    def update_statuses(self, statuses):
+        """Записывает изменившиеся статусы [(agent_id, статус), ...] одной транзакцией"""
+        db = self._connection()
+        version = self._next_version()
+        changes = db.total_changes
+        with db:
+            db.executemany(
+                "UPDATE AGENTS SET status = ?2, updated_at = ?3 WHERE id = ?1 AND status != ?2",
+                [(agent_id, status, version) for agent_id, status in statuses]
+            )
+        if db.total_changes != changes:
+            self.version = version
+
+    def get_all_agents(self, include_token=False):
+        db = self._connection()
         cur = db.cursor()
-        cur.execute(
-            """
-            SELECT id, name, location, ip, status, created_at, last_heartbeat
-            FROM AGENTS
-            """
-        )
+        cur.execute(f"SELECT {AGENT_COLUMNS}, token FROM AGENTS")
         agents = []
         for row in cur.fetchall():
-            agents.append({
-                "id": row[0],
-                "name": row[1],
-                "location": row[2],
-                "ip": row[3],
-                "status": row[4],
-                "created_at": row[5],
-                "last_heartbeat": row[6]
-            })
-        db.close()
+            agent = _agent_row(row)
+            if include_token:
+                agent["token"] = row[8]
+            agents.append(agent)
         return agents
 
+    @staticmethod
+    def _filters(status, location):
+        conditions = []
+        params = []
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        if location is not None:
+            conditions.append("location = ?")
+            params.append(location)
+        return conditions, params
+
+    def list_agents(self, after_id=0, limit=100, status=None, location=None):
+        """
+        Страница агентов по возрастанию id, начиная после after_id (keyset пагинация:
+        по индексу, без OFFSET). Возвращает (агенты, id для следующей страницы или None)
+        """
+        conditions, params = self._filters(status, location)
+        conditions.append("id > ?")
+        params.append(after_id)
+        db = self._connection()
+        cur = db.cursor()
+        # Лишняя строка показывает, есть ли следующая страница
+        cur.execute(
+            f"SELECT {AGENT_COLUMNS} FROM AGENTS WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?",
+            params + [limit + 1]
+        )
+        rows = cur.fetchall()
+        agents = [_agent_row(row) for row in rows[:limit]]
+        next_after = agents[-1]["id"] if len(rows) > limit else None
+        return agents, next_after
+
+    def count_agents(self, status=None, location=None):
+        conditions, params = self._filters(status, location)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        cur = self._connection().cursor()
+        cur.execute(f"SELECT COUNT(*) FROM AGENTS{where}", params)
+        return cur.fetchone()[0]
+
+    # Асинхронные обертки: запись - в поток писателя, чтение - в пул читателей
+
+    def _write(self, func, *args):
+        return asyncio.get_event_loop().run_in_executor(self._writer, func, *args)
+
+    def _read(self, func, *args):
+        return asyncio.get_event_loop().run_in_executor(self._readers, func, *args)
+
+    async def async_create_agent(self, name, location, ip, token):
+        return await self._write(self.create_agent, name, location, ip, token)
+
+    async def async_get_agent_by_token(self, token):
+        return await self._read(self.get_agent_by_token, token)
+
+    async def async_update_heartbeat(self, agent_id):
+        return await self._write(self.update_heartbeat, agent_id)
+
+    async def async_update_heartbeats(self, heartbeats):
+        return await self._write(self.update_heartbeats, heartbeats)
+
+    async def async_update_statuses(self, statuses):
+        return await self._write(self.update_statuses, statuses)
+
+    async def async_get_all_agents(self, include_token=False):
+        return await self._read(self.get_all_agents, include_token)
+
+    async def async_list_agents(self, after_id=0, limit=100, status=None, location=None):
+        return await self._read(self.list_agents, after_id, limit, status, location)
+
+    async def async_count_agents(self, status=None, location=None):
+        return await self._read(self.count_agents, status, location)
+
+    def close(self):
+        """Дожидается потоков и закрывает все соединения"""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._connections_lock:
+            for db in self._connections:
+                db.close()
+            self._connections.clear()
+        self._local = threading.local()
+
 if __name__ == "__main__":
     adb = agent_db()
     #adb.create_agent("test agent", "Russia", "00.000.0.000", "2")
     adb.update_heartbeat(1)
     print(adb.get_agent_by_token("1"))
-    print(adb.get_all_agents())
\ No newline at end of file
+    print(adb.get_all_agents())
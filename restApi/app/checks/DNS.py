@@ -1,8 +1,26 @@
+import asyncio
+import time
 import dns.resolver
 import sys
 from urllib.parse import urlparse
 from typing import List, Dict, Optional
 
+from check_results import DnsResult
+from dns_cache import dns_cache, get_async_resolver
+
+RECORD_TYPES = [
+    ('A', 'IPv4 addresses'),
+    ('AAAA', 'IPv6 addresses'),
+    ('MX', 'Mail servers'),
+    ('NS', 'Name servers'),
+    ('TXT', 'Text records'),
+    ('CNAME', 'Canonical name'),
+    ('SOA', 'Start of authority')
+]
+
+def _silent(*args, **kwargs):
+    pass
+
 def normalize_domain(domain):
     """Извлекает домен из URL если необходимо"""
     if domain.startswith(('http://', 'https://')):
@@ -18,129 +36,133 @@ def get_dns_servers():
         '208.67.222.222',  # OpenDNS
     ]
 
+def _lookup_result(domain, record_type, dns_server, answers=None, error=None):
+    """Формирует результат dns_lookup из ответа или исключения"""
+    result = {
+        'success': error is None,
+        'domain': domain,
+        'type': record_type,
+        'dns_server': dns_server or 'system'
+    }
+    
+    if error is None:
+        result['results'] = list(answers)
+    elif isinstance(error, dns.resolver.NoAnswer):
+        result['error'] = f'No {record_type} record found'
+    elif isinstance(error, dns.resolver.NXDOMAIN):
+        result['error'] = 'Domain does not exist'
+    elif isinstance(error, dns.resolver.Timeout):
+        result['error'] = 'DNS query timed out'
+    else:
+        result['error'] = f'Error: {str(error)}'
+    return result
+
 def dns_lookup(domain, record_type='A', dns_server=None):
     """
-    Выполняет DNS запрос указанного типа
+    Выполняет DNS запрос указанного типа (синхронная обертка для консоли)
+    """
+    return asyncio.run(async_dns_lookup(domain, record_type, dns_server))
+
+async def async_dns_lookup(domain, record_type='A', dns_server=None, cached=True):
+    """
+    Асинхронный DNS запрос указанного типа через общий кэш с учетом TTL.
+    cached=False - запрос напрямую к серверу, мимо кэша
     """
     domain = normalize_domain(domain)
     
     try:
-       
-        resolver = dns.resolver.Resolver()
-        
-        
-        if dns_server:
-            resolver.nameservers = [dns_server]
-        
-        
-        answers = resolver.resolve(domain, record_type)
-        
-        results = []
-        for rdata in answers:
-            results.append(str(rdata))
-        
-        return {
-            'success': True,
-            'domain': domain,
-            'type': record_type,
-            'results': results,
-            'dns_server': dns_server or 'system'
-        }
-        
-    except dns.resolver.NoAnswer:
-        return {
-            'success': False,
-            'domain': domain,
-            'type': record_type,
-            'error': f'No {record_type} record found',
-            'dns_server': dns_server or 'system'
-        }
-    except dns.resolver.NXDOMAIN:
-        return {
-            'success': False,
-            'domain': domain,
-            'type': record_type,
-            'error': 'Domain does not exist',
-            'dns_server': dns_server or 'system'
-        }
-    except dns.resolver.Timeout:
-        return {
-            'success': False,
-            'domain': domain,
-            'type': record_type,
-            'error': 'DNS query timed out',
-            'dns_server': dns_server or 'system'
-        }
+        if cached:
+            answers = await dns_cache.resolve(domain, record_type, dns_server)
+        else:
+            answer = await get_async_resolver(dns_server).resolve(domain, record_type)
+            answers = [str(rdata) for rdata in answer]
+        return _lookup_result(domain, record_type, dns_server, answers)
     except Exception as e:
-        return {
-            'success': False,
-            'domain': domain,
-            'type': record_type,
-            'error': f'Error: {str(e)}',
-            'dns_server': dns_server or 'system'
-        }
+        return _lookup_result(domain, record_type, dns_server, error=e)
 
-def check_all_records(domain, dns_server=None):
+async def async_check_all_records(domain, dns_server=None):
     """
-    Проверяет все основные типы DNS записей для домена
+    Запрашивает все основные типы записей параллельно:
+    полная проверка занимает один RTT до резолвера вместо семи
     """
     domain = normalize_domain(domain)
+    result = DnsResult(domain=domain, dns_server=dns_server or 'system')
     
-    print(f"\nDNS LOOKUP {domain}")
-    if dns_server:
-        print(f"DNS Server: {dns_server}")
-    print("─" * 60)
+    lookups = await asyncio.gather(*(
+        async_dns_lookup(domain, record_type, dns_server)
+        for record_type, _ in RECORD_TYPES
+    ))
     
-    record_types = [
-        ('A', 'IPv4 addresses'),
-        ('AAAA', 'IPv6 addresses'),
-        ('MX', 'Mail servers'),
-        ('NS', 'Name servers'),
-        ('TXT', 'Text records'),
-        ('CNAME', 'Canonical name'),
-        ('SOA', 'Start of authority')
-    ]
+    for lookup in lookups:
+        if lookup['success']:
+            result.records[lookup['type']] = lookup['results']
+        else:
+            result.errors[lookup['type']] = lookup['error']
+    
+    return result
+
+async def _timed_lookup(domain, record_type, dns_server):
+    """DNS запрос с замером времени ответа, мс. Идет мимо кэша: измеряется RTT до сервера"""
+    start_time = time.perf_counter()
+    result = await async_dns_lookup(domain, record_type, dns_server, cached=False)
+    result['time'] = (time.perf_counter() - start_time) * 1000
+    return result
+
+async def async_compare_dns_servers(domain, dns_servers=None, record_type='A'):
+    """Опрашивает несколько DNS серверов параллельно, возвращает список результатов со временем"""
+    domain = normalize_domain(domain)
+    return await asyncio.gather(*(
+        _timed_lookup(domain, record_type, dns_server)
+        for dns_server in (dns_servers or get_dns_servers())
+    ))
+
+def check_all_records(domain, dns_server=None, verbose=False):
+    """
+    Проверяет все основные типы DNS записей для домена.
+    Возвращает DnsResult, с verbose=True печатает записи в консоль
+    """
+    out = print if verbose else _silent
+    domain = normalize_domain(domain)
+    result = asyncio.run(async_check_all_records(domain, dns_server))
     
-    all_results = {}
+    out(f"\nDNS LOOKUP {domain}")
+    if dns_server:
+        out(f"DNS Server: {dns_server}")
+    out("─" * 60)
     
-    for record_type, description in record_types:
-        print(f"\n{record_type:6} ({description}):")
-        print("  " + "─" * 50)
+    for record_type, description in RECORD_TYPES:
+        out(f"\n{record_type:6} ({description}):")
+        out("  " + "─" * 50)
         
-        result = dns_lookup(domain, record_type, dns_server)
-        all_results[record_type] = result
-        
-        if result['success']:
-            for i, record in enumerate(result['results'], 1):
+        if record_type in result.records:
+            for i, record in enumerate(result.records[record_type], 1):
                 if record_type == 'MX':
                     
                     parts = record.split()
                     if len(parts) >= 2:
                         priority = parts[0]
                         server = ' '.join(parts[1:])
-                        print(f"  {i:2d}. Priority: {priority}, Server: {server}")
+                        out(f"  {i:2d}. Priority: {priority}, Server: {server}")
                     else:
-                        print(f"  {i:2d}. {record}")
+                        out(f"  {i:2d}. {record}")
                 else:
-                    print(f"{i:2d}. {record}")
+                    out(f"{i:2d}. {record}")
         else:
-            print(f"{result['error']}")
+            out(f"{result.errors.get(record_type)}")
     
-    return all_results
+    return result
 
 def check_with_multiple_dns(domain):
     """
-    Проверяет DNS записи используя несколько DNS серверов
+    Проверяет DNS записи используя несколько DNS серверов (параллельно)
     """
     domain = normalize_domain(domain)
-    dns_servers = get_dns_servers()
     
     print(f"\nDNS LOOKUP {domain} - Multiple DNS Servers")
     print("─" * 60)
     
-    for dns_server in dns_servers:
-        print(f"\n📡 Using DNS: {dns_server}")
-        result = dns_lookup(domain, 'A', dns_server)
+    for result in asyncio.run(async_compare_dns_servers(domain)):
+        print(f"\n📡 Using DNS: {result['dns_server']}")
         
         if result['success']:
             print(f" A records: {', '.join(result['results'])}")
@@ -186,22 +208,18 @@ def detailed_mx_check(domain):
 
 def dns_benchmark(domain):
     """
-    Тестирование скорости ответа разных DNS серверов
+    Тестирование скорости ответа разных DNS серверов (серверы опрашиваются параллельно)
     """
-    import time
-    
     domain = normalize_domain(domain)
-    dns_servers = get_dns_servers()
     
     print(f"\nDNS BENCHMARK {domain}")
     print("─" * 60)
     
     results = []
     
-    for dns_server in dns_servers:
-        start_time = time.time()
-        result = dns_lookup(domain, 'A', dns_server)
-        response_time = (time.time() - start_time) * 1000  # в миллисекундах
+    for result in asyncio.run(async_compare_dns_servers(domain)):
+        dns_server = result['dns_server']
+        response_time = result['time']
         
         status = 'Выполнено' if result['success'] else 'Отказ'
         results.append({
@@ -247,7 +265,7 @@ def main():
     choice = input("Ваш выбор [1]: ").strip() or "1"
     
     if choice == "1":
-        check_all_records(domain)
+        check_all_records(domain, verbose=True)
     elif choice == "2":
         check_with_multiple_dns(domain)
     elif choice == "3":
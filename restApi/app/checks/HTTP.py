@@ -1,81 +1,169 @@
+import asyncio
 import requests
+import socket
 import time
-import statistics
 from urllib.parse import urlparse
 
+import aiohttp
+from aiohttp.abc import AbstractResolver
 
-def http_ping_check(url, count=5):
-    """
-    Выполняет многократную проверку доступности сайта по HTTP/HTTPS
-    с выводом статистики в формате, похожем на ping
-    """
-    # Добавляем схему если отсутствует
+from check_results import ProbeResult
+from dns_cache import resolve_host
+
+# Параметры общего пула соединений для асинхронных проверок
+HTTP_POOL_LIMIT = 1000  # всего одновременных соединений
+HTTP_POOL_LIMIT_PER_HOST = 20  # соединений к одному хосту
+HTTP_TIMEOUT = 10  # таймаут одного запроса, секунды
+HTTP_READ_CHUNK = 64 * 1024
+
+_session = None
+
+
+def _silent(*args, **kwargs):
+    pass
+
+
+def _print_http_summary(result, out):
+    """Печатает статистику в формате, похожем на ping"""
+    out(f"\n--- {result.host} HTTP ping statistics ---")
+    out(f"{result.sent} requests made, {result.received} successful, {result.loss:.0f}% failed")
+
+    if result.codes:
+        out("Status code distribution:")
+        for code, count_val in result.codes.items():
+            out(f"  {code}: {count_val} times")
+
+    rtt = result.rtt
+    if rtt:
+        out(f"response min/avg/max/mdev = {rtt['min']:.3f}/{rtt['avg']:.3f}/{rtt['max']:.3f}/{rtt['mdev']:.3f} ms")
+
+
+def _prepare_url(url):
+    """Добавляет схему если отсутствует и возвращает (url, ProbeResult)"""
     if not url.startswith(('http://', 'https://')):
         url = 'http://' + url
 
     parsed_url = urlparse(url)
-    hostname = parsed_url.hostname
-    scheme = parsed_url.scheme
-    port = parsed_url.port or (443 if scheme == 'https' else 80)
+    port = parsed_url.port or (443 if parsed_url.scheme == 'https' else 80)
+    return url, ProbeResult(host=parsed_url.hostname, port=port)
 
-    print(f"HTTP PING {hostname} ({scheme.upper()}:{port})")
 
-    success_count = 0
-    response_times = []
-    status_codes = []
+def http_ping_check(url, count=5, verbose=False):
+    """
+    Выполняет многократную проверку доступности сайта по HTTP/HTTPS.
+    Возвращает ProbeResult, с verbose=True печатает вывод в формате ping
+    """
+    out = print if verbose else _silent
+    url, result = _prepare_url(url)
+
+    out(f"HTTP PING {result.host} ({urlparse(url).scheme.upper()}:{result.port})")
 
     for i in range(count):
         try:
-            start_time = time.time()
+            start_time = time.perf_counter()
             response = requests.get(url, timeout=10, allow_redirects=True)
-            end_time = time.time()
-
-            response_time = (end_time - start_time) * 1000  # в миллисекундах
-            response_times.append(response_time)
-            status_codes.append(response.status_code)
-            success_count += 1
+            response_time = (time.perf_counter() - start_time) * 1000  # в миллисекундах
 
-            # Форматируем вывод
-            print(
-                f"HTTP seq={i + 1} status={response.status_code} time={response_time:.1f} ms size={len(response.content)} bytes")
+            result.add_reply(i + 1, response_time, status=response.status_code, size=len(response.content))
+            out(f"HTTP seq={i + 1} status={response.status_code} time={response_time:.1f} ms size={len(response.content)} bytes")
 
         except requests.exceptions.RequestException as e:
-            print(f"HTTP seq={i + 1} failed: {str(e)}")
-            response_times.append(None)
-            status_codes.append(None)
+            result.add_failure(i + 1, str(e))
+            out(f"HTTP seq={i + 1} failed: {str(e)}")
 
         # Пауза между проверками
         if i < count - 1:
             time.sleep(1)
 
-    # Статистика
-    print(f"\n--- {hostname} HTTP ping statistics ---")
-    packet_loss = ((count - success_count) / count) * 100
-    print(f"{count} requests made, {success_count} successful, {packet_loss:.0f}% failed")
+    _print_http_summary(result, out)
+    return result
+
+
+class CachedResolver(AbstractResolver):
+    """Резолвер aiohttp поверх общего DNS кэша проверок"""
 
-    # Статистика по кодам ответа
-    successful_codes = [code for code in status_codes if code is not None]
-    if successful_codes:
-        code_counts = {}
-        for code in successful_codes:
-            code_counts[code] = code_counts.get(code, 0) + 1
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        addresses = await resolve_host(host)
+        if family != socket.AF_UNSPEC:
+            addresses = [a for a in addresses if a[0] == family] or addresses
+        if not addresses:
+            raise OSError(f"Cannot resolve {host}")
+        return [
+            {
+                "hostname": host,
+                "host": address,
+                "port": port,
+                "family": addr_family,
+                "proto": 0,
+                "flags": socket.AI_NUMERICHOST,
+            }
+            for addr_family, address in addresses
+        ]
 
-        print("Status code distribution:")
-        for code, count_val in code_counts.items():
-            print(f"  {code}: {count_val} times")
+    async def close(self):
+        pass
+
+
+def get_http_session():
+    """
+    Возвращает общий ClientSession с пулом keep-alive соединений.
+    Сессия создается лениво в текущем event loop и переиспользуется всеми проверками
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            resolver=CachedResolver(),
+            use_dns_cache=False,  # кэширует CachedResolver с учетом TTL
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+        )
+    return _session
+
+
+async def close_http_session():
+    """Закрывает общий ClientSession (вызывается при остановке сервера)"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def _http_probe(session, url):
+    """Один HTTP запрос: возвращает (status, size) и считает тело ответа без сохранения"""
+    async with session.get(url, allow_redirects=True) as response:
+        size = 0
+        async for chunk in response.content.iter_chunked(HTTP_READ_CHUNK):
+            size += len(chunk)
+        return response.status, size
+
+
+async def async_http_ping_check(url, count=5, interval=1.0, session=None):
+    """
+    Асинхронная версия http_ping_check на aiohttp.
+    Работает прямо в event loop сервера без потоков, использует общий пул соединений
+    """
+    url, result = _prepare_url(url)
+    session = session or get_http_session()
+
+    for i in range(count):
+        start_time = time.perf_counter()
+        try:
+            status, size = await _http_probe(session, url)
+            response_time = (time.perf_counter() - start_time) * 1000  # в миллисекундах
+            result.add_reply(i + 1, response_time, status=status, size=size)
 
-    # Статистика по времени ответа
-    successful_times = [t for t in response_times if t is not None]
-    if successful_times:
-        min_time = min(successful_times)
-        avg_time = statistics.mean(successful_times)
-        max_time = max(successful_times)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            result.add_failure(i + 1, str(e) or e.__class__.__name__)
 
-        # Вычисляем mdev (mean deviation)
-        deviations = [abs(t - avg_time) for t in successful_times]
-        mdev = statistics.mean(deviations) if deviations else 0
+        # Пауза между проверками не занимает поток
+        if i < count - 1 and interval:
+            await asyncio.sleep(interval)
 
-        print(f"response min/avg/max/mdev = {min_time:.3f}/{avg_time:.3f}/{max_time:.3f}/{mdev:.3f} ms")
+    return result
 
 
 # Основная программа
@@ -83,6 +171,6 @@ if __name__ == "__main__":
     website = input("Введите URL сайта для HTTP проверки: ").strip()
 
     if website:
-        http_ping_check(website, 5)
+        http_ping_check(website, 5, verbose=True)
     else:
         print("Вы не ввели URL сайта")
\ No newline at end of file
@@ -1,72 +1,263 @@
-import requests
-import time
-import statistics
+import asyncio
+import itertools
+import random
 import socket
+import struct
+import time
+import weakref
 from urllib.parse import urlparse
 
+from check_results import ProbeResult
+from dns_cache import resolve_host
+
+# ICMP echo: тип запроса и ответа для IPv4 и IPv6
+ICMP_ECHO_REQUEST = {socket.AF_INET: 8, socket.AF_INET6: 128}
+ICMP_ECHO_REPLY = {socket.AF_INET: 0, socket.AF_INET6: 129}
+ICMP_PROTO = {socket.AF_INET: socket.IPPROTO_ICMP, socket.AF_INET6: socket.IPPROTO_ICMPV6}
+
+# Linux константы для получения TTL / hop limit через recvmsg
+IP_RECVTTL = getattr(socket, 'IP_RECVTTL', 12)
+IPV6_RECVHOPLIMIT = getattr(socket, 'IPV6_RECVHOPLIMIT', 51)
+IPV6_HOPLIMIT = getattr(socket, 'IPV6_HOPLIMIT', 52)
+
+PING_PAYLOAD = b'\x00' * 56  # 56(84) bytes of data, как у системного ping
+PING_TIMEOUT = 2.0  # ожидание ответа на один запрос, секунды
+PING_INTERVAL = 1.0  # интервал между запросами, секунды
+
+# Один IcmpPinger на (event loop, семейство адресов)
+_pingers = weakref.WeakKeyDictionary()
 
-def advanced_ping_check(url, count=5):
+
+def icmp_checksum(data):
+    """Контрольная сумма ICMP (RFC 1071)"""
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+class IcmpPinger:
     """
-    Выполняет многократную проверку пинга и выводит статистику в формате ping
+    Асинхронный ICMP echo движок на одном сокете.
+    Пробует непривилегированный SOCK_DGRAM/IPPROTO_ICMP, при отказе - SOCK_RAW.
+    Все цели и все запросы мультиплексируются через один сокет: ответы
+    сопоставляются с запросами по идентификатору и номеру последовательности
     """
-    # Извлекаем hostname из URL
+
+    def __init__(self, family=socket.AF_INET, loop=None):
+        self.family = family
+        self.loop = loop or asyncio.get_event_loop()
+        self.sock, self.raw = self._open_socket(family)
+        self.sock.setblocking(False)
+
+        if self.raw:
+            # Сырой сокет видит все ICMP ответы хоста, свои отличаем по идентификатору
+            self.ident = random.getrandbits(16)
+        else:
+            # Для SOCK_DGRAM ядро подставляет в идентификатор локальный "порт" сокета
+            self.sock.bind(('', 0) if family == socket.AF_INET else ('::', 0))
+            self.ident = self.sock.getsockname()[1]
+
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_IP, IP_RECVTTL, 1)
+        else:
+            self.sock.setsockopt(socket.IPPROTO_IPV6, IPV6_RECVHOPLIMIT, 1)
+
+        self._seq = itertools.count(1)
+        self._pending = {}  # seq -> (future, address, время отправки)
+        self.loop.add_reader(self.sock.fileno(), self._on_readable)
+
+    @staticmethod
+    def _open_socket(family):
+        """Открывает ICMP сокет, возвращает (socket, raw)"""
+        try:
+            return socket.socket(family, socket.SOCK_DGRAM, ICMP_PROTO[family]), False
+        except OSError:
+            # Непривилегированный ping запрещен (net.ipv4.ping_group_range), нужен root/CAP_NET_RAW
+            return socket.socket(family, socket.SOCK_RAW, ICMP_PROTO[family]), True
+
+    def _next_seq(self):
+        """Следующий свободный номер последовательности (16 бит)"""
+        for _ in range(0x10000):
+            seq = next(self._seq) & 0xffff
+            if seq not in self._pending:
+                return seq
+        raise RuntimeError("Слишком много ICMP запросов в полете")
+
+    def _build_packet(self, seq):
+        icmp_type = ICMP_ECHO_REQUEST[self.family]
+        header = struct.pack('!BBHHH', icmp_type, 0, 0, self.ident, seq)
+        if self.family == socket.AF_INET:
+            # Для ICMPv6 контрольную сумму считает ядро
+            checksum = icmp_checksum(header + PING_PAYLOAD)
+            header = struct.pack('!BBHHH', icmp_type, 0, checksum, self.ident, seq)
+        return header + PING_PAYLOAD
+
+    async def ping(self, address, timeout=PING_TIMEOUT):
+        """
+        Отправляет один echo запрос и ждет ответ.
+        Возвращает (rtt в мс, ttl) или бросает asyncio.TimeoutError
+        """
+        seq = self._next_seq()
+        future = self.loop.create_future()
+        self._pending[seq] = (future, address, time.perf_counter())
+        try:
+            self.sock.sendto(self._build_packet(seq), (address, 0))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(seq, None)
+
+    def _on_readable(self):
+        """Читает все доступные ответы и будит ожидающие запросы"""
+        while True:
+            try:
+                data, ancdata, _, addr = self.sock.recvmsg(2048, socket.CMSG_SPACE(4))
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            received_at = time.perf_counter()
+
+            ttl = None
+            for level, cmsg_type, cmsg_data in ancdata:
+                if (level, cmsg_type) in ((socket.IPPROTO_IP, socket.IP_TTL),
+                                          (socket.IPPROTO_IPV6, IPV6_HOPLIMIT)):
+                    ttl = struct.unpack('i', cmsg_data[:4])[0]
+
+            if self.raw and self.family == socket.AF_INET:
+                # Сырой IPv4 сокет отдает пакет вместе с IP заголовком
+                header_len = (data[0] & 0x0f) * 4
+                ttl = data[8]
+                data = data[header_len:]
+
+            if len(data) < 8:
+                continue
+            icmp_type, _, _, ident, seq = struct.unpack('!BBHHH', data[:8])
+            if icmp_type != ICMP_ECHO_REPLY[self.family]:
+                continue
+            if self.raw and ident != self.ident:
+                continue
+
+            pending = self._pending.get(seq)
+            if pending is None:
+                continue
+            future, address, sent_at = pending
+            if addr[0] != address or future.done():
+                continue
+            future.set_result(((received_at - sent_at) * 1000, ttl))
+
+    def close(self):
+        self.loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+        for future, _, _ in self._pending.values():
+            if not future.done():
+                future.cancel()
+        self._pending.clear()
+
+
+def get_pinger(family=socket.AF_INET):
+    """Возвращает общий IcmpPinger текущего event loop для семейства адресов"""
+    loop = asyncio.get_event_loop()
+    pingers = _pingers.setdefault(loop, {})
+    if family not in pingers:
+        pingers[family] = IcmpPinger(family, loop)
+    return pingers[family]
+
+
+def close_pingers():
+    """Закрывает ICMP сокеты текущего event loop"""
+    loop = asyncio.get_event_loop()
+    for pinger in _pingers.pop(loop, {}).values():
+        pinger.close()
+
+
+def _extract_hostname(url):
+    """Извлекаем hostname из URL"""
     if url.startswith(('http://', 'https://')):
-        parsed_url = urlparse(url)
-        hostname = parsed_url.hostname
-    else:
-        hostname = url
+        return urlparse(url).hostname
+    return url
+
+
+async def async_ping_check(url, count=5, interval=PING_INTERVAL, timeout=PING_TIMEOUT):
+    """
+    Настоящий ICMP ping: запросы уходят с интервалом, не дожидаясь ответов
+    на предыдущие, так что одновременно в полете может быть несколько запросов
+    """
+    hostname = _extract_hostname(url)
+    result = ProbeResult(host=hostname)
 
-    # Получаем IP адрес
+    # Получаем IP адрес через общий DNS кэш
     try:
-        ip_address = socket.gethostbyname(hostname)
+        family, result.address = (await resolve_host(hostname))[0]
     except socket.gaierror:
-        print(f"ping: cannot resolve {hostname}: Unknown host")
-        return
+        result.error = f"cannot resolve {hostname}: Unknown host"
+        return result
 
-    print(f"PING {hostname} ({ip_address}) 56(84) bytes of data.")
-
-    success_count = 0
-    ping_times = []
+    try:
+        pinger = get_pinger(family)
+    except OSError as e:
+        result.error = f"ICMP сокет недоступен: {e}"
+        return result
 
-    for i in range(count):
+    async def probe(seq):
+        await asyncio.sleep((seq - 1) * interval)
         try:
-            start_time = time.time()
-            response = requests.get(f"https://{hostname}", timeout=10)
-            end_time = time.time()
+            rtt, ttl = await pinger.ping(result.address, timeout)
+            return seq, rtt, ttl, None
+        except asyncio.TimeoutError:
+            return seq, None, None, "Request timeout"
+        except OSError as e:
+            return seq, None, None, str(e)
 
-            ping_time = (end_time - start_time) * 1000  # в миллисекундах
-            ping_times.append(ping_time)
-            success_count += 1
+    for seq, rtt, ttl, error in await asyncio.gather(*(probe(i + 1) for i in range(count))):
+        if error is None:
+            result.add_reply(seq, rtt, ttl=ttl)
+        else:
+            result.add_failure(seq, error)
 
-            # Форматируем вывод как в ping
-            print(f"64 bytes from {hostname} ({ip_address}): icmp_seq={i + 1} ttl=54 time={ping_time:.1f} ms")
+    return result
 
-        except requests.exceptions.RequestException as e:
-            print(f"From {ip_address} icmp_seq={i + 1} Destination Host Unreachable")
-            ping_times.append(None)
 
-        # Пауза между проверками (как в реальном ping)
-        if i < count - 1:
-            time.sleep(1)
+def print_ping_result(result, out=print):
+    """Печатает ProbeResult в формате системного ping"""
+    if result.error:
+        out(f"ping: {result.error}")
+        return
+
+    out(f"PING {result.host} ({result.address}) 56(84) bytes of data.")
+    for sample in result.samples:
+        if "time" in sample:
+            out(f"64 bytes from {result.host} ({result.address}): icmp_seq={sample['seq']} "
+                f"ttl={sample.get('ttl')} time={sample['time']:.1f} ms")
+        else:
+            out(f"From {result.address} icmp_seq={sample['seq']} {sample['error']}")
 
     # Статистика в формате ping
-    print(f"\n--- {hostname} ping statistics ---")
-    packet_loss = ((count - success_count) / count) * 100
-    print(
-        f"{count} packets transmitted, {success_count} received, {packet_loss:.0f}% packet loss, time {count * 1000}ms")
+    out(f"\n--- {result.host} ping statistics ---")
+    out(f"{result.sent} packets transmitted, {result.received} received, {result.loss:.0f}% packet loss")
+
+    rtt = result.rtt
+    if rtt:
+        out(f"rtt min/avg/max/mdev = {rtt['min']:.3f}/{rtt['avg']:.3f}/{rtt['max']:.3f}/{rtt['mdev']:.3f} ms")
 
-    # Вычисляем статистику RTT
-    successful_pings = [t for t in ping_times if t is not None]
-    if successful_pings:
-        min_time = min(successful_pings)
-        avg_time = statistics.mean(successful_pings)
-        max_time = max(successful_pings)
 
-        # Вычисляем mdev (mean deviation) - среднее отклонение
-        deviations = [abs(t - avg_time) for t in successful_pings]
-        mdev = statistics.mean(deviations) if deviations else 0
+def advanced_ping_check(url, count=5, verbose=False):
+    """
+    Синхронная обертка над async_ping_check (для консоли и потоков агента).
+    Возвращает ProbeResult, с verbose=True печатает вывод в формате ping
+    """
+    async def run():
+        try:
+            return await async_ping_check(url, count)
+        finally:
+            close_pingers()
 
-        print(f"rtt min/avg/max/mdev = {min_time:.3f}/{avg_time:.3f}/{max_time:.3f}/{mdev:.3f} ms")
+    result = asyncio.run(run())
+    if verbose:
+        print_ping_result(result)
+    return result
 
 
 # Основная программа
@@ -74,6 +265,6 @@ if __name__ == "__main__":
     website = input("Введите URL сайта для проверки: ").strip()
 
     if website:
-        advanced_ping_check(website, 5)  # Фиксированное количество проверок = 5
+        advanced_ping_check(website, 5, verbose=True)  # Фиксированное количество проверок = 5
     else:
-        print("Вы не ввели URL сайта")
\ No newline at end of file
+        print("Вы не ввели URL сайта")
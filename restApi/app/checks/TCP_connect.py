@@ -1,72 +1,139 @@
+import asyncio
 import socket
 import time
-import statistics
 from urllib.parse import urlparse
 
+from check_results import ProbeResult
+from dns_cache import resolve_host
 
-def simple_tcp_ping(url, count=5, port=None):
+TCP_CONNECT_TIMEOUT = 10  # таймаут одного подключения, секунды
+TCP_INTERVAL = 1.0  # интервал между попытками к одной цели, секунды
+TCP_SWEEP_CONCURRENCY = 200  # одновременных подключений при обходе портов
+
+
+def _silent(*args, **kwargs):
+    pass
+
+
+def parse_tcp_target(url, port=None):
     """
-    Упрощенная версия TCP ping с возможностью указания порта
+    Извлекает (hostname, port) из URL, "host:port", "[v6]:port" или просто хоста.
+    Явно переданный port имеет приоритет
     """
-    # Извлекаем hostname
     if url.startswith(('http://', 'https://')):
         parsed_url = urlparse(url)
-        hostname = parsed_url.hostname
-        if not port:  # Если порт не указан явно, используем из URL или по умолчанию
-            port = parsed_url.port or (443 if parsed_url.scheme == 'https' else 80)
-    else:
-        hostname = url
-        if not port:
-            port = 80  # Порт по умолчанию
+        # Если порт не указан явно, используем из URL или по умолчанию
+        return parsed_url.hostname, port or parsed_url.port or (443 if parsed_url.scheme == 'https' else 80)
+
+    hostname = url
+    if url.startswith('[') and ']' in url:
+        hostname, _, rest = url[1:].partition(']')
+        if rest.startswith(':') and rest[1:].isdigit():
+            port = port or int(rest[1:])
+    elif url.count(':') == 1:
+        host_part, _, port_part = url.partition(':')
+        if port_part.isdigit():
+            hostname = host_part
+            port = port or int(port_part)
+
+    return hostname, port or 80  # Порт по умолчанию
+
+
+async def tcp_connect_time(family, sockaddr, timeout=TCP_CONNECT_TIMEOUT):
+    """Одно TCP подключение без блокировки event loop, возвращает время в мс"""
+    loop = asyncio.get_event_loop()
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    try:
+        start = time.perf_counter()
+        await asyncio.wait_for(loop.sock_connect(sock, sockaddr), timeout)
+        return (time.perf_counter() - start) * 1000
+    finally:
+        sock.close()
+
+
+async def async_tcp_ping(url, count=5, port=None, interval=TCP_INTERVAL,
+                         timeout=TCP_CONNECT_TIMEOUT, semaphore=None):
+    """
+    Асинхронный TCP ping (IPv4 и IPv6).
+    Попытки уходят с интервалом, не дожидаясь предыдущих; semaphore ограничивает
+    число одновременных подключений, когда проверяется много целей
+    """
+    hostname, port = parse_tcp_target(url, port)
+    result = ProbeResult(host=hostname, port=port)
 
-    # Получаем IP
+    # Получаем IP через общий DNS кэш
     try:
-        ip_address = socket.gethostbyname(hostname)
+        family, result.address = (await resolve_host(hostname))[0]
     except socket.gaierror:
-        print(f"Ошибка: не удается разрешить {hostname}")
-        return
+        result.error = f"не удается разрешить {hostname}"
+        return result
 
-    print(f"TCP PING {hostname} ({ip_address}):{port}")
+    sockaddr = (result.address, port)
 
-    times = []
-    successful = 0
-
-    for i in range(count):
+    async def attempt(seq):
+        await asyncio.sleep((seq - 1) * interval)
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(10)
+            if semaphore is None:
+                return seq, await tcp_connect_time(family, sockaddr, timeout), None
+            async with semaphore:
+                return seq, await tcp_connect_time(family, sockaddr, timeout), None
+        except asyncio.TimeoutError:
+            return seq, None, "timeout"
+        except OSError as e:
+            return seq, None, str(e)
+
+    for seq, elapsed, error in await asyncio.gather(*(attempt(i + 1) for i in range(count))):
+        if error is None:
+            result.add_reply(seq, elapsed)
+        else:
+            result.add_failure(seq, error)
+
+    return result
+
+
+async def tcp_sweep(hosts, ports, count=1, concurrency=TCP_SWEEP_CONCURRENCY,
+                    timeout=TCP_CONNECT_TIMEOUT):
+    """
+    Проверяет все пары host:port параллельно, не более concurrency подключений
+    одновременно. Возвращает список ProbeResult в порядке hosts x ports
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(
+        async_tcp_ping(host, count, port, timeout=timeout, semaphore=semaphore)
+        for host in hosts
+        for port in ports
+    ))
 
-            start = time.time()
-            sock.connect((ip_address, port))
-            elapsed = (time.time() - start) * 1000
-            sock.close()
 
-            times.append(elapsed)
-            successful += 1
-            print(f"tcp_seq={i + 1} connect time={elapsed:.1f} ms")
+def simple_tcp_ping(url, count=5, port=None, verbose=False):
+    """
+    Синхронная обертка над async_tcp_ping (для консоли и потоков агента).
+    Возвращает ProbeResult, с verbose=True печатает вывод в консоль
+    """
+    out = print if verbose else _silent
+    result = asyncio.run(async_tcp_ping(url, count, port))
 
-        except socket.timeout:
-            print(f"tcp_seq={i + 1} timeout")
-            times.append(None)
-        except Exception as e:
-            print(f"tcp_seq={i + 1} failed: {e}")
-            times.append(None)
+    if result.error:
+        out(f"Ошибка: {result.error}")
+        return result
 
-        if i < count - 1:
-            time.sleep(1)
+    out(f"TCP PING {result.host} ({result.address}):{result.port}")
+    for sample in result.samples:
+        if "time" in sample:
+            out(f"tcp_seq={sample['seq']} connect time={sample['time']:.1f} ms")
+        else:
+            out(f"tcp_seq={sample['seq']} failed: {sample['error']}")
 
     # Статистика
-    print(f"\n--- {hostname}:{port} tcp statistics ---")
-    loss = ((count - successful) / count) * 100
-    print(f"{count} attempts, {successful} successful, {loss:.0f}% failure")
+    out(f"\n--- {result.host}:{result.port} tcp statistics ---")
+    out(f"{result.sent} attempts, {result.received} successful, {result.loss:.0f}% failure")
+
+    rtt = result.rtt
+    if rtt:
+        out(f"connect min/avg/max/dev = {rtt['min']:.3f}/{rtt['avg']:.3f}/{rtt['max']:.3f}/{rtt['mdev']:.3f} ms")
 
-    good_times = [t for t in times if t is not None]
-    if good_times:
-        min_t = min(good_times)
-        avg_t = statistics.mean(good_times)
-        max_t = max(good_times)
-        dev_t = statistics.mean([abs(t - avg_t) for t in good_times])
-        print(f"connect min/avg/max/dev = {min_t:.3f}/{avg_t:.3f}/{max_t:.3f}/{dev_t:.3f} ms")
+    return result
 
 
 # Основная программа с выбором порта
@@ -77,6 +144,6 @@ if __name__ == "__main__":
         port_input = input("Порт (по умолчанию автоопределение): ").strip()
         port = int(port_input) if port_input else None
 
-        simple_tcp_ping(website, 5, port)
+        simple_tcp_ping(website, 5, port, verbose=True)
     else:
-        print("Не указан URL")
\ No newline at end of file
+        print("Не указан URL")
@@ -0,0 +1,150 @@
+"""
+Структурированные результаты сетевых проверок.
+Проверки возвращают эти объекты вместо печати в stdout, сервис и агент
+сериализуют их в JSON через to_dict()
+"""
+
+import statistics
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional
+
+# Дедлайны отдельных типов проверок, секунды (общие для сервера и агента)
+CHECK_TIMEOUTS = {
+    "ping": 30,
+    "http": 60,
+    "https": 60,
+    "tcp": 60,
+    "dns": 30,
+    "traceroute": 30,
+}
+DEFAULT_CHECK_TIMEOUT = 60
+
+def rtt_stats(times) -> Optional[Dict[str, float]]:
+    """Считает min/avg/max/mdev (мс) по успешным замерам, None если замеров нет"""
+    good = [t for t in times if t is not None]
+    if not good:
+        return None
+
+    avg = statistics.mean(good)
+    # mdev - среднее отклонение, как в выводе ping
+    mdev = statistics.mean([abs(t - avg) for t in good])
+    return {
+        "min": round(min(good), 3),
+        "avg": round(avg, 3),
+        "max": round(max(good), 3),
+        "mdev": round(mdev, 3),
+    }
+
+
+def _compact(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Убирает пустые поля, чтобы JSON был компактнее"""
+    return {key: value for key, value in data.items() if value is not None}
+
+
+@dataclass
+class ProbeResult:
+    """Результат серии замеров: ping, tcp, http"""
+    host: str
+    address: Optional[str] = None
+    port: Optional[int] = None
+    samples: List[Dict[str, Any]] = field(default_factory=list)
+    codes: Optional[Dict[str, int]] = None
+    error: Optional[str] = None
+
+    def add_reply(self, seq: int, time_ms: float, **extra):
+        """Успешный замер: время в миллисекундах и доп. поля (ttl, status, size)"""
+        self.samples.append({"seq": seq, "time": round(time_ms, 3), **extra})
+        status = extra.get("status")
+        if status is not None:
+            if self.codes is None:
+                self.codes = {}
+            self.codes[str(status)] = self.codes.get(str(status), 0) + 1
+
+    def add_failure(self, seq: int, error: str):
+        """Неудачный замер"""
+        self.samples.append({"seq": seq, "error": error})
+
+    @property
+    def sent(self) -> int:
+        return len(self.samples)
+
+    @property
+    def received(self) -> int:
+        return sum(1 for sample in self.samples if "time" in sample)
+
+    @property
+    def loss(self) -> float:
+        if not self.samples:
+            return 100.0
+        return round((self.sent - self.received) / self.sent * 100, 1)
+
+    @property
+    def rtt(self) -> Optional[Dict[str, float]]:
+        return rtt_stats([sample.get("time") for sample in self.samples])
+
+    @property
+    def success(self) -> bool:
+        # Все замеры потеряны - хост недоступен, даже если ошибки проверки не было
+        return self.error is None and self.received > 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return _compact({
+            "host": self.host,
+            "address": self.address,
+            "port": self.port,
+            "sent": self.sent,
+            "received": self.received,
+            "loss": self.loss,
+            "rtt": self.rtt,
+            "codes": self.codes,
+            "samples": self.samples,
+            "error": self.error,
+        })
+
+
+@dataclass
+class DnsResult:
+    """Результат DNS проверки: записи по типам и ошибки по типам"""
+    domain: str
+    dns_server: str = "system"
+    records: Dict[str, List[str]] = field(default_factory=dict)
+    errors: Dict[str, str] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def success(self) -> bool:
+        return self.error is None and bool(self.records)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        if not data["errors"]:
+            data["errors"] = None
+        return _compact(data)
+
+
+@dataclass
+class TracerouteResult:
+    """Результат трассировки: список прыжков"""
+    target: str
+    address: Optional[str] = None
+    hops: List[Dict[str, Any]] = field(default_factory=list)
+    reached: bool = False
+    error: Optional[str] = None
+
+    def add_hop(self, ttl: int, address: Optional[str] = None, host: Optional[str] = None, rtt=None,
+                error: Optional[str] = None):
+        """Добавляет прыжок; address None означает, что ответа не было, error - что пробу не удалось отправить"""
+        self.hops.append(_compact({
+            "ttl": ttl,
+            "address": address,
+            "host": host if host != address else None,
+            "rtt": [round(t, 3) for t in rtt] if rtt else None,
+            "error": error,
+        }))
+
+    @property
+    def success(self) -> bool:
+        return self.error is None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return _compact(asdict(self))
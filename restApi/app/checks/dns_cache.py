@@ -0,0 +1,200 @@
+"""
+Общий для всех проверок кэш DNS ответов.
+Ключ - (имя, тип записи, DNS сервер). Учитывает TTL записей, кэширует
+отрицательные ответы (NXDOMAIN, NoAnswer), ограничен по размеру (LRU)
+и объединяет одновременные запросы одного имени в один
+"""
+
+import asyncio
+import ipaddress
+import socket
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import dns.asyncresolver
+import dns.exception
+import dns.rdatatype
+import dns.resolver
+
+DNS_CACHE_SIZE = 10000  # максимум записей в кэше
+NEGATIVE_TTL = 60  # TTL отрицательного ответа, если в нем нет SOA, секунды
+MAX_TTL = 3600  # верхняя граница TTL, секунды
+HOSTS_TTL = 300  # TTL ответов системного резолвера (/etc/hosts и т.п.), секунды
+
+# Долгоживущие асинхронные резолверы по DNS серверу (None - системный)
+_async_resolvers = {}
+
+
+def get_async_resolver(dns_server=None):
+    """Возвращает долгоживущий асинхронный Resolver для сервера (None - системный)"""
+    resolver = _async_resolvers.get(dns_server)
+    if resolver is None:
+        resolver = dns.asyncresolver.Resolver()
+        if dns_server:
+            resolver.nameservers = [dns_server]
+        _async_resolvers[dns_server] = resolver
+    return resolver
+
+
+def _negative_ttl(error):
+    """TTL отрицательного ответа: минимум из TTL и MINIMUM записи SOA в authority"""
+    responses = list(error.kwargs.get('responses', {}).values())
+    if error.kwargs.get('response') is not None:
+        responses.append(error.kwargs['response'])
+
+    for response in responses:
+        for rrset in getattr(response, 'authority', []):
+            if rrset.rdtype == dns.rdatatype.SOA and len(rrset):
+                return min(rrset.ttl, rrset[0].minimum, MAX_TTL)
+    return NEGATIVE_TTL
+
+
+class CachedError:
+    """
+    Отрицательный ответ в кэше: тип и текст исключения. На каждое попадание
+    создается новое исключение - повторный raise одного экземпляра наращивал бы
+    его __traceback__, пока запись живет
+    """
+
+    __slots__ = ("type", "args")
+
+    def __init__(self, error):
+        self.type = type(error)
+        # dnspython хранит подробности в kwargs (вместе с ответами сервера) - берем только текст
+        self.args = error.args or (str(error),)
+
+    def exception(self):
+        try:
+            return self.type(*self.args)
+        except Exception:
+            return dns.exception.DNSException(*self.args)
+
+
+class DnsCache:
+    """Потокобезопасный LRU кэш DNS ответов с учетом TTL"""
+
+    def __init__(self, max_size=DNS_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # ключ -> (время истечения, значение или CachedError)
+        self._lock = threading.Lock()
+        # Запросы в полете отдельно для каждого event loop (агент запускает проверки в потоках)
+        self._inflight = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Возвращает (True, значение) для живой записи или (False, None)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def put(self, key, value, ttl):
+        """Сохраняет значение (или CachedError для отрицательного ответа) на ttl секунд"""
+        ttl = min(ttl, MAX_TTL)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    async def lookup(self, key, fetch):
+        """
+        Возвращает значение из кэша или вызывает fetch() -> (значение, ttl).
+        Одновременные запросы одного ключа ждут один и тот же fetch
+        """
+        found, value = self.get(key)
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+            loop = asyncio.get_event_loop()
+            inflight = self._inflight.setdefault(loop, {})
+            task = inflight.get(key)
+            if task is None:
+                task = loop.create_task(self._fetch(key, fetch))
+                inflight[key] = task
+                task.add_done_callback(lambda _: inflight.pop(key, None))
+            # shield: отмена одного ожидающего не отменяет общий запрос
+            value = await asyncio.shield(task)
+
+        if isinstance(value, CachedError):
+            raise value.exception()
+        return value
+
+    async def _fetch(self, key, fetch):
+        value, ttl = await fetch()
+        if isinstance(value, Exception):
+            value = CachedError(value)
+        self.put(key, value, ttl)
+        return value
+
+    async def resolve(self, name, rdtype='A', dns_server=None):
+        """DNS запрос через кэш, возвращает список записей строками"""
+        name = name.lower().rstrip('.')
+
+        async def fetch():
+            try:
+                answer = await get_async_resolver(dns_server).resolve(name, rdtype)
+            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+                return e, _negative_ttl(e)
+            return [str(rdata) for rdata in answer], answer.rrset.ttl
+
+        return await self.lookup((name, rdtype, dns_server), fetch)
+
+
+# Общий кэш процесса
+dns_cache = DnsCache()
+
+
+async def _addresses(hostname, rdtype):
+    try:
+        return await dns_cache.resolve(hostname, rdtype)
+    except dns.exception.DNSException:
+        return []
+
+
+async def resolve_host(hostname):
+    """
+    Разрешает имя хоста в список (family, address) через общий кэш.
+    A и AAAA запрашиваются параллельно; если DNS ничего не вернул, используется
+    системный резолвер (например, для имен из /etc/hosts). Бросает socket.gaierror
+    """
+    try:
+        address = ipaddress.ip_address(hostname)
+        return [(socket.AF_INET if address.version == 4 else socket.AF_INET6, hostname)]
+    except ValueError:
+        pass
+
+    ipv4, ipv6 = await asyncio.gather(_addresses(hostname, 'A'), _addresses(hostname, 'AAAA'))
+    addresses = [(socket.AF_INET, a) for a in ipv4] + [(socket.AF_INET6, a) for a in ipv6]
+    if addresses:
+        return addresses
+
+    async def fetch():
+        loop = asyncio.get_event_loop()
+        try:
+            infos = await loop.getaddrinfo(hostname, None, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            return e, NEGATIVE_TTL
+        unique = list(dict.fromkeys((family, sockaddr[0]) for family, _, _, _, sockaddr in infos))
+        return unique, HOSTS_TTL
+
+    return await dns_cache.lookup((hostname.lower(), 'getaddrinfo', None), fetch)
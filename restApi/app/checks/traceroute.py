@@ -1,8 +1,43 @@
+import asyncio
+import random
+import re
+import socket
+import struct
 import subprocess
 import platform
 import sys
+import time
 from urllib.parse import urlparse
 
+from check_results import TracerouteResult
+from dns_cache import resolve_host
+
+TRACE_TIMEOUT = 3.0  # ожидание ответов после отправки всех проб, секунды
+TRACE_PROBES = 1  # проб на один прыжок
+TRACE_PAYLOAD_SIZE = 32
+
+ICMP_ECHO_REQUEST = {socket.AF_INET: 8, socket.AF_INET6: 128}
+ICMP_ECHO_REPLY = {socket.AF_INET: 0, socket.AF_INET6: 129}
+ICMP_PROTO = {socket.AF_INET: socket.IPPROTO_ICMP, socket.AF_INET6: socket.IPPROTO_ICMPV6}
+# Time exceeded и destination unreachable
+ICMP_ERRORS = {socket.AF_INET: (11, 3), socket.AF_INET6: (3, 1)}
+
+# Linux константы для очереди ошибок непривилегированного ICMP сокета
+IP_RECVERR = getattr(socket, 'IP_RECVERR', 11)
+IPV6_RECVERR = getattr(socket, 'IPV6_RECVERR', 25)
+MSG_ERRQUEUE = getattr(socket, 'MSG_ERRQUEUE', 0x2000)
+SOCK_EXTENDED_ERR = struct.Struct('=IBBBBII')
+
+# Строка прыжка: номер и остаток ("1  gw (10.0.0.1)  0.4 ms" или "1  <1 ms  <1 ms  <1 ms  10.0.0.1")
+HOP_LINE_RE = re.compile(r'^\s*(\d+)\s+(.*)$')
+HOST_ADDR_RE = re.compile(r'(\S+)\s+\(([0-9a-fA-F.:]+)\)')
+BARE_ADDR_RE = re.compile(r'\b(\d{1,3}(?:\.\d{1,3}){3}|[0-9a-fA-F]*:[0-9a-fA-F:]+)\b')
+RTT_RE = re.compile(r'<?([\d.]+)\s*(?:ms|мс)')
+HEADER_ADDR_RE = re.compile(r'\(([0-9a-fA-F.:]+)\)|\[([0-9a-fA-F.:]+)\]')
+
+def _silent(*args, **kwargs):
+    pass
+
 def normalize_hostname(hostname):
     """Извлекает hostname из URL если необходимо"""
     if hostname.startswith(('http://', 'https://')):
@@ -30,16 +65,336 @@ def fix_encoding(text):
     except:
         return text
 
-def execute_traceroute(hostname, max_hops=30):
+def parse_traceroute_output(text, result):
+    """Разбирает вывод traceroute/tracert в прыжки TracerouteResult"""
+    for line in text.splitlines():
+        match = HOP_LINE_RE.match(line)
+        if not match:
+            if result.address is None:
+                header = HEADER_ADDR_RE.search(line)
+                if header:
+                    result.address = header.group(1) or header.group(2)
+            continue
+        
+        ttl, rest = int(match.group(1)), match.group(2)
+        rtt = [float(value) for value in RTT_RE.findall(rest)]
+        
+        host_addr = HOST_ADDR_RE.search(rest)
+        if host_addr:
+            host, address = host_addr.group(1), host_addr.group(2)
+        else:
+            bare = BARE_ADDR_RE.search(RTT_RE.sub('', rest))
+            host = address = bare.group(1) if bare else None
+        
+        result.add_hop(ttl, address, host, rtt)
+    
+    if result.hops and result.address:
+        result.reached = result.hops[-1].get('address') == result.address
+    return result
+
+def icmp_checksum(data):
+    """Контрольная сумма ICMP (RFC 1071)"""
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+class IcmpTracer:
+    """
+    Движок трассировки на одном ICMP сокете.
+    Echo запросы с разным TTL отправляются все сразу, ответы (time exceeded,
+    unreachable, echo reply) сопоставляются с пробами по номеру последовательности.
+    Paris-стиль: номер компенсируется в полезной нагрузке, поэтому контрольная
+    сумма, а значит и хэш потока у балансировщиков, одинаковы для всех проб
+    """
+    
+    def __init__(self, family, address, on_hop, loop=None):
+        self.family = family
+        self.address = address
+        self.on_hop = on_hop
+        self.loop = loop or asyncio.get_event_loop()
+        
+        try:
+            self.sock = socket.socket(family, socket.SOCK_DGRAM, ICMP_PROTO[family])
+            self.raw = False
+            # Ошибки ICMP для непривилегированного сокета приходят в очередь ошибок
+            if family == socket.AF_INET:
+                self.sock.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+            else:
+                self.sock.setsockopt(socket.IPPROTO_IPV6, IPV6_RECVERR, 1)
+        except OSError:
+            self.sock = socket.socket(family, socket.SOCK_RAW, ICMP_PROTO[family])
+            self.raw = True
+        
+        self.sock.setblocking(False)
+        self.ident = random.getrandbits(16)
+        self._seq = 0
+        self._pending = {}  # seq -> (ttl, время отправки)
+        try:
+            self.loop.add_reader(self.sock.fileno(), self._on_readable)
+        except Exception:
+            self.sock.close()
+            raise
+    
+    def _build_packet(self, seq):
+        icmp_type = ICMP_ECHO_REQUEST[self.family]
+        # seq + (0xffff - seq) дает постоянную сумму в обратном коде
+        payload = struct.pack('!H', 0xffff - seq) + b'\x00' * (TRACE_PAYLOAD_SIZE - 2)
+        header = struct.pack('!BBHHH', icmp_type, 0, 0, self.ident, seq)
+        checksum = icmp_checksum(header + payload)
+        return struct.pack('!BBHHH', icmp_type, 0, checksum, self.ident, seq) + payload
+    
+    def send(self, ttl):
+        """Отправляет одну пробу с заданным TTL"""
+        self._seq = (self._seq + 1) & 0xffff
+        seq = self._seq
+        if self.family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+        else:
+            self.sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_UNICAST_HOPS, ttl)
+        self._pending[seq] = (ttl, time.perf_counter())
+        try:
+            self.sock.sendto(self._build_packet(seq), (self.address, 0))
+        except OSError:
+            del self._pending[seq]
+            raise
+    
+    def _match(self, seq, hop_address, reached):
+        """Сообщает о прыжке, если seq принадлежит нашей пробе"""
+        pending = self._pending.pop(seq, None)
+        if pending is None:
+            return
+        ttl, sent_at = pending
+        rtt = (time.perf_counter() - sent_at) * 1000
+        self.on_hop({"ttl": ttl, "address": hop_address, "rtt": rtt, "reached": reached})
+    
+    def _on_readable(self):
+        """Читает ответы и очередь ошибок сокета"""
+        if not self.raw:
+            self._drain_error_queue()
+        
+        for _ in range(1024):
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # Непривилегированный сокет один раз сообщает об ошибке ICMP через recv
+                continue
+            
+            if self.raw and self.family == socket.AF_INET:
+                data = data[(data[0] & 0x0f) * 4:]
+            self._handle_icmp(data, addr[0])
+    
+    def _handle_icmp(self, data, source):
+        if len(data) < 8:
+            return
+        icmp_type, _, _, ident, seq = struct.unpack('!BBHHH', data[:8])
+        
+        if icmp_type == ICMP_ECHO_REPLY[self.family]:
+            # Для непривилегированного сокета ядро само фильтрует по идентификатору
+            if not self.raw or ident == self.ident:
+                self._match(seq, source, True)
+            return
+        
+        if not self.raw or icmp_type not in ICMP_ERRORS[self.family]:
+            return
+        
+        # В ошибке ICMP вложен заголовок исходного пакета и 8 байт нашего echo
+        inner = data[8:]
+        if self.family == socket.AF_INET:
+            if not inner:
+                return
+            inner = inner[(inner[0] & 0x0f) * 4:]
+        else:
+            inner = inner[40:]
+        if len(inner) < 8:
+            return
+        inner_type, _, _, inner_ident, inner_seq = struct.unpack('!BBHHH', inner[:8])
+        if inner_type == ICMP_ECHO_REQUEST[self.family] and inner_ident == self.ident:
+            self._match(inner_seq, source, source == self.address)
+    
+    def _drain_error_queue(self):
+        """Разбирает time exceeded / unreachable из очереди ошибок (IP_RECVERR)"""
+        for _ in range(1024):
+            try:
+                data, ancdata, _, _ = self.sock.recvmsg(2048, 512, MSG_ERRQUEUE)
+            except (BlockingIOError, InterruptedError, OSError):
+                return
+            if len(data) < 8:
+                continue
+            seq = struct.unpack('!H', data[6:8])[0]
+            
+            for level, cmsg_type, cmsg_data in ancdata:
+                if (level, cmsg_type) not in ((socket.IPPROTO_IP, IP_RECVERR),
+                                              (socket.IPPROTO_IPV6, IPV6_RECVERR)):
+                    continue
+                offender = cmsg_data[SOCK_EXTENDED_ERR.size:]
+                if len(offender) < 2:
+                    continue
+                offender_family = struct.unpack('=H', offender[:2])[0]
+                if offender_family == socket.AF_INET:
+                    hop_address = socket.inet_ntop(socket.AF_INET, offender[4:8])
+                elif offender_family == socket.AF_INET6:
+                    hop_address = socket.inet_ntop(socket.AF_INET6, offender[8:24])
+                else:
+                    continue
+                self._match(seq, hop_address, hop_address == self.address)
+    
+    def close(self):
+        self.loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+
+async def trace_hops(hostname, max_hops=30, timeout=TRACE_TIMEOUT, probes=TRACE_PROBES):
+    """
+    Асинхронный генератор прыжков в порядке прихода ответов.
+    Пробы для всех TTL уходят сразу, поэтому трассировка укладывается
+    примерно в одно окно timeout вместо max_hops x timeout.
+    Первым отдает {"address": ...} цели, когда сокет уже открыт, затем словари
+    прыжков {ttl, address, rtt, reached}; проба, которую не удалось отправить,
+    приходит прыжком с error вместо rtt
+    """
+    family, address = (await resolve_host(normalize_hostname(hostname)))[0]
+    
+    loop = asyncio.get_event_loop()
+    queue = asyncio.Queue()
+    tracer = IcmpTracer(family, address, queue.put_nowait, loop)
+    try:
+        yield {"address": address}
+        
+        for ttl in range(1, max_hops + 1):
+            for _ in range(probes):
+                try:
+                    tracer.send(ttl)
+                except OSError as e:
+                    # Ошибка одной пробы (например, sendto на этом TTL) - прыжок с ошибкой, трассировка идет дальше
+                    queue.put_nowait({"ttl": ttl, "address": None, "error": str(e), "reached": False})
+        
+        deadline = loop.time() + timeout
+        answered = {}  # ttl -> число ответов
+        reached_ttl = None
+        
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                hop = await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            
+            # Цель отвечает и на пробы с TTL больше ее расстояния - их отбрасываем
+            if reached_ttl is not None and hop["ttl"] > reached_ttl:
+                continue
+            if hop["reached"]:
+                reached_ttl = hop["ttl"] if reached_ttl is None else min(reached_ttl, hop["ttl"])
+            answered[hop["ttl"]] = answered.get(hop["ttl"], 0) + 1
+            yield hop
+            
+            last_ttl = reached_ttl or max_hops
+            if all(answered.get(ttl, 0) >= probes for ttl in range(1, last_ttl + 1)):
+                break
+    finally:
+        tracer.close()
+
+async def async_traceroute(hostname, max_hops=30, timeout=TRACE_TIMEOUT, probes=TRACE_PROBES, on_hop=None):
+    """
+    Нативная трассировка без внешней утилиты. Возвращает TracerouteResult.
+    on_hop(result) вызывается после каждого пришедшего прыжка с текущим частичным результатом
+    """
+    target = normalize_hostname(hostname)
+    result = TracerouteResult(target=target)
+    hops = {}  # ttl -> (address, [rtt], ошибка отправки)
+    
+    def build(partial, final=False):
+        # Промежуточный результат - до последнего ответившего прыжка, итоговый без цели - до max_hops
+        last_ttl = max(hops, default=0)
+        if final and not partial.reached:
+            last_ttl = max_hops
+        for ttl in range(1, last_ttl + 1):
+            address, rtts, error = hops.get(ttl, (None, None, None))
+            partial.add_hop(ttl, address, None, rtts, error if address is None else None)
+        return partial
+    
+    try:
+        async for hop in trace_hops(target, max_hops, timeout, probes):
+            if "ttl" not in hop:
+                result.address = hop["address"]
+                continue
+            if "error" in hop:
+                hops.setdefault(hop["ttl"], (None, [], hop["error"]))
+            else:
+                address, rtts, error = hops.get(hop["ttl"], (None, [], None))
+                rtts.append(hop["rtt"])
+                hops[hop["ttl"]] = (address or hop["address"], rtts, None)
+            if hop["reached"]:
+                result.reached = True
+                # Прыжки дальше цели - ответы самой цели на пробы с большим TTL
+                for ttl in [t for t in hops if t > hop["ttl"]]:
+                    del hops[ttl]
+            if on_hop:
+                on_hop(build(TracerouteResult(target=target, address=result.address, reached=result.reached)))
+    except socket.gaierror:
+        result.error = f"cannot resolve {target}: Unknown host"
+        return result
+    except (OSError, NotImplementedError) as e:
+        if result.address is not None:
+            # Сокет уже был открыт - отдаем собранные прыжки с ошибкой, а не запускаем трассировку заново
+            result.error = str(e)
+            return build(result)
+        # ICMP сокет недоступен (нет прав или event loop без add_reader) - системная утилита
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, system_traceroute, target, max_hops)
+    
+    return build(result, final=True)
+
+def print_traceroute_result(result, out=print):
+    """Печатает TracerouteResult в формате traceroute"""
+    if result.error:
+        out(f"Ошибка: {result.error}")
+        return
+    
+    for hop in result.hops:
+        if "address" in hop:
+            rtts = "  ".join(f"{t:.3f} ms" for t in hop.get("rtt", []))
+            out(f"{hop['ttl']:2d}  {hop['address']}  {rtts}")
+        elif "error" in hop:
+            out(f"{hop['ttl']:2d}  !  {hop['error']}")
+        else:
+            out(f"{hop['ttl']:2d}  *")
+
+def execute_traceroute(hostname, max_hops=30, verbose=False):
+    """
+    Выполняет трассировку маршрута к указанному хосту (синхронная обертка для консоли и агента).
+    Возвращает TracerouteResult, с verbose=True печатает вывод в консоль
+    """
+    target = normalize_hostname(hostname)
+    if verbose:
+        print(f"\nTRACEROUTE {target}")
+        print(f"Максимум прыжков: {max_hops}")
+        print("─" * 60)
+    
+    result = asyncio.run(async_traceroute(target, max_hops))
+    if verbose:
+        print_traceroute_result(result)
+    return result
+
+def system_traceroute(hostname, max_hops=30, verbose=False):
     """
-    Выполняет трассировку маршрута к указанному хосту
+    Трассировка через системную утилиту traceroute/tracert.
+    Используется, когда ICMP сокет недоступен. Возвращает TracerouteResult
     """
+    out = print if verbose else _silent
+    
     # Подготовка параметров
     target = normalize_hostname(hostname)
+    result = TracerouteResult(target=target)
     
-    print(f"\nTRACEROUTE {target}")
-    print(f"Максимум прыжков: {max_hops}")
-    print("─" * 60)
+    out(f"\nTRACEROUTE {target}")
+    out(f"Максимум прыжков: {max_hops}")
+    out("─" * 60)
     
     try:
         # Формируем команду
@@ -47,7 +402,7 @@ def execute_traceroute(hostname, max_hops=30):
         
         # Выполняем команду с правильной кодировкой
         if platform.system().lower() == "windows":
-            result = subprocess.run(
+            completed = subprocess.run(
                 command,
                 capture_output=True,
                 text=True,
@@ -55,7 +410,7 @@ def execute_traceroute(hostname, max_hops=30):
                 timeout=120
             )
         else:
-            result = subprocess.run(
+            completed = subprocess.run(
                 command,
                 capture_output=True,
                 text=True,
@@ -64,39 +419,45 @@ def execute_traceroute(hostname, max_hops=30):
             )
         
         # Обрабатываем результат
-        if result.returncode == 0:
-            output = fix_encoding(result.stdout)
-            print(output)
-            return True
+        if completed.returncode == 0:
+            output = fix_encoding(completed.stdout)
+            out(output)
+            return parse_traceroute_output(output, result)
         else:
-            error_msg = fix_encoding(result.stderr)
+            error_msg = fix_encoding(completed.stderr)
             if "не найден" in error_msg or "not found" in error_msg:
-                print("Ошибка: Команда traceroute/tracert не найдена")
-                print("Убедитесь, что traceroute установлен в системе")
+                result.error = "Команда traceroute/tracert не найдена"
+                out("Ошибка: Команда traceroute/tracert не найдена")
+                out("Убедитесь, что traceroute установлен в системе")
             else:
-                print(f"Ошибка выполнения: {error_msg}")
-            return False
+                result.error = f"Ошибка выполнения: {error_msg}"
+                out(result.error)
+            return result
             
     except subprocess.TimeoutExpired:
-        print("Таймаут: трассировка заняла слишком много времени")
-        return False
+        result.error = "Таймаут: трассировка заняла слишком много времени"
+        out(result.error)
+        return result
     except FileNotFoundError:
-        print("Ошибка: Команда traceroute/tracert недоступна")
-        print("\nДля установки:")
+        result.error = "Команда traceroute/tracert недоступна"
+        out(f"Ошибка: {result.error}")
+        out("\nДля установки:")
         if platform.system().lower() == "windows":
-            print("• Traceroute встроен в Windows как 'tracert'")
+            out("• Traceroute встроен в Windows как 'tracert'")
         else:
-            print("• Ubuntu/Debian: sudo apt install traceroute")
-            print("• CentOS/RHEL: sudo yum install traceroute")
-            print("• macOS: предустановлен")
-        return False
+            out("• Ubuntu/Debian: sudo apt install traceroute")
+            out("• CentOS/RHEL: sudo yum install traceroute")
+            out("• macOS: предустановлен")
+        return result
     except UnicodeDecodeError as e:
-        print(f"Ошибка кодировки: {e}")
-        print("Попробуйте изменить настройки консоли")
-        return False
+        result.error = f"Ошибка кодировки: {e}"
+        out(result.error)
+        out("Попробуйте изменить настройки консоли")
+        return result
     except Exception as error:
-        print(f"Неожиданная ошибка: {error}")
-        return False
+        result.error = f"Неожиданная ошибка: {error}"
+        out(result.error)
+        return result
 
 def main():
     """Основная функция программы"""
@@ -129,7 +490,7 @@ def main():
             max_hops = 30
     
     # Выполняем трассировку
-    success = execute_traceroute(target, max_hops)
+    success = execute_traceroute(target, max_hops, verbose=True).success
     
     # Итоговое сообщение
     if success:
@@ -141,7 +502,7 @@ def main():
 def execute_traceroute_windows_fixed(hostname, max_hops=30):
     """Версия для Windows с исправлением кодировки через chcp"""
     if platform.system().lower() != "windows":
-        return execute_traceroute(hostname, max_hops)
+        return execute_traceroute(hostname, max_hops, verbose=True)
     
     target = normalize_hostname(hostname)
     
@@ -214,4 +575,4 @@ if __name__ == "__main__":
             execute_traceroute_windows_fixed(target)
         else:
             # Для Linux/Mac используем стандартную версию
-            execute_traceroute(target)
\ No newline at end of file
+            execute_traceroute(target, verbose=True)
\ No newline at end of file
@@ -1,7 +1,28 @@
+import asyncio
+import hashlib
+
+from aiohttp import web
+
 from agent_database import agent_db
+from app.json_codec import PayloadCache, loads
+from app.services.agent_channels import AgentChannels
+from app.services.agent_events import AgentEvents
+from app.services.agent_index import AgentIndex
+from app.services.agent_liveness import AgentLiveness
+from app.services.heartbeat_buffer import HeartbeatBuffer
 
 # Глобальный экземпляр базы данных
 _db = None
+# Глобальный буфер heartbeat
+_heartbeats = None
+# Глобальный индекс агентов по токену
+_agent_index = None
+# Глобальный реестр WebSocket каналов агентов
+_agent_channels = None
+# Глобальный автомат статусов агентов
+_liveness = None
+# Глобальные подписки на переходы статусов агентов
+_agent_events = None
 
 def get_db():
     """Получить или создать экземпляр базы данных"""
@@ -10,15 +31,176 @@ def get_db():
         _db = agent_db()
     return _db
 
-async def get_agents(app):
-    """Получить список агентов"""
+def get_heartbeats():
+    """Получить или создать буфер heartbeat"""
+    global _heartbeats
+    if _heartbeats is None:
+        _heartbeats = HeartbeatBuffer(get_db())
+        _heartbeats.listeners.append(get_liveness().seen)
+    return _heartbeats
+
+def get_liveness():
+    """Получить или создать автомат статусов агентов"""
+    global _liveness
+    if _liveness is None:
+        _liveness = AgentLiveness(get_db())
+        _liveness.listeners.append(get_agent_events().publish)
+    return _liveness
+
+def get_agent_events():
+    """Получить или создать подписки на события агентов"""
+    global _agent_events
+    if _agent_events is None:
+        _agent_events = AgentEvents()
+    return _agent_events
+
+def get_agent_index():
+    """Получить или создать индекс агентов"""
+    global _agent_index
+    if _agent_index is None:
+        _agent_index = AgentIndex(get_db())
+    return _agent_index
+
+def get_agent_channels():
+    """Получить или создать реестр каналов агентов"""
+    from app.handlers.check_handler import get_check_service
+    
+    global _agent_channels
+    if _agent_channels is None:
+        _agent_channels = AgentChannels(get_check_service(), get_heartbeats())
+    return _agent_channels
+
+async def close_agent_channels(app):
+    """Закрыть WebSocket каналы агентов (on_shutdown приложения)"""
+    global _agent_channels
+    if _agent_channels is not None:
+        await _agent_channels.close()
+        _agent_channels = None
+
+async def close_agent_events(app):
+    """Завершить SSE потоки событий агентов (on_shutdown приложения)"""
+    if _agent_events is not None:
+        _agent_events.close()
+
+async def start_agents(app):
+    """Загрузить индекс и статусы агентов, запустить сброс heartbeat (on_startup приложения)"""
+    index = get_agent_index()
+    await index.load()
+    liveness = get_liveness()
+    liveness.load(index.agents())
+    liveness.start()
+    get_heartbeats().start()
+
+async def close_db(app):
+    """Сбросить heartbeat и закрыть соединения с базой агентов (on_cleanup приложения)"""
+    global _db, _heartbeats, _agent_index, _liveness
+    # Сначала статусы stale/offline, затем heartbeat: более свежий active записывается последним
+    if _liveness is not None:
+        await _liveness.close()
+        _liveness = None
+    if _heartbeats is not None:
+        await _heartbeats.close()
+        _heartbeats = None
+    _agent_index = None
+    if _db is not None:
+        _db.close()
+        _db = None
+
+# Размер страницы списка агентов
+DEFAULT_AGENTS_LIMIT = 100
+MAX_AGENTS_LIMIT = 1000
+
+def parse_agents_query(params):
+    """Параметры списка агентов: (after, limit, status, location), ValueError при ошибке"""
+    try:
+        limit = int(params.get('limit', DEFAULT_AGENTS_LIMIT))
+        after = int(params.get('after', 0))
+    except ValueError:
+        raise ValueError("limit и after должны быть числами")
+    if after < 0:
+        raise ValueError("after не может быть отрицательным")
+    limit = max(1, min(limit, MAX_AGENTS_LIMIT))
+    return after, limit, params.get('status') or None, params.get('location') or None
+
+def agents_etag(query):
+    """
+    ETag страницы списка агентов без обращения к базе: версия таблицы (наибольший
+    updated_at), ревизии еще не записанных heartbeat и статусов, параметры запроса
+    """
+    key = f"{get_db().version}|{get_heartbeats().revision}|{get_liveness().revision}|{query}"
+    return 'W/"' + hashlib.blake2b(key.encode(), digest_size=8).hexdigest() + '"'
+
+async def get_agents(query, app):
+    """
+    Получить страницу списка агентов.
+    query - результат parse_agents_query; next_after - курсор следующей страницы
+    (None на последней), total - число агентов с теми же фильтрами
+    """
+    after, limit, status, location = query
     db = get_db()
-    agents = db.get_all_agents()
-    return {"agents": agents}
+    heartbeats = get_heartbeats()
+    liveness = get_liveness()
+    if status is not None:
+        # Фильтр по статусу выполняет база: сначала записываем еще не сохраненные
+        # переходы и heartbeat, чтобы страница и total совпадали с текущими статусами
+        await liveness.flush()
+        await heartbeats.flush_all()
+    agents, next_after = await db.async_list_agents(after, limit, status, location)
+    total = await db.async_count_agents(status, location)
+    agents = [liveness.apply(heartbeats.apply(agent)) for agent in agents]
+    return {"agents": agents, "next_after": next_after, "total": total}
+
+# Закодированные страницы списка агентов по ETag: пока версия не изменилась,
+# повторный запрос отдает готовые байты, а запрос с If-None-Match - 304
+AGENTS_PAYLOAD_TTL = 60.0
+_agents_payload = PayloadCache(64 * 1024 * 1024, AGENTS_PAYLOAD_TTL)
+
+async def get_agents_summary(app):
+    """Число агентов по статусам (из памяти, без обращения к базе)"""
+    return get_liveness().summary()
+
+async def stream_agent_events(request):
+    """
+    SSE поток статусов агентов: snapshot (сводка по статусам, как в /api/agents/summary),
+    затем transition ({agent_id, from, to, at}) на каждый переход active/stale/offline
+    """
+    from app.handlers.check_handler import SSE_KEEPALIVE, _sse_event
+    
+    liveness = get_liveness()
+    events = get_agent_events()
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+    })
+    # Подписываемся до отправки snapshot, чтобы не пропустить переходы
+    queue = events.subscribe()
+    try:
+        await response.prepare(request)
+        await response.write(_sse_event("snapshot", liveness.summary()))
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                await response.write(b": keepalive\n\n")
+                continue
+            if event is None:
+                break  # сервер останавливается или клиент отстал
+            await response.write(_sse_event("transition", event))
+    except ConnectionResetError:
+        pass  # клиент закрыл поток
+    finally:
+        events.unsubscribe(queue)
+    return response
+
+async def get_agents_payload(query, etag, app):
+    """Страница списка агентов, закодированная в JSON (из кеша, если ETag не изменился)"""
+    payload = _agents_payload.get(etag)
+    if payload is None:
+        payload = _agents_payload.put(etag, await get_agents(query, app))
+    return payload
 
 async def update_heartbeat(data, app):
     """Обновить heartbeat агента"""
-    db = get_db()
     agent_id = data.get('agent_id')
     token = data.get('token')
     
@@ -27,18 +209,22 @@ async def update_heartbeat(data, app):
     
     if token:
         # Найти агента по токену
-        agent = db.get_agent_by_token(token)
+        agent = await get_agent_index().get_by_token(token)
         if not agent:
             raise ValueError("Агент с таким токеном не найден")
         agent_id = agent['id']
+    else:
+        try:
+            agent_id = int(agent_id)
+        except (TypeError, ValueError):
+            raise ValueError("agent_id должен быть числом")
     
-    db.update_heartbeat(agent_id)
+    # Heartbeat сразу виден в get_agents и меняет статус, в базу пишется пачкой
+    get_heartbeats().record(agent_id)
     return {"status": "updated", "agent_id": agent_id}
 
 async def create_agent(data, app):
     """Создать нового агента"""
-    db = get_db()
-    
     name = data.get('name')
     location = data.get('location')
     ip = data.get('ip')
@@ -47,42 +233,158 @@ async def create_agent(data, app):
     if not all([name, location, ip, token]):
         raise ValueError("Не указаны все обязательные поля")
     
-    agent_id = db.create_agent(name, location, ip, token)
-    return {"agent_id": agent_id, "status": "created"}
+    agent, replaced = await get_agent_index().create(name, location, ip, token)
+    liveness = get_liveness()
+    if replaced is not None:
+        # Запись с этим токеном пересоздана с новым id
+        get_heartbeats().forget(replaced['id'])
+        liveness.remove(replaced['id'])
+    liveness.add(agent['id'])
+    return {"agent_id": agent['id'], "status": "created"}
+
+# Максимум задач, выдаваемых агенту за один запрос
+MAX_TASKS_PER_CLAIM = 100
 
-async def get_agent_tasks(app):
-    """Получить задачи для агентов"""
-    # Получаем задачи из сервиса проверок
-    from app.services.checks_service import CheckService
+async def _authenticate(token):
+    """Агент по токену, ValueError если токен не указан или неизвестен"""
+    if not token:
+        raise ValueError("Не указан token")
+    agent = await get_agent_index().get_by_token(token)
+    if not agent:
+        raise ValueError("Агент с таким токеном не найден")
+    return agent
+
+def _parse_type_limits(value):
+    """Свободные слоты агента по типам: "traceroute:2,ping:16" -> {"traceroute": 2, "ping": 16}"""
+    if not value:
+        return None
+    type_limits = {}
+    for item in value.split(','):
+        check_type, _, count = item.partition(':')
+        try:
+            type_limits[check_type] = max(int(count), 0)
+        except ValueError:
+            raise ValueError("limits должен иметь вид тип:число через запятую")
+    return type_limits
+
+async def get_agent_tasks(params, app):
+    """
+    Выдать агенту задачи в аренду.
+    params: token, limit (сколько задач взять), types (типы проверок через запятую,
+    которые умеет агент; по умолчанию все), limits (сколько задач каждого типа
+    агент может начать сразу, "traceroute:2,ping:16")
+    """
+    from app.handlers.check_handler import get_check_service
+    from app.services.checks_service import CHECK_TIMEOUTS
+    
+    agent = await _authenticate(params.get('token'))
     
-    # Создаем временный сервис для получения задач
-    service = CheckService()
-    checks = service.get_all_checks()
+    try:
+        limit = int(params.get('limit', 1))
+    except ValueError:
+        raise ValueError("limit должен быть числом")
+    limit = max(1, min(limit, MAX_TASKS_PER_CLAIM))
     
-    # Фильтруем задачи, которые еще не выполнены
-    pending_tasks = []
-    for check in checks:
-        if check.get('status') == 'queued':
-            for check_type in check.get('checks', []):
-                pending_tasks.append({
-                    'id': f"{check['id']}_{check_type}",
-                    'check_id': check['id'],
-                    'type': check_type,
-                    'target': check['target']
-                })
+    types = params.get('types')
+    capabilities = [t for t in types.split(',') if t in CHECK_TIMEOUTS] if types else list(CHECK_TIMEOUTS)
+    type_limits = _parse_type_limits(params.get('limits'))
     
-    return {"tasks": pending_tasks}
+    # Запрос задач - тоже признак жизни агента
+    get_heartbeats().record(agent['id'])
+    
+    service = get_check_service()
+    tasks = service.tasks.claim(agent['id'], agent.get('location'), capabilities, limit, type_limits)
+    return {"tasks": tasks}
 
 async def send_agent_results(data, app):
-    """Обработать результаты от агента"""
+    """Принять результат задачи от агента и записать его в проверку"""
+    from app.handlers.check_handler import get_check_service
+    
     task_id = data.get('task_id')
-    agent_id = data.get('agent_id')
+    lease_id = data.get('lease_id')
     results = data.get('results')
     
-    if not all([task_id, agent_id, results]):
+    if not all([task_id, lease_id, results]):
         raise ValueError("Не указаны все обязательные поля")
     
-    # Здесь можно добавить логику обработки результатов
-    # Например, обновление статуса задачи в базе данных
+    if not isinstance(results, dict):
+        raise ValueError("results должен быть объектом")
+    
+    agent = await _authenticate(data.get('token'))
+    
+    service = get_check_service()
+    if not service.complete_task(task_id, lease_id, agent['id'], results):
+        # Аренда истекла или задача уже выполнена - результат не нужен
+        return {"status": "rejected", "task_id": task_id}
     
     return {"status": "received", "task_id": task_id}
+
+# Максимум результатов в одном пакетном запросе
+MAX_RESULTS_PER_BATCH = 5000
+
+def _decode_results_batch(body, content_type):
+    """Разбирает пакет результатов: NDJSON (по объекту в строке) или msgpack (массив объектов)"""
+    if content_type in ('application/msgpack', 'application/x-msgpack'):
+        try:
+            import msgpack
+        except ImportError:
+            raise ValueError("msgpack не установлен на сервере, используйте application/x-ndjson")
+        try:
+            items = msgpack.unpackb(body, raw=False)
+        except Exception:
+            raise ValueError("Некорректный msgpack")
+        if not isinstance(items, list):
+            raise ValueError("Пакет msgpack должен быть массивом")
+        return items
+    
+    items = []
+    for line in body.splitlines():
+        if line.strip():
+            try:
+                items.append(loads(line))
+            except ValueError:
+                raise ValueError(f"Некорректный JSON в строке {len(items) + 1}")
+    return items
+
+async def send_agent_results_batch(body, content_type, token, app):
+    """
+    Принять пакет результатов от агента.
+    Все принятые результаты записываются в хранилище одной транзакцией до ответа
+    """
+    from app.handlers.check_handler import get_check_service
+    
+    agent = await _authenticate(token)
+    items = _decode_results_batch(body, content_type)
+    if len(items) > MAX_RESULTS_PER_BATCH:
+        raise ValueError(f"Слишком много результатов в пакете (максимум {MAX_RESULTS_PER_BATCH})")
+    
+    # Пакет проверяется целиком до применения: ошибка не должна оставлять его записанным частично
+    if not all(isinstance(item, dict) for item in items):
+        raise ValueError("Каждый результат должен быть объектом")
+    
+    service = get_check_service()
+    statuses = []
+    received = 0
+    for item in items:
+        task_id = item.get('task_id')
+        results = item.get('results')
+        accepted = isinstance(results, dict) and service.complete_task(
+            task_id, item.get('lease_id'), agent['id'], results
+        )
+        received += accepted
+        statuses.append({"task_id": task_id, "status": "received" if accepted else "rejected"})
+    
+    get_heartbeats().record(agent['id'])
+    # Сбрасываем накопленные записи сразу, одной транзакцией. Если запись не удалась,
+    # агент должен получить 5xx и оставить пакет у себя, а не считать его доставленным
+    try:
+        await service.store.flush(raise_errors=True)
+    except Exception as e:
+        raise RuntimeError(f"Результаты не записаны в хранилище: {e}")
+    
+    return {"received": received, "rejected": len(items) - received, "results": statuses}
+
+async def agent_channel(request):
+    """Открыть WebSocket канал агента (токен в параметре token)"""
+    agent = await _authenticate(request.query.get('token'))
+    return await get_agent_channels().handle(request, agent)
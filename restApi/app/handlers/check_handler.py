@@ -1,4 +1,10 @@
-from app.services.checks_service import CheckService
+import asyncio
+
+from aiohttp import web
+
+from app.json_codec import PayloadCache, dumps, loads
+from app.services.check_store import ACTIVE_STATUSES
+from app.services.checks_service import CheckService, CHECK_TIMEOUTS
 
 # Глобальный экземпляр сервиса (singleton)
 _check_service = None
@@ -10,6 +16,36 @@ def get_check_service() -> CheckService:
         _check_service = CheckService()
     return _check_service
 
+# Максимум пар target x port в одном запросе обхода портов
+MAX_SWEEP_PAIRS = 10000
+# Максимум целей в одном пакете проверок
+MAX_BATCH_TARGETS = 10000
+# Максимальное ожидание изменений в режиме long-poll, секунды
+MAX_WAIT = 60
+# Как часто отправлять комментарий keep-alive в SSE поток, секунды
+SSE_KEEPALIVE = 15
+# Кеш закодированных ответов завершенных проверок: они больше не меняются
+FINISHED_PAYLOAD_CACHE_BYTES = 32 * 1024 * 1024
+FINISHED_PAYLOAD_TTL = 600
+
+_finished_payloads = PayloadCache(FINISHED_PAYLOAD_CACHE_BYTES, FINISHED_PAYLOAD_TTL)
+
+async def start_check_service(app):
+    """Открывает хранилище проверок и очередь агентов (on_startup приложения)"""
+    await get_check_service().start()
+
+async def close_check_events(app):
+    """Завершает SSE потоки и long-poll запросы (on_shutdown приложения)"""
+    if _check_service is not None:
+        _check_service.events.close()
+
+async def close_check_service(app):
+    """Останавливает сервис проверок (on_cleanup приложения)"""
+    global _check_service
+    if _check_service is not None:
+        await _check_service.shutdown()
+        _check_service = None
+
 async def create_check(data, app):
     """Создать новую проверку"""
     target = data.get('target')
@@ -22,9 +58,15 @@ async def create_check(data, app):
     if not checks or len(checks) == 0:
         raise ValueError("Не указаны типы проверок")
     
+    # Где выполнять: локально на сервере или агентами (location - только агенты локации)
+    location = data.get('location')
+    executor = data.get('executor', 'agent' if location else 'local')
+    if executor not in ('local', 'agent'):
+        raise ValueError("executor должен быть 'local' или 'agent'")
+    
     # Создаем проверку через сервис
     service = get_check_service()
-    check_id = await service.create_check(target, checks)
+    check_id = await service.create_check(target, checks, executor, location)
     
     return {
         "checkId": check_id,
@@ -33,10 +75,108 @@ async def create_check(data, app):
         "checks": checks
     }
 
-async def get_check_result(check_id: str, app):
-    """Получить результат проверки по ID"""
+def _batch_item(item, default_checks, number: int):
+    """Превращает элемент пакета (строка target или {"target", "checks"}) в пару (target, checks)"""
+    if isinstance(item, str):
+        target, checks = item, default_checks
+    elif isinstance(item, dict):
+        target, checks = item.get('target'), item.get('checks', default_checks)
+    else:
+        raise ValueError(f"Элемент {number}: ожидается строка или объект")
+    
+    if not target or not isinstance(target, str):
+        raise ValueError(f"Элемент {number}: не указан target")
+    
+    if not isinstance(checks, list) or not checks:
+        raise ValueError(f"Элемент {number}: не указаны типы проверок")
+    
+    unknown = [t for t in checks if t not in CHECK_TIMEOUTS]
+    if unknown:
+        raise ValueError(f"Элемент {number}: неизвестные типы проверок: {', '.join(map(str, unknown))}")
+    
+    return target, list(dict.fromkeys(checks))
+
+def _batch_options(executor, location):
+    executor = executor or ('agent' if location else 'local')
+    if executor not in ('local', 'agent'):
+        raise ValueError("executor должен быть 'local' или 'agent'")
+    return executor, location
+
+async def create_check_batch(data, app):
+    """
+    Создать пакет проверок из JSON:
+    {"targets": ["a.com", {"target": "b.com", "checks": ["dns"]}], "checks": [...], "executor", "location"}
+    """
+    targets = data.get('targets', [])
+    default_checks = data.get('checks', [])
+    
+    if not isinstance(targets, list) or not targets:
+        raise ValueError("Не указаны targets")
+    
+    if len(targets) > MAX_BATCH_TARGETS:
+        raise ValueError(f"Слишком много целей в пакете (максимум {MAX_BATCH_TARGETS})")
+    
+    items = [_batch_item(item, default_checks, number) for number, item in enumerate(targets, 1)]
+    executor, location = _batch_options(data.get('executor'), data.get('location'))
+    
+    return await get_check_service().create_batch(items, executor, location)
+
+async def create_check_batch_stream(stream, params, app):
+    """
+    Создать пакет проверок из потока NDJSON: в каждой строке target (строка JSON)
+    или объект {"target", "checks"}. Типы проверок по умолчанию, executor
+    и location - в параметрах запроса (checks=ping,dns)
+    """
+    default_checks = [t for t in params.get('checks', '').split(',') if t]
+    executor, location = _batch_options(params.get('executor'), params.get('location'))
+    
+    # Тело читается построчно, без буферизации всего запроса
+    items = []
+    number = 0
+    async for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        number += 1
+        if number > MAX_BATCH_TARGETS:
+            raise ValueError(f"Слишком много целей в пакете (максимум {MAX_BATCH_TARGETS})")
+        try:
+            item = loads(line)
+        except ValueError:
+            raise ValueError(f"Строка {number}: неверный JSON")
+        items.append(_batch_item(item, default_checks, number))
+    
+    if not items:
+        raise ValueError("Не указаны targets")
+    
+    return await get_check_service().create_batch(items, executor, location)
+
+async def get_check_batch(batch_id: str, app):
+    """Сводный прогресс пакета проверок"""
+    batch = get_check_service().get_batch(batch_id)
+    if batch is None:
+        return {
+            "error": f"Пакет {batch_id} не найден",
+            "status": "not_found"
+        }
+    return batch
+
+async def get_check_result(check_id: str, app, wait=None):
+    """
+    Получить результат проверки по ID.
+    wait - long-poll: если проверка еще выполняется, ответ придет при первом
+    новом результате или смене статуса, но не позже чем через wait секунд
+    """
+    if wait is not None:
+        try:
+            wait = float(wait)
+        except ValueError:
+            wait = None
+        if wait is None or not 0 < wait <= MAX_WAIT:
+            raise ValueError(f"wait должен быть числом от 0 до {MAX_WAIT} секунд")
+    
     service = get_check_service()
-    result = service.get_check_by_id(check_id)
+    result = await service.get_check_by_id(check_id)
     
     if not result:
         return {
@@ -44,4 +184,104 @@ async def get_check_result(check_id: str, app):
             "status": "not_found"
         }
     
-    return result
\ No newline at end of file
+    if wait and result["status"] in ACTIVE_STATUSES:
+        if await service.events.wait(check_id, wait) is not None:
+            result = await service.get_check_by_id(check_id)
+    
+    return result
+
+def get_finished_check_payload(check_id: str):
+    """Закодированный ответ завершенной проверки из кеша или None"""
+    return _finished_payloads.get(check_id)
+
+def cache_finished_check(check):
+    """Кодирует завершенную проверку один раз; повторные GET отдают готовые (и сжатые) байты"""
+    return _finished_payloads.put(check["id"], check)
+
+def _sse_event(name: str, data) -> bytes:
+    return b"event: " + name.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+async def stream_check_events(request):
+    """
+    SSE поток проверки: snapshot (текущее состояние), result (тип проверки
+    завершился или обновился прыжок traceroute), status, done (итоговая запись).
+    Возвращает None, если проверка не найдена
+    """
+    check_id = request.match_info['check_id']
+    service = get_check_service()
+    check = await service.get_check_by_id(check_id)
+    if not check:
+        return None
+    
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+    })
+    # Подписываемся до отправки snapshot, чтобы не пропустить события
+    queue = service.events.subscribe(check_id)
+    try:
+        await response.prepare(request)
+        await response.write(_sse_event("snapshot", check))
+        finished = check["status"] not in ACTIVE_STATUSES
+        while not finished:
+            try:
+                event = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                await response.write(b": keepalive\n\n")
+                continue
+            if event is None:
+                break  # сервер останавливается
+            if event["event"] == "result":
+                await response.write(_sse_event("result", {"type": event["type"], "result": event["result"]}))
+            elif event["status"] in ACTIVE_STATUSES:
+                await response.write(_sse_event("status", {"status": event["status"]}))
+            else:
+                check = await service.get_check_by_id(check_id)
+                finished = True
+        if finished:
+            await response.write(_sse_event("done", check))
+    except ConnectionResetError:
+        pass  # клиент закрыл поток
+    finally:
+        service.events.unsubscribe(check_id, queue)
+    return response
+
+async def cancel_check(check_id: str, app):
+    """Отменить выполняющуюся проверку"""
+    service = get_check_service()
+    if not await service.get_check_by_id(check_id):
+        return {
+            "error": f"Проверка {check_id} не найдена",
+            "status": "not_found"
+        }
+    
+    cancelled = service.cancel_check(check_id)
+    return {"checkId": check_id, "status": "cancelling" if cancelled else "not_running"}
+
+
+async def run_tcp_sweep(data, app):
+    """Обход TCP портов на множестве целей"""
+    targets = data.get('targets', [])
+    ports = data.get('ports', [])
+    count = data.get('count', 1)
+    
+    # Валидация
+    if not isinstance(targets, list) or not targets:
+        raise ValueError("Не указаны targets")
+    
+    if not isinstance(ports, list) or not ports:
+        raise ValueError("Не указаны ports")
+    
+    if not all(isinstance(p, int) and 0 < p < 65536 for p in ports):
+        raise ValueError("Порты должны быть числами от 1 до 65535")
+    
+    if not isinstance(count, int) or not 0 < count <= 10:
+        raise ValueError("count должен быть от 1 до 10")
+    
+    if len(targets) * len(ports) > MAX_SWEEP_PAIRS:
+        raise ValueError(f"Слишком много пар target x port (максимум {MAX_SWEEP_PAIRS})")
+    
+    service = get_check_service()
+    results = await service.run_tcp_sweep(targets, ports, count)
+    
+    return {"results": results}
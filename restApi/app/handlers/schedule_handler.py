@@ -0,0 +1,115 @@
+from app.handlers.check_handler import get_check_service
+from app.services.checks_service import CHECK_TIMEOUTS
+from app.services.scheduler import Scheduler, CronSchedule, MIN_INTERVAL, OVERLAP_POLICIES
+
+# Глобальный экземпляр планировщика (singleton)
+_scheduler = None
+
+# Максимум расписаний в одном ответе списка
+MAX_SCHEDULES_PER_PAGE = 1000
+
+def get_scheduler() -> Scheduler:
+    """Получить или создать планировщик периодических проверок"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler(get_check_service())
+    return _scheduler
+
+async def start_scheduler(app):
+    """Загружает расписания и запускает планировщик (on_startup приложения)"""
+    await get_scheduler().start()
+
+async def close_scheduler(app):
+    """Останавливает планировщик до остановки сервиса проверок (on_cleanup приложения)"""
+    global _scheduler
+    if _scheduler is not None:
+        await _scheduler.close()
+        _scheduler = None
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+async def create_schedule(data, app):
+    """Создать периодическую проверку"""
+    target = data.get('target')
+    checks = data.get('checks', [])
+    interval = data.get('interval')
+    cron = data.get('cron')
+    jitter = data.get('jitter', 0)
+    overlap = data.get('overlap', 'skip')
+    
+    # Валидация
+    if not target or not isinstance(target, str):
+        raise ValueError("Не указан target")
+    
+    if not isinstance(checks, list) or not checks:
+        raise ValueError("Не указаны типы проверок")
+    
+    unknown = [t for t in checks if t not in CHECK_TIMEOUTS]
+    if unknown:
+        raise ValueError(f"Неизвестные типы проверок: {', '.join(map(str, unknown))}")
+    
+    if (interval is None) == (cron is None):
+        raise ValueError("Нужно указать interval или cron (одно из двух)")
+    
+    if interval is not None and (not _is_number(interval) or interval < MIN_INTERVAL):
+        raise ValueError(f"interval должен быть числом не меньше {MIN_INTERVAL} секунд")
+    
+    if cron is not None:
+        CronSchedule(cron)
+    
+    if not _is_number(jitter) or jitter < 0:
+        raise ValueError("jitter должен быть неотрицательным числом")
+    
+    if interval is not None and jitter > interval:
+        raise ValueError("jitter не может быть больше interval")
+    
+    if overlap not in OVERLAP_POLICIES:
+        raise ValueError("overlap должен быть 'skip' или 'coalesce'")
+    
+    # Где выполнять - как в create_check
+    location = data.get('location')
+    executor = data.get('executor', 'agent' if location else 'local')
+    if executor not in ('local', 'agent'):
+        raise ValueError("executor должен быть 'local' или 'agent'")
+    
+    definition = {
+        "target": target,
+        "checks": list(dict.fromkeys(checks)),
+        "interval": interval,
+        "cron": cron,
+        "jitter": jitter,
+        "overlap": overlap,
+        "executor": executor,
+        "location": location,
+    }
+    return await get_scheduler().add(definition)
+
+async def list_schedules(params, app):
+    """Список расписаний"""
+    limit = int(params.get('limit', 100))
+    offset = int(params.get('offset', 0))
+    if not 0 < limit <= MAX_SCHEDULES_PER_PAGE or offset < 0:
+        raise ValueError(f"limit должен быть от 1 до {MAX_SCHEDULES_PER_PAGE}, offset - неотрицательным")
+    
+    scheduler = get_scheduler()
+    return {"schedules": scheduler.list(limit, offset), "total": len(scheduler)}
+
+async def get_schedule(schedule_id: str, app):
+    """Получить расписание по ID"""
+    schedule = get_scheduler().get(schedule_id)
+    if schedule is None:
+        return {
+            "error": f"Расписание {schedule_id} не найдено",
+            "status": "not_found"
+        }
+    return schedule
+
+async def delete_schedule(schedule_id: str, app):
+    """Удалить расписание"""
+    if not await get_scheduler().remove(schedule_id):
+        return {
+            "error": f"Расписание {schedule_id} не найдено",
+            "status": "not_found"
+        }
+    return {"id": schedule_id, "status": "deleted"}
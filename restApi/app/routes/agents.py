@@ -1,5 +1,7 @@
 from aiohttp import web
-from app.handlers.agent_handler import get_agents, update_heartbeat, create_agent, get_agent_tasks, send_agent_results
+from app.json_codec import read_json, json_response, etag_matches
+from app.handlers.agent_handler import (parse_agents_query, agents_etag, get_agents_payload, get_agents_summary, update_heartbeat, create_agent, get_agent_tasks, send_agent_results,
+                                        send_agent_results_batch, agent_channel, stream_agent_events)
 
 agent_routes = web.RouteTableDef()
 
@@ -10,36 +12,74 @@ async def options_agents_handler(request):
 
 @agent_routes.get('/api/agents')
 async def get_agents_handler(request):
-    """Получить список агентов"""
+    """Получить страницу списка агентов (limit, after, status, location), 304 если не изменилась"""
     try:
-        result = await get_agents(request.app)
-        return web.json_response(result)
+        query = parse_agents_query(request.query)
+        etag = agents_etag(query)
+        # Клиент должен перепроверять ответ, но при неизменной версии получает пустой 304
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request, etag):
+            return web.Response(status=304, headers=headers)
+        payload = await get_agents_payload(query, etag, request.app)
+        response = payload.response(request)
+        response.headers.update(headers)
+        return response
+    except ValueError as e:
+        return json_response({"error": str(e)}, status=400)
     except Exception as e:
-        return web.json_response({"error": str(e)}, status=500)
+        return json_response({"error": str(e)}, status=500)
+
+@agent_routes.options('/api/agents/summary')
+async def options_agents_summary_handler(request):
+    """Обработка preflight запросов для CORS"""
+    return web.Response()
+
+@agent_routes.get('/api/agents/summary')
+async def get_agents_summary_handler(request):
+    """Число агентов по статусам: total, healthy, statuses"""
+    try:
+        result = await get_agents_summary(request.app)
+        return json_response(result)
+    except Exception as e:
+        return json_response({"error": str(e)}, status=500)
+
+@agent_routes.options('/api/agents/events')
+async def options_agents_events_handler(request):
+    """Обработка preflight запросов для CORS"""
+    return web.Response()
+
+@agent_routes.get('/api/agents/events')
+async def agents_events_handler(request):
+    """Поток переходов статусов агентов (Server-Sent Events)"""
+    return await stream_agent_events(request)
 
 @agent_routes.post('/api/agents/heartbeat')
 async def heartbeat_handler(request):
     """Обновить heartbeat агента"""
     try:
-        data = request._json_data if hasattr(request, '_json_data') else await request.json()
+        data = await read_json(request)
         result = await update_heartbeat(data, request.app)
-        return web.json_response(result)
+        return json_response(result)
+    except web.HTTPException:
+        raise
     except ValueError as e:
-        return web.json_response({"error": str(e)}, status=400)
+        return json_response({"error": str(e)}, status=400)
     except Exception as e:
-        return web.json_response({"error": str(e)}, status=500)
+        return json_response({"error": str(e)}, status=500)
 
 @agent_routes.post('/api/agents')
 async def create_agent_handler(request):
     """Создать нового агента"""
     try:
-        data = request._json_data if hasattr(request, '_json_data') else await request.json()
+        data = await read_json(request)
         result = await create_agent(data, request.app)
-        return web.json_response(result, status=201)
+        return json_response(result, status=201)
+    except web.HTTPException:
+        raise
     except ValueError as e:
-        return web.json_response({"error": str(e)}, status=400)
+        return json_response({"error": str(e)}, status=400)
     except Exception as e:
-        return web.json_response({"error": str(e)}, status=500)
+        return json_response({"error": str(e)}, status=500)
 
 @agent_routes.options('/api/agent/tasks')
 async def options_agent_tasks_handler(request):
@@ -50,10 +90,12 @@ async def options_agent_tasks_handler(request):
 async def get_agent_tasks_handler(request):
     """Получить задачи для агента"""
     try:
-        result = await get_agent_tasks(request.app)
-        return web.json_response(result)
+        result = await get_agent_tasks(request.query, request.app)
+        return json_response(result)
+    except ValueError as e:
+        return json_response({"error": str(e)}, status=400)
     except Exception as e:
-        return web.json_response({"error": str(e)}, status=500)
+        return json_response({"error": str(e)}, status=500)
 
 @agent_routes.options('/api/agent/results')
 async def options_agent_results_handler(request):
@@ -64,10 +106,40 @@ async def options_agent_results_handler(request):
 async def send_agent_results_handler(request):
     """Отправить результаты выполнения задачи"""
     try:
-        data = request._json_data if hasattr(request, '_json_data') else await request.json()
+        data = await read_json(request)
         result = await send_agent_results(data, request.app)
-        return web.json_response(result)
+        return json_response(result)
+    except web.HTTPException:
+        raise
     except ValueError as e:
-        return web.json_response({"error": str(e)}, status=400)
+        return json_response({"error": str(e)}, status=400)
     except Exception as e:
-        return web.json_response({"error": str(e)}, status=500)
\ No newline at end of file
+        return json_response({"error": str(e)}, status=500)
+
+@agent_routes.options('/api/agent/results/batch')
+async def options_agent_results_batch_handler(request):
+    """Обработка preflight запросов для CORS"""
+    return web.Response()
+
+@agent_routes.post('/api/agent/results/batch')
+async def send_agent_results_batch_handler(request):
+    """Отправить пакет результатов (NDJSON или msgpack, можно со сжатием gzip)"""
+    try:
+        body = await request.read()
+        result = await send_agent_results_batch(body, request.content_type, request.query.get('token'), request.app)
+        return json_response(result)
+    except web.HTTPException:
+        # Пакет больше client_max_size - 413 от aiohttp, а не 500
+        raise
+    except ValueError as e:
+        return json_response({"error": str(e)}, status=400)
+    except Exception as e:
+        return json_response({"error": str(e)}, status=500)
+
+@agent_routes.get('/api/agent/ws')
+async def agent_ws_handler(request):
+    """WebSocket канал агента: задачи, результаты, heartbeat и отмены"""
+    try:
+        return await agent_channel(request)
+    except ValueError as e:
+        return json_response({"error": str(e)}, status=400)
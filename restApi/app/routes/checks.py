@@ -1,5 +1,9 @@
 from aiohttp import web
-from app.handlers.check_handler import create_check, get_check_result
+from app.json_codec import read_json, json_response
+from app.handlers.check_handler import (create_check, get_check_result, cancel_check, run_tcp_sweep,
+                                        stream_check_events, create_check_batch, create_check_batch_stream,
+                                        get_check_batch, get_finished_check_payload, cache_finished_check)
+from app.services.check_store import ACTIVE_STATUSES
 
 checks_routes = web.RouteTableDef()
 
@@ -12,13 +16,52 @@ async def options_check_handler(request):
 async def create_check_handler(request):
     """Создать новую проверку"""
     try:
-        data = request._json_data if hasattr(request, '_json_data') else await request.json()
+        data = await read_json(request)
         result = await create_check(data, request.app)
-        return web.json_response(result, status=201)
+        return json_response(result, status=201)
+    except web.HTTPException:
+        raise
     except ValueError as e:
-        return web.json_response({"error": str(e)}, status=400)
+        return json_response({"error": str(e)}, status=400)
     except Exception as e:
-        return web.json_response({"error": f"Internal error: {str(e)}"}, status=500)
+        return json_response({"error": f"Internal error: {str(e)}"}, status=500)
+
+@checks_routes.options('/api/checks/batch')
+async def options_check_batch_handler(request):
+    """Обработка preflight запросов для CORS"""
+    return web.Response()
+
+@checks_routes.post('/api/checks/batch')
+async def create_check_batch_handler(request):
+    """Создать пакет проверок (JSON или поток NDJSON)"""
+    try:
+        if request.content_type == 'application/json':
+            data = await read_json(request)
+            result = await create_check_batch(data, request.app)
+        else:
+            result = await create_check_batch_stream(request.content, request.query, request.app)
+        return json_response(result, status=201)
+    except web.HTTPException:
+        raise
+    except ValueError as e:
+        return json_response({"error": str(e)}, status=400)
+    except Exception as e:
+        return json_response({"error": f"Internal error: {str(e)}"}, status=500)
+
+@checks_routes.options('/api/checks/batch/{batch_id}')
+async def options_get_check_batch_handler(request):
+    """Обработка preflight запросов для CORS"""
+    return web.Response()
+
+@checks_routes.get('/api/checks/batch/{batch_id}')
+async def get_check_batch_handler(request):
+    """Прогресс пакета проверок"""
+    result = await get_check_batch(request.match_info['batch_id'], request.app)
+    
+    if result.get("status") == "not_found":
+        return json_response(result, status=404)
+    
+    return json_response(result)
 
 @checks_routes.options('/api/check/{check_id}')
 async def options_get_check_handler(request):
@@ -27,11 +70,67 @@ async def options_get_check_handler(request):
 
 @checks_routes.get('/api/check/{check_id}')
 async def get_check_handler(request):
-    """Получить результат проверки"""
+    """Получить результат проверки (?wait=N - ждать изменений до N секунд)"""
+    check_id = request.match_info['check_id']
+    payload = get_finished_check_payload(check_id)
+    if payload is not None:
+        return payload.response(request)
+    
+    try:
+        result = await get_check_result(check_id, request.app, request.query.get('wait'))
+    except ValueError as e:
+        return json_response({"error": str(e)}, status=400)
+    
+    if result.get("status") == "not_found":
+        return json_response(result, status=404)
+    
+    if result["status"] not in ACTIVE_STATUSES:
+        return cache_finished_check(result).response(request)
+    
+    return json_response(result)
+
+@checks_routes.options('/api/check/{check_id}/events')
+async def options_check_events_handler(request):
+    """Обработка preflight запросов для CORS"""
+    return web.Response()
+
+@checks_routes.get('/api/check/{check_id}/events')
+async def check_events_handler(request):
+    """Поток результатов проверки (Server-Sent Events)"""
+    response = await stream_check_events(request)
+    
+    if response is None:
+        check_id = request.match_info['check_id']
+        return json_response({"error": f"Проверка {check_id} не найдена", "status": "not_found"}, status=404)
+    
+    return response
+
+@checks_routes.delete('/api/check/{check_id}')
+async def cancel_check_handler(request):
+    """Отменить выполняющуюся проверку"""
     check_id = request.match_info['check_id']
-    result = await get_check_result(check_id, request.app)
+    result = await cancel_check(check_id, request.app)
     
     if result.get("status") == "not_found":
-        return web.json_response(result, status=404)
+        return json_response(result, status=404)
     
-    return web.json_response(result)
\ No newline at end of file
+    return json_response(result)
+
+@checks_routes.options('/api/tcp/sweep')
+async def options_tcp_sweep_handler(request):
+    """Обработка preflight запросов для CORS"""
+    return web.Response()
+
+@checks_routes.post('/api/tcp/sweep')
+async def tcp_sweep_handler(request):
+    """Проверить TCP порты на множестве целей"""
+    try:
+        data = await read_json(request)
+        result = await run_tcp_sweep(data, request.app)
+        return json_response(result)
+    except web.HTTPException:
+        raise
+    except ValueError as e:
+        return json_response({"error": str(e)}, status=400)
+    except Exception as e:
+        return json_response({"error": f"Internal error: {str(e)}"}, status=500)
\ No newline at end of file
@@ -0,0 +1,58 @@
+from aiohttp import web
+from app.json_codec import read_json, json_response
+from app.handlers.schedule_handler import create_schedule, list_schedules, get_schedule, delete_schedule
+
+schedule_routes = web.RouteTableDef()
+
+@schedule_routes.options('/api/schedules')
+async def options_schedules_handler(request):
+    """Обработка preflight запросов для CORS"""
+    return web.Response()
+
+@schedule_routes.post('/api/schedules')
+async def create_schedule_handler(request):
+    """Создать периодическую проверку"""
+    try:
+        data = await read_json(request)
+        result = await create_schedule(data, request.app)
+        return json_response(result, status=201)
+    except web.HTTPException:
+        raise
+    except ValueError as e:
+        return json_response({"error": str(e)}, status=400)
+    except Exception as e:
+        return json_response({"error": f"Internal error: {str(e)}"}, status=500)
+
+@schedule_routes.get('/api/schedules')
+async def list_schedules_handler(request):
+    """Список периодических проверок"""
+    try:
+        result = await list_schedules(request.query, request.app)
+        return json_response(result)
+    except ValueError as e:
+        return json_response({"error": str(e)}, status=400)
+
+@schedule_routes.options('/api/schedules/{schedule_id}')
+async def options_schedule_handler(request):
+    """Обработка preflight запросов для CORS"""
+    return web.Response()
+
+@schedule_routes.get('/api/schedules/{schedule_id}')
+async def get_schedule_handler(request):
+    """Получить периодическую проверку и статистику запусков"""
+    result = await get_schedule(request.match_info['schedule_id'], request.app)
+    
+    if result.get("status") == "not_found":
+        return json_response(result, status=404)
+    
+    return json_response(result)
+
+@schedule_routes.delete('/api/schedules/{schedule_id}')
+async def delete_schedule_handler(request):
+    """Удалить периодическую проверку"""
+    result = await delete_schedule(request.match_info['schedule_id'], request.app)
+    
+    if result.get("status") == "not_found":
+        return json_response(result, status=404)
+    
+    return json_response(result)
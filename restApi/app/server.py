@@ -1,7 +1,15 @@
 from aiohttp import web
 from app.routes.checks import checks_routes
 from app.routes.agents import agent_routes
+from app.routes.schedules import schedule_routes
+from app.handlers.check_handler import start_check_service, close_check_events, close_check_service
+from app.handlers.agent_handler import start_agents, close_agent_channels, close_agent_events, close_db, get_agent_index
+from app.handlers.schedule_handler import start_scheduler, close_scheduler
+from app.json_codec import read_json, compress_response
+from app.services.rate_limiter import RateClass, RateLimiter
+from math import ceil
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -13,63 +21,155 @@ ALLOWED_ORIGINS = [
     "http://127.0.0.1",
 ]
 
-# Middleware для CORS
-@web.middleware
-async def cors_middleware(request, handler):
-    origin = request.headers.get('Origin', '')
-    
-    # Обработка preflight запросов
-    if request.method == 'OPTIONS':
-        response = web.Response()
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Requested-With'
-        response.headers['Access-Control-Max-Age'] = '3600'
-        return response
-    
-    # Обрабатываем обычные запросы
-    response = await handler(request)
-    
-    # Добавляем CORS заголовки
-    response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Requested-With'
-    
-    # Безопасные заголовки
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'DENY'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    
-    return response
-
-# Middleware для валидации JSON
-@web.middleware
-async def validate_json_middleware(request, handler):
-    # Логируем запрос
-    logger.info(f"{request.method} {request.path} - IP: {request.remote}")
-    
-    if request.content_type == 'application/json':
-        try:
-            # Читаем тело запроса
-            body = await request.read()
-            
-            # Ограничение размера (1 MB)
-            if len(body) > 1024 * 1024:
-                raise web.HTTPRequestEntityTooLarge()
-            
-            # Парсим JSON
-            import json
-            request._json_data = json.loads(body)
-        except (json.JSONDecodeError, ValueError):
-            raise web.HTTPBadRequest(reason="Invalid JSON")
-    
-    return await handler(request)
-
-# Middleware для обработки ошибок
+# Заголовки CORS и безопасности считаются один раз при загрузке модуля
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Requested-With, If-None-Match',
+    'Access-Control-Expose-Headers': 'ETag',
+}
+PREFLIGHT_HEADERS = {**CORS_HEADERS, 'Access-Control-Max-Age': '3600'}
+RESPONSE_HEADERS = {
+    **CORS_HEADERS,
+    'X-Content-Type-Options': 'nosniff',
+    'X-Frame-Options': 'DENY',
+    'X-XSS-Protection': '1; mode=block',
+}
+
+async def apply_response_headers(request, response):
+    """
+    Добавляет заголовки CORS и безопасности (сигнал on_response_prepare).
+    Срабатывает для любого ответа, включая ошибки, SSE и WebSocket,
+    до отправки заголовков
+    """
+    response.headers.update(RESPONSE_HEADERS)
+
+# Rate limiting (GCRA, см. app/services/rate_limiter.py)
+
+# Классы лимитов
+RATE_CLASSES = {
+    "default": RateClass("default", 100, 60),
+    # Чтение результатов и preflight - дешевые запросы
+    "read": RateClass("read", 600, 60, burst=100),
+    # Создание проверок запускает пробы
+    "create": RateClass("create", 60, 60, burst=20),
+    # Пакеты и обход портов - сотни проб за запрос
+    "bulk": RateClass("bulk", 10, 60, burst=5),
+    # Агенты с известным токеном: опрос задач, heartbeat и результаты
+    "agent": RateClass("agent", 6000, 60, burst=1000),
+}
+
+# Класс лимита по маршруту: (метод, шаблон пути); остальные GET/OPTIONS - read, прочие - default
+ROUTE_RATE_CLASSES = {
+    ("POST", "/api/check"): "create",
+    ("POST", "/api/schedules"): "create",
+    ("POST", "/api/checks/batch"): "bulk",
+    ("POST", "/api/tcp/sweep"): "bulk",
+}
+
+rate_limiter = RateLimiter()
+
+# Маршруты агентов: для них известный токен агента дает отдельный лимит
+AGENT_ROUTES = {
+    "/api/agent/tasks",
+    "/api/agent/results",
+    "/api/agent/results/batch",
+    "/api/agent/ws",
+    "/api/agents/heartbeat",
+}
+
+def _route_path(request) -> str:
+    route = request.match_info.route.resource
+    return route.canonical if route is not None else request.path
+
+def _rate_class(request, path: str) -> RateClass:
+    name = ROUTE_RATE_CLASSES.get((request.method, path))
+    if name is None:
+        name = "read" if request.method in ("GET", "HEAD", "OPTIONS") else "default"
+    return RATE_CLASSES[name]
+
+def check_rate_limit(request):
+    """Учитывает запрос в лимите, при превышении - 429 с Retry-After"""
+    path = _route_path(request)
+    # Агент определяется по токену из заголовка X-Agent-Token или параметра token.
+    # Лимит агента действует только на маршрутах агентов: токен может получить
+    # кто угодно через POST /api/agents, поэтому на остальных маршрутах лимит по IP;
+    # неизвестный токен отдельного лимита не дает
+    token = None
+    if path in AGENT_ROUTES:
+        token = request.headers.get('X-Agent-Token') or request.query.get('token')
+    if token and get_agent_index().has_token(token):
+        allowed, retry_after = rate_limiter.hit(RATE_CLASSES["agent"], token)
+    else:
+        allowed, retry_after = rate_limiter.hit(_rate_class(request, path), request.remote)
+
+    if not allowed:
+        raise web.HTTPTooManyRequests(
+            reason="Rate limit exceeded",
+            headers={'Retry-After': str(ceil(retry_after))}
+        )
+
+# Журнал запросов и бюджет накладных расходов middleware
+
+ACCESS_LOG_SAMPLE = 100  # в журнал пишется каждый N-й запрос (ошибки и медленные - всегда)
+MIDDLEWARE_BUDGET = 0.0005  # допустимые накладные расходы middleware на запрос, секунды
+STATS_LOG_INTERVAL = 10000  # раз в столько запросов в журнал пишется сводка накладных расходов
+
+class MiddlewareStats:
+    """Накладные расходы middleware: время запроса без времени обработчика"""
+
+    def __init__(self):
+        self.requests = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.over_budget = 0
+
+    def add(self, overhead: float):
+        self.requests += 1
+        self.total += overhead
+        if overhead > self.max:
+            self.max = overhead
+        if overhead > MIDDLEWARE_BUDGET:
+            self.over_budget += 1
+        if self.requests % STATS_LOG_INTERVAL == 0:
+            logger.info(
+                f"Middleware: {self.requests} запросов, в среднем {self.total / self.requests * 1e6:.0f} мкс, "
+                f"максимум {self.max * 1e6:.0f} мкс, сверх бюджета {MIDDLEWARE_BUDGET * 1e6:.0f} мкс: "
+                f"{self.over_budget}"
+            )
+
+middleware_stats = MiddlewareStats()
+
 @web.middleware
-async def error_middleware(request, handler):
+async def api_middleware(request, handler):
+    """
+    Единственный middleware API, шаги в прежнем порядке:
+    ошибки -> rate limit -> разбор JSON (один раз) -> preflight CORS -> обработчик
+    -> сжатие большого ответа.
+    Заголовки ответа добавляет apply_response_headers
+    """
+    started = time.perf_counter()
+    handler_time = 0.0
     try:
-        return await handler(request)
+        check_rate_limit(request)
+
+        if request.content_type == 'application/json' and request.body_exists:
+            try:
+                await read_json(request)
+            except ValueError:
+                raise web.HTTPBadRequest(reason="Invalid JSON")
+
+        if request.method == 'OPTIONS':
+            return web.Response(headers=PREFLIGHT_HEADERS)
+
+        handler_started = time.perf_counter()
+        try:
+            response = await handler(request)
+            # Сжатие - часть стоимости ответа, а не накладные расходы middleware
+            compress_response(request, response)
+            return response
+        finally:
+            handler_time = time.perf_counter() - handler_started
     except web.HTTPException as e:
         # Логируем ошибки
         logger.error(f"HTTP {e.status}: {e.reason} - {request.method} {request.path}")
@@ -78,42 +178,32 @@ async def error_middleware(request, handler):
         # Не раскрываем внутренние ошибки
         logger.error(f"Internal error: {str(e)} - {request.method} {request.path}")
         raise web.HTTPInternalServerError()
-
-# Middleware для rate limiting (простая реализация)
-from collections import defaultdict
-from datetime import datetime
-
-request_counts = defaultdict(int)
-last_reset = datetime.now()
-
-@web.middleware
-async def rate_limit_middleware(request, handler):
-    global last_reset
-    ip = request.remote
-    
-    # Сброс счетчика раз в минуту
-    if (datetime.now() - last_reset).total_seconds() > 60:
-        request_counts.clear()
-        last_reset = datetime.now()
-    
-    # Лимит: 100 запросов в минуту с одного IP
-    if request_counts[ip] > 100:
-        raise web.HTTPTooManyRequests(reason="Rate limit exceeded")
-    
-    request_counts[ip] += 1
-    return await handler(request)
+    finally:
+        overhead = time.perf_counter() - started - handler_time
+        middleware_stats.add(overhead)
+        if middleware_stats.requests % ACCESS_LOG_SAMPLE == 0 or overhead > MIDDLEWARE_BUDGET:
+            logger.info(f"{request.method} {request.path} - IP: {request.remote} - "
+                        f"middleware {overhead * 1e6:.0f} мкс")
 
 def create_app():
     app = web.Application()
-    
-    # Подключаем middleware в правильном порядке
-    app.middlewares.append(error_middleware)
-    app.middlewares.append(rate_limit_middleware)
-    app.middlewares.append(validate_json_middleware)
-    app.middlewares.append(cors_middleware)
-    
+
+    app.middlewares.append(api_middleware)
+    app.on_response_prepare.append(apply_response_headers)
+
     app.add_routes(checks_routes)
     app.add_routes(agent_routes)
-    
+    app.add_routes(schedule_routes)
+
+    app.on_startup.append(start_check_service)
+    app.on_startup.append(start_agents)
+    app.on_startup.append(start_scheduler)
+    app.on_shutdown.append(close_agent_channels)
+    app.on_shutdown.append(close_check_events)
+    app.on_shutdown.append(close_agent_events)
+    # Планировщик останавливается раньше сервиса проверок, которым пользуется
+    app.on_cleanup.append(close_scheduler)
+    app.on_cleanup.append(close_check_service)
+    app.on_cleanup.append(close_db)
+
     return app
-    
\ No newline at end of file
@@ -0,0 +1,227 @@
+"""
+Постоянные WebSocket каналы агентов.
+По каналу сервер сразу отправляет задачи из очереди (без опроса раз в 5 секунд)
+и отмены, а агент - результаты и heartbeat. Поток задач ограничен кредитами:
+агент сообщает, сколько задач готов принять (всего и по типам),
+и сервер не отправляет больше
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, List
+
+from aiohttp import WSCloseCode, WSMsgType, web
+
+from app.json_codec import loads
+
+logger = logging.getLogger(__name__)
+
+WS_HEARTBEAT = 20  # интервал ping WebSocket, секунды
+MAX_CREDITS = 100  # максимум задач в полете у одного агента
+
+
+class AgentChannel:
+    """
+    Канал одного агента.
+    Сообщения агента: hello (types, credits, type_credits, inflight), credit (credits,
+    type_credits), result, release, heartbeat. type_credits - кредиты по типам проверок;
+    если агент их не присылает, ограничен только общий кредит.
+    Сообщения сервера: task, cancel, ack, error (сообщение агента не разобрано,
+    канал при этом не закрывается)
+    """
+
+    def __init__(self, ws: web.WebSocketResponse, agent: Dict[str, Any], service, heartbeats):
+        self.ws = ws
+        self.agent = agent
+        self.service = service
+        self.heartbeats = heartbeats
+        self.capabilities = []
+        self.credits = 0
+        self.type_credits = None  # тип -> кредиты, None - без ограничений по типам
+        self._credit = asyncio.Event()
+
+    @property
+    def agent_id(self) -> int:
+        return self.agent["id"]
+
+    async def run(self):
+        """Обрабатывает сообщения агента, пока канал открыт"""
+        sender = asyncio.create_task(self._send_tasks())
+        try:
+            async for msg in self.ws:
+                if msg.type == WSMsgType.TEXT:
+                    try:
+                        message = loads(msg.data)
+                    except ValueError:
+                        await self.ws.send_json({"type": "error", "error": "Invalid JSON"})
+                        continue
+                    try:
+                        await self._handle(message)
+                    except ValueError as e:
+                        await self.ws.send_json({"type": "error", "error": str(e)})
+                elif msg.type == WSMsgType.ERROR:
+                    logger.warning(f"Ошибка канала агента {self.agent_id}: {self.ws.exception()}")
+                    break
+        finally:
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+
+    async def _handle(self, message: Any):
+        """Обрабатывает одно сообщение агента; ValueError - сообщение некорректно"""
+        if not isinstance(message, dict):
+            raise ValueError("Сообщение должно быть объектом")
+        # Любое сообщение агента - признак жизни
+        self.heartbeats.record(self.agent_id)
+        kind = message.get("type")
+
+        if kind == "hello":
+            types = _string_list(message.get("types"), "types")
+            self.capabilities = [t for t in types if t in self.service.tasks.lease_timeouts]
+            # Аренды, которые агент потерял при переподключении, сразу возвращаем в очередь
+            inflight = set(_string_list(message.get("inflight"), "inflight"))
+            released = self.service.tasks.release_agent(self.agent_id, keep=inflight)
+            if released:
+                logger.info(f"Агент {self.agent_id} переподключился, возвращено задач: {released}")
+            self.type_credits = {} if isinstance(message.get("type_credits"), dict) else None
+            self._grant(message.get("credits", 0), message.get("type_credits"))
+        elif kind == "credit":
+            self._grant(message.get("credits", 0), message.get("type_credits"))
+        elif kind == "release":
+            # Агент останавливается и возвращает задачи, которые не начал
+            tasks = message.get("tasks") or []
+            if not isinstance(tasks, list):
+                raise ValueError("tasks должен быть массивом")
+            for task in tasks:
+                if isinstance(task, dict) and isinstance(task.get("id"), str):
+                    self.service.tasks.release(task["id"], task.get("lease_id"))
+        elif kind == "result":
+            task_id = message.get("task_id")
+            if not isinstance(task_id, str):
+                raise ValueError("task_id должен быть строкой")
+            results = message.get("results")
+            accepted = isinstance(results, dict) and self.service.complete_task(
+                task_id, message.get("lease_id"), self.agent_id, results
+            )
+            await self.ws.send_json({
+                "type": "ack",
+                "task_id": task_id,
+                "status": "received" if accepted else "rejected"
+            })
+
+    def _grant(self, credits, type_credits=None):
+        if self.type_credits is not None and isinstance(type_credits, dict):
+            for check_type, count in type_credits.items():
+                if isinstance(count, int) and count > 0:
+                    self.type_credits[check_type] = min(self.type_credits.get(check_type, 0) + count, MAX_CREDITS)
+                    self._credit.set()
+        if isinstance(credits, int) and credits > 0:
+            self.credits = min(self.credits + credits, MAX_CREDITS)
+            self._credit.set()
+
+    def _claimable(self) -> List[str]:
+        """Типы, задачи которых агент может начать сразу"""
+        if self.type_credits is None:
+            return self.capabilities
+        return [t for t in self.capabilities if self.type_credits.get(t, 0) > 0]
+
+    async def _send_tasks(self):
+        """Отправляет задачи, как только они появляются и есть кредиты"""
+        queue = self.service.tasks
+        while True:
+            capabilities = self._claimable()
+            if self.credits <= 0 or not capabilities:
+                self._credit.clear()
+                await self._credit.wait()
+                continue
+
+            tasks = queue.claim(self.agent_id, self.agent.get("location"), capabilities,
+                                self.credits, self.type_credits)
+            if not tasks:
+                # Ждем задачу или кредит: кредит может открыть другие типы
+                self._credit.clear()
+                waiter = asyncio.ensure_future(queue.wait(self.agent.get("location"), capabilities))
+                credit = asyncio.ensure_future(self._credit.wait())
+                try:
+                    await asyncio.wait({waiter, credit}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    waiter.cancel()
+                    credit.cancel()
+                continue
+
+            self.credits -= len(tasks)
+            if self.type_credits is not None:
+                for task in tasks:
+                    self.type_credits[task["type"]] -= 1
+            for i, task in enumerate(tasks):
+                try:
+                    await self.ws.send_json({"type": "task", "task": task})
+                except (ConnectionError, RuntimeError):
+                    # Агент отключился - неотправленные задачи сразу отдаем другим
+                    for unsent in tasks[i:]:
+                        queue.release(unsent["id"], unsent["lease_id"])
+                    return
+
+    def cancel(self, task_ids: List[str]):
+        """Сообщает агенту об отмене задач"""
+        if not self.ws.closed:
+            asyncio.ensure_future(self.ws.send_json({"type": "cancel", "task_ids": task_ids}))
+
+
+def _string_list(value: Any, field: str) -> List[str]:
+    """Поле сообщения - массив строк (отсутствующее поле - пустой массив)"""
+    if value is None:
+        return []
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f"{field} должен быть массивом строк")
+    return value
+
+
+class AgentChannels:
+    """Реестр открытых каналов: agent_id -> канал"""
+
+    def __init__(self, service, heartbeats):
+        self.service = service
+        self.heartbeats = heartbeats
+        self._channels = {}
+        service.tasks.cancel_listeners.append(self._on_cancel)
+
+    def __len__(self):
+        return len(self._channels)
+
+    async def handle(self, request: web.Request, agent: Dict[str, Any]) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(heartbeat=WS_HEARTBEAT)
+        await ws.prepare(request)
+
+        # Новое подключение агента вытесняет старое
+        previous = self._channels.get(agent["id"])
+        if previous is not None:
+            await previous.ws.close(code=WSCloseCode.POLICY_VIOLATION, message=b"replaced")
+
+        channel = AgentChannel(ws, agent, self.service, self.heartbeats)
+        self._channels[agent["id"]] = channel
+        logger.info(f"Агент {agent['id']} подключился по WebSocket")
+        try:
+            await channel.run()
+        finally:
+            if self._channels.get(agent["id"]) is channel:
+                del self._channels[agent["id"]]
+            logger.info(f"Агент {agent['id']} отключился")
+        return ws
+
+    def _on_cancel(self, tasks: List[Dict[str, Any]]):
+        by_agent = {}
+        for task in tasks:
+            if task.get("agent_id") is not None:
+                by_agent.setdefault(task["agent_id"], []).append(task["id"])
+        for agent_id, task_ids in by_agent.items():
+            channel = self._channels.get(agent_id)
+            if channel is not None:
+                channel.cancel(task_ids)
+
+    async def close(self):
+        """Закрывает все каналы (при остановке сервера)"""
+        channels = list(self._channels.values())
+        await asyncio.gather(*(
+            channel.ws.close(code=WSCloseCode.GOING_AWAY, message=b"server shutdown")
+            for channel in channels
+        ), return_exceptions=True)
@@ -0,0 +1,51 @@
+"""
+Публикация событий агентов.
+Автомат статусов публикует переходы active/stale/offline, подписчики
+(SSE поток /api/agents/events) получают их через свою очередь
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = 10000  # столько непрочитанных событий ждет медленный подписчик
+
+
+class AgentEvents:
+    """Подписки на события агентов: у каждого подписчика своя ограниченная очередь"""
+
+    def __init__(self):
+        self._subscribers = set()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, event: Dict[str, Any]):
+        # Без подписчиков публикация ничего не стоит
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Подписчик не успевает читать - отключаем его, а не копим события без предела
+                logger.warning("Подписчик событий агентов отстал, поток закрывается")
+                self._subscribers.discard(queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+    def close(self):
+        """Завершает все подписки (при остановке сервера): подписчики получают None"""
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+        self._subscribers.clear()
@@ -0,0 +1,104 @@
+"""
+Индекс агентов в памяти процесса: токен -> запись агента и id -> запись.
+Загружается при старте и обновляется при создании (REPLACE) агентов,
+поэтому проверка токена на каждом heartbeat - поиск в словаре
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MISSING_TTL = 5.0  # сколько секунд помнить неизвестный токен
+MISSING_MAX = 10000  # максимум запомненных неизвестных токенов
+
+
+class AgentIndex:
+    """
+    Кэш агентов поверх agent_db. База читается только при промахе
+    (агент создан другим процессом) и при создании агента. Неизвестные
+    токены запоминаются на MISSING_TTL секунд, поэтому запросы со случайным
+    токеном не ходят в базу каждый раз
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._by_token = {}  # token -> запись агента
+        self._by_id = {}  # id -> запись агента
+        self._missing = OrderedDict()  # неизвестный token -> когда забыть (monotonic)
+        self._loaded = False
+
+    def __len__(self):
+        return len(self._by_token)
+
+    async def load(self):
+        """Загружает всех агентов из базы"""
+        agents = await self.db.async_get_all_agents(include_token=True)
+        self._by_token.clear()
+        self._by_id.clear()
+        for agent in agents:
+            self._put(agent)
+        self._loaded = True
+        logger.info(f"Загружено агентов в индекс: {len(agents)}")
+
+    def _put(self, agent: Dict[str, Any]):
+        self._by_token[agent["token"]] = agent
+        self._by_id[agent["id"]] = agent
+
+    def _drop(self, token: str) -> Optional[Dict[str, Any]]:
+        agent = self._by_token.pop(token, None)
+        if agent is not None:
+            self._by_id.pop(agent["id"], None)
+        return agent
+
+    def agents(self) -> List[Dict[str, Any]]:
+        """Все агенты индекса"""
+        return list(self._by_id.values())
+
+    def get_by_id(self, agent_id: int) -> Optional[Dict[str, Any]]:
+        return self._by_id.get(agent_id)
+
+    def has_token(self, token: str) -> bool:
+        """Известен ли токен (только индекс, без обращения к базе)"""
+        return token in self._by_token
+
+    async def get_by_token(self, token: str) -> Optional[Dict[str, Any]]:
+        """Агент по токену: из индекса, при промахе - из базы"""
+        agent = self._by_token.get(token)
+        if agent is not None:
+            return agent
+
+        expires_at = self._missing.get(token)
+        if expires_at is not None:
+            if expires_at > time.monotonic():
+                return None
+            del self._missing[token]
+
+        agent = await self.db.async_get_agent_by_token(token)
+        if agent is not None:
+            self._put(agent)
+        else:
+            self._missing[token] = time.monotonic() + MISSING_TTL
+            if len(self._missing) > MISSING_MAX:
+                self._missing.popitem(last=False)
+        return agent
+
+    async def create(self, name: str, location: str, ip: str,
+                     token: str) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """
+        Создает агента. REPLACE удаляет старую запись с тем же токеном
+        и создает новую с новым id, поэтому старая запись убирается из индекса.
+        Возвращает (новая запись, старая запись или None)
+        """
+        agent_id = await self.db.async_create_agent(name, location, ip, token)
+        self._missing.pop(token, None)
+        replaced = self._drop(token)
+
+        agent = await self.db.async_get_agent_by_token(token)
+        if agent is None or agent["id"] != agent_id:
+            # Токен успели перезаписать параллельным запросом - индекс заполнится при промахе
+            return {"id": agent_id}, replaced
+        self._put(agent)
+        return agent, replaced
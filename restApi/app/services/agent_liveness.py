@@ -0,0 +1,240 @@
+"""
+Состояние жизни агентов.
+Статус агента меняется по heartbeat и по истечении сроков:
+active -> stale (нет heartbeat STALE_AFTER секунд) -> offline (OFFLINE_AFTER секунд),
+любой heartbeat возвращает агента в active. Сроки всех агентов лежат в одной
+куче, поэтому цикл просыпается только к ближайшему сроку, а не пересчитывает
+статусы по last_heartbeat всей таблицы. Счетчики агентов по статусам
+обновляются при каждом переходе, число живых агентов читается за O(1)
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+STALE_AFTER = 60  # без heartbeat столько секунд агент stale (агент шлет heartbeat раз в 30 секунд)
+OFFLINE_AFTER = 120  # без heartbeat столько секунд агент offline
+MAX_SLEEP = 60  # цикл просыпается хотя бы раз в столько секунд
+TRANSITION_BATCH = 5000  # после стольких сроков подряд отдаем управление event loop
+
+ACTIVE = "active"
+STALE = "stale"
+OFFLINE = "offline"
+
+
+class AgentLiveness:
+    """
+    Конечный автомат статусов агентов.
+    У каждого агента один действующий срок (_deadlines); записи кучи с другим
+    сроком (агент удален или добавлен заново) устарели и пропускаются. Heartbeat
+    только запоминает время и кучу не трогает: когда срок наступает,
+    он пересчитывается от последнего heartbeat, и если агент был жив, в кучу
+    кладется запись с новым сроком. Переходы передаются слушателям
+    (listeners) и записываются в базу пачкой - только изменившиеся статусы.
+    Агенты, которые еще не присылали heartbeat (awaiting_heartbeat), сроков не имеют
+    """
+
+    def __init__(self, db, stale_after: float = STALE_AFTER, offline_after: float = OFFLINE_AFTER,
+                 clock: Callable[[], float] = time.monotonic):
+        self.db = db
+        self.stale_after = stale_after
+        self.offline_after = offline_after
+        self._clock = clock
+        self._status = {}  # agent_id -> статус
+        self._last_seen = {}  # agent_id -> время последнего heartbeat (clock)
+        self._deadlines = {}  # agent_id -> действующий срок в куче
+        self._heap = []  # куча (срок, agent_id), удаление ленивое
+        self._counts = {}  # статус -> число агентов
+        self._dirty = {}  # agent_id -> статус, еще не записанный в базу
+        self.revision = 0  # растет при каждом переходе
+        self.listeners = []  # вызываются с событием перехода
+        self._wakeup = None
+        self._loop_task = None
+
+    def __len__(self):
+        return len(self._status)
+
+    def load(self, agents: Iterable[Dict[str, Any]]):
+        """
+        Начальные статусы по записям из базы: срок отсчитывается от last_heartbeat,
+        поэтому после перезапуска сервера давно молчащие агенты сразу уходят в offline
+        """
+        now = self._clock()
+        utc_now = datetime.utcnow()
+        for agent in agents:
+            agent_id = agent["id"]
+            last_heartbeat = agent.get("last_heartbeat")
+            if not last_heartbeat:
+                self.add(agent_id, agent.get("status") or "inactive")
+                continue
+            try:
+                age = (utc_now - datetime.fromisoformat(last_heartbeat)).total_seconds()
+            except ValueError:
+                age = self.offline_after
+            self.add(agent_id, agent.get("status") or ACTIVE)
+            self._last_seen[agent_id] = now - max(age, 0)
+            self._arm(agent_id, self._last_seen[agent_id])
+
+    def start(self):
+        if self._loop_task is None:
+            self._wakeup = asyncio.Event()
+            self._loop_task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        await self.flush()
+
+    def add(self, agent_id: int, status: str = "awaiting_heartbeat"):
+        """Регистрирует агента (создан или загружен из базы)"""
+        if agent_id in self._status:
+            self.remove(agent_id)
+        self._status[agent_id] = status
+        self._counts[status] = self._counts.get(status, 0) + 1
+        self.revision += 1
+
+    def remove(self, agent_id: int):
+        """Убирает агента (запись пересоздана с новым id); запись в куче удалится лениво"""
+        status = self._status.pop(agent_id, None)
+        if status is None:
+            return
+        self._counts[status] -= 1
+        self._last_seen.pop(agent_id, None)
+        self._deadlines.pop(agent_id, None)
+        self._dirty.pop(agent_id, None)
+        self.revision += 1
+
+    def seen(self, agent_id: int):
+        """Heartbeat агента: O(1), без операций с кучей, пока агент жив"""
+        status = self._status.get(agent_id)
+        if status is None:
+            return  # агент неизвестен (несуществующий id)
+        now = self._clock()
+        self._last_seen[agent_id] = now
+        if status != ACTIVE:
+            # В базу active запишет сброс heartbeat; незаписанный stale/offline уже не нужен
+            self._dirty.pop(agent_id, None)
+            self._transition(agent_id, ACTIVE, persist=False)
+        if agent_id not in self._deadlines:
+            self._arm(agent_id, now)
+
+    def status(self, agent_id: int) -> Optional[str]:
+        return self._status.get(agent_id)
+
+    def apply(self, agent: Dict[str, Any]) -> Dict[str, Any]:
+        """Подставляет в запись агента из базы текущий статус"""
+        status = self._status.get(agent["id"])
+        if status is not None:
+            agent["status"] = status
+        return agent
+
+    def count(self, status: str = ACTIVE) -> int:
+        """Число агентов в статусе, O(1)"""
+        return self._counts.get(status, 0)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "total": len(self._status),
+            "healthy": self.count(ACTIVE),
+            "statuses": {status: count for status, count in self._counts.items() if count},
+        }
+
+    def _arm(self, agent_id: int, last_seen: float):
+        status = self._status[agent_id]
+        if status == OFFLINE:
+            deadline = None
+        elif status == STALE:
+            deadline = last_seen + self.offline_after
+        else:
+            deadline = last_seen + self.stale_after
+        if deadline is None:
+            return
+        self._deadlines[agent_id] = deadline
+        heapq.heappush(self._heap, (deadline, agent_id))
+        # Новый срок раньше текущего ожидания цикла - будим его
+        if self._wakeup is not None and self._heap[0][1] == agent_id:
+            self._wakeup.set()
+
+    def _transition(self, agent_id: int, status: str, persist: bool = True):
+        previous = self._status[agent_id]
+        self._status[agent_id] = status
+        self._counts[previous] -= 1
+        self._counts[status] = self._counts.get(status, 0) + 1
+        self.revision += 1
+        if persist:
+            self._dirty[agent_id] = status
+
+        event = {"agent_id": agent_id, "from": previous, "to": status, "at": time.time()}
+        for listener in list(self.listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика перехода агента {agent_id}: {e}")
+
+    def expire(self, limit: int = TRANSITION_BATCH) -> int:
+        """Обрабатывает до limit наступивших сроков, возвращает число переходов"""
+        now = self._clock()
+        transitions = 0
+        for _ in range(limit):
+            if not self._heap or self._heap[0][0] > now:
+                break
+            deadline, agent_id = heapq.heappop(self._heap)
+            if self._deadlines.get(agent_id) != deadline:
+                continue  # агент удален или у него уже другой срок
+            del self._deadlines[agent_id]
+            last_seen = self._last_seen.get(agent_id, now)
+            idle = now - last_seen
+            status = self._status[agent_id]
+            if idle >= self.offline_after:
+                next_status = OFFLINE
+            elif idle >= self.stale_after:
+                next_status = STALE
+            else:
+                next_status = ACTIVE
+            if next_status != status:
+                self._transition(agent_id, next_status)
+                transitions += 1
+            # Агент жил - срок переносится от его последнего heartbeat
+            self._arm(agent_id, last_seen)
+        return transitions
+
+    async def flush(self) -> bool:
+        """Записывает накопленные переходы одной транзакцией, возвращает успех"""
+        if not self._dirty:
+            return True
+        batch, self._dirty = self._dirty, {}
+        try:
+            await self.db.async_update_statuses(list(batch.items()))
+        except Exception as e:
+            logger.error(f"Ошибка записи статусов агентов: {e}")
+            # Возвращаем пачку, не перетирая более свежие переходы
+            for agent_id, status in batch.items():
+                if agent_id in self._status:
+                    self._dirty.setdefault(agent_id, status)
+            return False
+        return True
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            transitions = self.expire()
+            if transitions:
+                logger.info(f"Переходов статуса агентов: {transitions}, активных: {self.count(ACTIVE)}")
+            await self.flush()
+            if self._heap and self._heap[0][0] <= self._clock():
+                # Сроков больше одной пачки - продолжаем, отдав управление event loop
+                await asyncio.sleep(0)
+                continue
+
+            timeout = self._heap[0][0] - self._clock() if self._heap else MAX_SLEEP
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), min(max(timeout, 0), MAX_SLEEP))
+            except asyncio.TimeoutError:
+                pass
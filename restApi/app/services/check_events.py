@@ -0,0 +1,51 @@
+"""
+Внутренняя публикация событий проверок.
+Сервис проверок публикует результат каждого типа и смену статуса,
+подписчики (SSE поток, long-poll запрос) получают их через свою очередь
+вместо опроса хранилища
+"""
+
+import asyncio
+from typing import Any, Dict, Optional
+
+
+class CheckEvents:
+    """Подписки на события проверок: check_id -> очереди подписчиков"""
+
+    def __init__(self):
+        self._subscribers = {}
+
+    def subscribe(self, check_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(check_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, check_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(check_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[check_id]
+
+    def publish(self, check_id: str, event: Dict[str, Any]):
+        # Без подписчиков публикация - один поиск в словаре
+        for queue in self._subscribers.get(check_id, ()):
+            queue.put_nowait(event)
+
+    async def wait(self, check_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Ждет следующее событие проверки; None - таймаут"""
+        queue = self.subscribe(check_id)
+        try:
+            return await asyncio.wait_for(queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.unsubscribe(check_id, queue)
+
+    def close(self):
+        """Завершает все подписки (при остановке сервера): подписчики получают None"""
+        for queues in self._subscribers.values():
+            for queue in queues:
+                queue.put_nowait(None)
+        self._subscribers.clear()
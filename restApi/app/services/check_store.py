@@ -0,0 +1,445 @@
+"""
+Постоянное хранилище проверок и их результатов.
+CheckStore - интерфейс, SQLiteCheckStore - реализация по умолчанию (WAL),
+PostgresCheckStore - реализация на asyncpgsa для общего хранилища нескольких процессов
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.5  # как часто сбрасывать накопленные записи, секунды
+FLUSH_BATCH_SIZE = 500  # сбросить раньше, если накопилось столько записей
+CHECK_RETENTION = timedelta(days=7)  # сколько хранить проверки
+SWEEP_INTERVAL = 600  # как часто удалять устаревшие проверки, секунды
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+# Статусы, при которых проверка еще выполняется и не удаляется
+ACTIVE_STATUSES = ("queued", "in_progress")
+
+
+def utc_now() -> str:
+    """Текущее время UTC в ISO 8601; строки такого вида сравниваются как даты"""
+    return datetime.utcnow().strftime(TIME_FORMAT)
+
+
+class CheckStore:
+    """
+    Интерфейс хранилища проверок.
+    save() только ставит запись в очередь: записи копятся и сбрасываются
+    одной транзакцией раз в FLUSH_INTERVAL или при FLUSH_BATCH_SIZE записях
+    """
+
+    def __init__(self):
+        self._dirty = {}  # check_id -> последняя версия записи
+        self._flushing = {}  # записи, которые сейчас пишутся в базу
+        self._flush_needed = None
+        self._flush_lock = None
+        self._tasks = []
+        self._started = False
+
+    async def start(self):
+        """Открывает хранилище и запускает фоновые сброс и очистку"""
+        if self._started:
+            return
+        self._started = True
+        await self._open()
+        self._flush_needed = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._flush_loop()),
+            asyncio.create_task(self._sweep_loop()),
+        ]
+
+    async def close(self):
+        """Останавливает фоновые задачи и сбрасывает накопленные записи"""
+        if not self._started:
+            return
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+        await self._close()
+        self._started = False
+
+    def save(self, check: Dict[str, Any]):
+        """Ставит запись проверки в очередь на запись"""
+        self._dirty[check["id"]] = check
+        if self._flush_needed is not None and len(self._dirty) >= FLUSH_BATCH_SIZE:
+            self._flush_needed.set()
+
+    async def get(self, check_id: str) -> Optional[Dict[str, Any]]:
+        """Получает проверку по ID (с учетом еще не сброшенных записей)"""
+        check = self._dirty.get(check_id) or self._flushing.get(check_id)
+        if check is not None:
+            return check
+        await self.start()
+        return await self._get(check_id)
+
+    async def list(self, status: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Последние проверки, опционально с фильтром по статусу"""
+        await self.start()
+        await self.flush()
+        return await self._list(status, limit)
+
+    async def flush(self, raise_errors: bool = False) -> bool:
+        """
+        Записывает все накопленные изменения одной транзакцией, возвращает успех.
+        Если запись не удалась, записи возвращаются в очередь (более новые версии
+        не перетираются); с raise_errors=True ошибка пробрасывается вызывающему
+        """
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._dirty:
+                return True
+            # Сериализуем в event loop, пока записи не изменились
+            rows = [self._to_row(check) for check in self._dirty.values()]
+            self._flushing, self._dirty = self._dirty, {}
+            try:
+                await self._write(rows)
+            except Exception as e:
+                logger.error(f"Ошибка записи проверок в хранилище: {e}")
+                for check_id, check in self._flushing.items():
+                    self._dirty.setdefault(check_id, check)
+                if raise_errors:
+                    raise
+                return False
+            finally:
+                self._flushing = {}
+            return True
+
+    async def save_schedule(self, schedule: Dict[str, Any]):
+        """Сохраняет определение периодической проверки (записывается сразу)"""
+        await self.start()
+        await self._save_schedule(schedule["id"], json.dumps(schedule))
+
+    async def delete_schedule(self, schedule_id: str) -> bool:
+        """Удаляет определение периодической проверки"""
+        await self.start()
+        return await self._delete_schedule(schedule_id)
+
+    async def load_schedules(self) -> List[Dict[str, Any]]:
+        """Все сохраненные определения периодических проверок"""
+        await self.start()
+        return [json.loads(row) for row in await self._load_schedules()]
+
+    async def sweep(self):
+        """Удаляет завершенные проверки старше CHECK_RETENTION"""
+        cutoff = (datetime.utcnow() - CHECK_RETENTION).strftime(TIME_FORMAT)
+        deleted = await self._delete_older_than(cutoff)
+        if deleted:
+            logger.info(f"Удалено устаревших проверок: {deleted}")
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_needed.wait(), FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_needed.clear()
+            await self.flush()
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Ошибка очистки хранилища проверок: {e}")
+            await asyncio.sleep(SWEEP_INTERVAL)
+
+    @staticmethod
+    def _to_row(check: Dict[str, Any]) -> tuple:
+        return (
+            check["id"],
+            check["target"],
+            json.dumps(check["checks"]),
+            check["status"],
+            json.dumps(check["results"]),
+            check["created_at"],
+            utc_now(),
+        )
+
+    @staticmethod
+    def _from_row(row) -> Dict[str, Any]:
+        return {
+            "id": row[0],
+            "target": row[1],
+            "checks": json.loads(row[2]),
+            "status": row[3],
+            "results": json.loads(row[4]) if row[4] else {},
+            "created_at": row[5],
+        }
+
+    # Методы конкретного хранилища
+
+    async def _open(self):
+        raise NotImplementedError
+
+    async def _close(self):
+        raise NotImplementedError
+
+    async def _write(self, rows: List[tuple]):
+        raise NotImplementedError
+
+    async def _get(self, check_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def _list(self, status: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def _delete_older_than(self, cutoff: str) -> int:
+        raise NotImplementedError
+
+    async def _save_schedule(self, schedule_id: str, definition: str):
+        raise NotImplementedError
+
+    async def _delete_schedule(self, schedule_id: str) -> bool:
+        raise NotImplementedError
+
+    async def _load_schedules(self) -> List[str]:
+        raise NotImplementedError
+
+
+class SQLiteCheckStore(CheckStore):
+    """
+    Хранилище проверок в SQLite (WAL).
+    Все обращения к базе идут через один поток, event loop не блокируется
+    """
+
+    def __init__(self, db_path: str = "checks.db"):
+        super().__init__()
+        self.db_path = db_path
+        self._db = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="check-store")
+
+    def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self._executor, func, *args)
+
+    async def _open(self):
+        await self._run(self._open_sync)
+
+    def _open_sync(self):
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        cur = self._db.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS CHECKS (
+            id TEXT PRIMARY KEY,
+            target TEXT NOT NULL,
+            checks TEXT NOT NULL,
+            status TEXT NOT NULL,
+            results TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+            )
+            """
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_checks_status ON CHECKS (status)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_checks_created_at ON CHECKS (created_at)")
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS SCHEDULES (
+            id TEXT PRIMARY KEY,
+            definition TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+            )
+            """
+        )
+        self._db.commit()
+
+    async def _close(self):
+        await self._run(self._db.close)
+        self._executor.shutdown(wait=True)
+
+    async def _write(self, rows):
+        await self._run(self._write_sync, rows)
+
+    def _write_sync(self, rows):
+        with self._db:
+            self._db.executemany(
+                """
+                REPLACE INTO CHECKS (id, target, checks, status, results, created_at, updated_at)
+                VALUES (?,?,?,?,?,?,?)
+                """,
+                rows
+            )
+
+    async def _get(self, check_id):
+        return await self._run(self._get_sync, check_id)
+
+    def _get_sync(self, check_id):
+        row = self._db.execute(
+            "SELECT id, target, checks, status, results, created_at FROM CHECKS WHERE id = ?",
+            (check_id,)
+        ).fetchone()
+        return self._from_row(row) if row else None
+
+    async def _list(self, status, limit):
+        return await self._run(self._list_sync, status, limit)
+
+    def _list_sync(self, status, limit):
+        query = "SELECT id, target, checks, status, results, created_at FROM CHECKS"
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        return [self._from_row(row) for row in self._db.execute(query, params).fetchall()]
+
+    async def _delete_older_than(self, cutoff):
+        return await self._run(self._delete_sync, cutoff)
+
+    def _delete_sync(self, cutoff):
+        with self._db:
+            cur = self._db.execute(
+                f"DELETE FROM CHECKS WHERE created_at < ? AND status NOT IN ({','.join('?' * len(ACTIVE_STATUSES))})",
+                (cutoff, *ACTIVE_STATUSES)
+            )
+            return cur.rowcount
+
+    async def _save_schedule(self, schedule_id, definition):
+        await self._run(self._save_schedule_sync, schedule_id, definition)
+
+    def _save_schedule_sync(self, schedule_id, definition):
+        with self._db:
+            self._db.execute(
+                "REPLACE INTO SCHEDULES (id, definition, updated_at) VALUES (?,?,?)",
+                (schedule_id, definition, utc_now())
+            )
+
+    async def _delete_schedule(self, schedule_id):
+        return await self._run(self._delete_schedule_sync, schedule_id)
+
+    def _delete_schedule_sync(self, schedule_id):
+        with self._db:
+            return self._db.execute("DELETE FROM SCHEDULES WHERE id = ?", (schedule_id,)).rowcount > 0
+
+    async def _load_schedules(self):
+        return await self._run(self._load_schedules_sync)
+
+    def _load_schedules_sync(self):
+        return [row[0] for row in self._db.execute("SELECT definition FROM SCHEDULES").fetchall()]
+
+
+class PostgresCheckStore(CheckStore):
+    """Хранилище проверок в PostgreSQL через пул asyncpgsa"""
+
+    def __init__(self, dsn: str):
+        super().__init__()
+        self.dsn = dsn
+        self._pool = None
+
+    async def _open(self):
+        import asyncpgsa
+
+        self._pool = await asyncpgsa.create_pool(self.dsn, min_size=1, max_size=10)
+        await self._pool.execute(
+            """
+            CREATE TABLE IF NOT EXISTS checks (
+            id TEXT PRIMARY KEY,
+            target TEXT NOT NULL,
+            checks TEXT NOT NULL,
+            status TEXT NOT NULL,
+            results TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+            )
+            """
+        )
+        await self._pool.execute("CREATE INDEX IF NOT EXISTS idx_checks_status ON checks (status)")
+        await self._pool.execute("CREATE INDEX IF NOT EXISTS idx_checks_created_at ON checks (created_at)")
+        await self._pool.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schedules (
+            id TEXT PRIMARY KEY,
+            definition TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+            )
+            """
+        )
+
+    async def _close(self):
+        await self._pool.close()
+
+    async def _write(self, rows):
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany(
+                    """
+                    INSERT INTO checks (id, target, checks, status, results, created_at, updated_at)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7)
+                    ON CONFLICT (id) DO UPDATE SET
+                    status = EXCLUDED.status, results = EXCLUDED.results, updated_at = EXCLUDED.updated_at
+                    """,
+                    rows
+                )
+
+    async def _get(self, check_id):
+        row = await self._pool.fetchrow(
+            "SELECT id, target, checks, status, results, created_at FROM checks WHERE id = $1",
+            check_id
+        )
+        return self._from_row(row) if row else None
+
+    async def _list(self, status, limit):
+        if status:
+            rows = await self._pool.fetch(
+                "SELECT id, target, checks, status, results, created_at FROM checks "
+                "WHERE status = $1 ORDER BY created_at DESC LIMIT $2",
+                status, limit
+            )
+        else:
+            rows = await self._pool.fetch(
+                "SELECT id, target, checks, status, results, created_at FROM checks "
+                "ORDER BY created_at DESC LIMIT $1",
+                limit
+            )
+        return [self._from_row(row) for row in rows]
+
+    async def _delete_older_than(self, cutoff):
+        result = await self._pool.execute(
+            "DELETE FROM checks WHERE created_at < $1 AND NOT (status = ANY($2::text[]))",
+            cutoff, list(ACTIVE_STATUSES)
+        )
+        return int(result.split()[-1])
+
+    async def _save_schedule(self, schedule_id, definition):
+        await self._pool.execute(
+            """
+            INSERT INTO schedules (id, definition, updated_at) VALUES ($1, $2, $3)
+            ON CONFLICT (id) DO UPDATE SET
+            definition = EXCLUDED.definition, updated_at = EXCLUDED.updated_at
+            """,
+            schedule_id, definition, utc_now()
+        )
+
+    async def _delete_schedule(self, schedule_id):
+        result = await self._pool.execute("DELETE FROM schedules WHERE id = $1", schedule_id)
+        return int(result.split()[-1]) > 0
+
+    async def _load_schedules(self):
+        rows = await self._pool.fetch("SELECT definition FROM schedules")
+        return [row[0] for row in rows]
+
+
+def create_check_store() -> CheckStore:
+    """
+    Создает хранилище по переменной окружения CHECKS_DB:
+    postgres://... или postgresql://... - PostgreSQL, иначе путь к файлу SQLite
+    """
+    location = os.environ.get("CHECKS_DB", "checks.db")
+    if location.startswith(("postgres://", "postgresql://")):
+        return PostgresCheckStore(location)
+    return SQLiteCheckStore(location)
@@ -1,81 +1,107 @@
 import sys
 import os
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from typing import Dict, List, Any
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Any, Tuple
 import uuid
 
+from app.services.check_events import CheckEvents
+from app.services.check_store import CheckStore, create_check_store, utc_now
+from app.services.task_queue import TaskQueue
+
+logger = logging.getLogger(__name__)
+
 # Добавляем путь к папке checks
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'checks'))
 
 # Импортируем функции проверок
 try:
-    from PING import advanced_ping_check
+    from PING import async_ping_check, close_pingers
 except ImportError:
-    def advanced_ping_check(target, count=5):
+    async def async_ping_check(target, count=5):
         return {"error": "Ping check not available"}
+
+    def close_pingers():
+        pass
     
 try:
-    from HTTP import http_ping_check
+    from HTTP import async_http_ping_check, close_http_session
 except ImportError:
-    def http_ping_check(target, count=5):
-        return {"error": "HTTP check not available"}
+    async def async_http_ping_check(target, count=5):
+        raise RuntimeError("HTTP check not available")
+
+    async def close_http_session():
+        pass
 
 try:
-    from TCP_connect import simple_tcp_ping
+    from TCP_connect import async_tcp_ping, tcp_sweep
 except ImportError:
-    def simple_tcp_ping(target, count=5, port=None):
+    async def async_tcp_ping(target, count=5, port=None):
         return {"error": "TCP check not available"}
 
+    async def tcp_sweep(hosts, ports, count=1, timeout=None):
+        return [{"error": "TCP check not available"} for _ in hosts for _ in ports]
+
 try:
-    from DNS import check_all_records
+    from DNS import async_check_all_records
 except ImportError:
-    def check_all_records(target, dns_server=None):
+    async def async_check_all_records(target, dns_server=None):
         return {"error": "DNS check not available"}
 
 try:
-    from traceroute import execute_traceroute
+    from traceroute import async_traceroute
 except ImportError:
-    def execute_traceroute(target, max_hops=30):
+    async def async_traceroute(target, max_hops=30, on_hop=None):
         return {"error": "Traceroute not available"}
 
+from check_results import CHECK_TIMEOUTS, DEFAULT_CHECK_TIMEOUT
+
+BATCH_CONCURRENCY = 256  # сколько проверок из пакетов выполняются одновременно
+BATCH_RETENTION = 3600  # сколько хранить статус завершенного пакета, секунды
+TCP_SWEEP_TIMEOUT = 3  # таймаут подключения при обходе портов, секунды
+
 class CheckService:
     """Сервис для выполнения различных сетевых проверок"""
     
-    def __init__(self):
-        self.checks_storage = {}  # Временное хранилище результатов
-        self.executor = ThreadPoolExecutor(max_workers=5)
+    def __init__(self, store: CheckStore = None):
+        self.store = store or create_check_store()  # Постоянное хранилище проверок
+        self._active = {}  # check_id -> запись выполняющейся проверки
+        self._running = {}  # check_id -> задачи выполняющихся проверок
+        self._remote = {}  # check_id -> типы проверок, ожидающие результата от агентов
+        self.completion_listeners = []  # вызываются с записью завершенной проверки
+        self.events = CheckEvents()  # результаты и статусы для SSE и long-poll
+        # Пакеты проверок: запускаются по очереди из всех пакетов (round-robin),
+        # не больше BATCH_CONCURRENCY одновременно
+        self._batches = OrderedDict()  # batch_id -> пакет
+        self._batch_order = deque()  # пакеты, в которых есть незапущенные проверки
+        self._batch_of = {}  # check_id -> batch_id для незавершенных проверок пакетов
+        self._batch_pending = set()  # check_id, еще ожидающие запуска
+        self._batch_running = 0
+        self._pumping = False
+        # Очередь проб для агентов
+        self.tasks = TaskQueue(CHECK_TIMEOUTS, DEFAULT_CHECK_TIMEOUT,
+                               on_lease=self._on_task_leased, on_done=self._on_task_done)
     
-    def _run_in_executor(self, func, *args, **kwargs):
-        """Запускает синхронную функцию в отдельном потоке"""
-        loop = asyncio.get_event_loop()
-        return loop.run_in_executor(self.executor, func, *args, **kwargs)
+    async def start(self):
+        """Открывает хранилище и запускает очередь задач агентов"""
+        await self.store.start()
+        self.tasks.start()
     
-    def _capture_output(self, func, *args, **kwargs):
-        """Выполняет функцию и перехватывает stdout"""
-        from io import StringIO
-        import sys
-        
-        old_stdout = sys.stdout
-        sys.stdout = captured_output = StringIO()
-        
-        try:
-            func(*args, **kwargs)
-            output = captured_output.getvalue()
-            return {"success": True, "output": output}
-        except Exception as e:
-            return {"success": False, "error": str(e)}
-        finally:
-            sys.stdout = old_stdout
+    @staticmethod
+    def _to_result(record) -> Dict[str, Any]:
+        """Превращает результат проверки (ProbeResult, DnsResult...) в словарь для JSON"""
+        if isinstance(record, dict):
+            return {"success": "error" not in record, **record}
+        return {"success": record.success, **record.to_dict()}
     
     async def run_ping_check(self, target: str) -> Dict[str, Any]:
-        """Выполняет ping проверку"""
-        result = await self._run_in_executor(
-            self._capture_output, 
-            advanced_ping_check, 
-            target, 
-            5
-        )
+        """Выполняет ICMP ping проверку прямо в event loop"""
+        try:
+            result = self._to_result(await async_ping_check(target, 5))
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
         return {
             "type": "ping",
             "target": target,
@@ -87,12 +113,11 @@ class CheckService:
         if not target.startswith(('http://', 'https://')):
             target = f"https://{target}" if is_https else f"http://{target}"
         
-        result = await self._run_in_executor(
-            self._capture_output,
-            http_ping_check,
-            target,
-            5
-        )
+        # Выполняется прямо в event loop через общий пул aiohttp, без потоков
+        try:
+            result = self._to_result(await async_http_ping_check(target, 5))
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
         return {
             "type": "https" if is_https else "http",
             "target": target,
@@ -100,96 +125,341 @@ class CheckService:
         }
     
     async def run_tcp_check(self, target: str) -> Dict[str, Any]:
-        """Выполняет TCP проверку"""
-        result = await self._run_in_executor(
-            self._capture_output,
-            simple_tcp_ping,
-            target,
-            5,
-            None
-        )
+        """Выполняет TCP проверку прямо в event loop"""
+        try:
+            result = self._to_result(await async_tcp_ping(target, 5))
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
         return {
             "type": "tcp",
             "target": target,
             **result
         }
     
+    async def run_tcp_sweep(self, targets: List[str], ports: List[int], count: int = 1) -> List[Dict[str, Any]]:
+        """Проверяет TCP подключение ко всем парам target x port за один вызов"""
+        records = await tcp_sweep(targets, ports, count, timeout=TCP_SWEEP_TIMEOUT)
+        return [self._to_result(record) for record in records]
+    
     async def run_dns_check(self, target: str) -> Dict[str, Any]:
-        """Выполняет DNS проверку"""
-        result = await self._run_in_executor(
-            self._capture_output,
-            check_all_records,
-            target,
-            None
-        )
+        """Выполняет DNS проверку: все типы записей параллельно, без потоков"""
+        try:
+            result = self._to_result(await async_check_all_records(target, None))
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
         return {
             "type": "dns",
             "target": target,
             **result
         }
     
-    async def run_traceroute_check(self, target: str) -> Dict[str, Any]:
-        """Выполняет traceroute"""
-        result = await self._run_in_executor(
-            self._capture_output,
-            execute_traceroute,
-            target,
-            30
-        )
+    async def run_traceroute_check(self, target: str, on_update=None) -> Dict[str, Any]:
+        """
+        Выполняет нативный traceroute: пробы всех прыжков уходят параллельно.
+        on_update(result) получает частичный результат после каждого прыжка
+        """
+        def on_hop(partial):
+            if on_update:
+                on_update({"type": "traceroute", "target": target, "status": "in_progress", **self._to_result(partial)})
+        
+        try:
+            result = self._to_result(await async_traceroute(target, 30, on_hop=on_hop))
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
         return {
             "type": "traceroute",
             "target": target,
             **result
         }
     
-    async def create_check(self, target: str, checks: List[str]) -> str:
-        """Создает новую проверку и возвращает ID"""
-        check_id = str(uuid.uuid4())
-        
-        self.checks_storage[check_id] = {
-            "id": check_id,
+    async def create_check(self, target: str, checks: List[str], executor: str = "local",
+                           location: str = None) -> str:
+        """
+        Создает новую проверку и возвращает ID.
+        executor="agent" - пробы выполняют агенты (location - только агенты этой локации)
+        """
+        await self.start()
+        check_id = self._new_check(target, checks)["id"]
+        self._dispatch(check_id, target, checks, executor, location)
+        return check_id
+    
+    def _new_check(self, target: str, checks: List[str]) -> Dict[str, Any]:
+        check = {
+            "id": str(uuid.uuid4()),
             "target": target,
             "checks": checks,
             "status": "queued",
             "results": {},
-            "created_at": None
+            "created_at": utc_now()
         }
+        self._active[check["id"]] = check
+        self.store.save(check)
+        return check
+    
+    def _dispatch(self, check_id: str, target: str, checks: List[str], executor: str, location: str = None):
+        if executor == "agent":
+            self._enqueue_for_agents(check_id, target, checks, location)
+        else:
+            asyncio.create_task(self._execute_checks(check_id, target, checks))
+    
+    async def create_batch(self, items: List[Tuple[str, List[str]]], executor: str = "local",
+                           location: str = None) -> Dict[str, Any]:
+        """
+        Создает пакет проверок из пар (target, checks). Проверки пакета ждут
+        своей очереди: запускаются поочередно из всех пакетов, поэтому большой
+        пакет не задерживает остальные, а одиночные проверки идут без очереди
+        """
+        await self.start()
+        self._prune_batches()
+        batch = {
+            "id": str(uuid.uuid4()),
+            "executor": executor,
+            "location": location,
+            "created_at": utc_now(),
+            "finished_at": None,
+            "finished_ts": None,
+            "total": len(items),
+            "pending": deque(),
+            "counts": {"queued": 0, "in_progress": 0, "completed": 0, "cancelled": 0, "failed": 0},
+        }
+        created = []
+        for target, checks in items:
+            check = self._new_check(target, checks)
+            batch["pending"].append(check["id"])
+            self._batch_of[check["id"]] = batch["id"]
+            self._batch_pending.add(check["id"])
+            created.append({"target": target, "checkId": check["id"]})
+        batch["counts"]["queued"] = len(created)
+        self._batches[batch["id"]] = batch
+        if created:
+            self._batch_order.append(batch)
+        else:
+            self._finish_batch(batch)
+        self._pump_batches()
+        return {"batchId": batch["id"], "total": batch["total"], "checks": created}
+    
+    def _pump_batches(self):
+        """Запускает ожидающие проверки пакетов, пока есть свободные места"""
+        # Проверка может завершиться прямо при запуске и снова вызвать pump
+        if self._pumping:
+            return
+        self._pumping = True
+        try:
+            while self._batch_running < BATCH_CONCURRENCY and self._batch_order:
+                batch = self._batch_order.popleft()
+                check_id = batch["pending"].popleft()
+                if batch["pending"]:
+                    self._batch_order.append(batch)
+                # Отмененные до запуска проверки удаляются из очереди лениво
+                if check_id not in self._batch_pending:
+                    continue
+                self._batch_pending.discard(check_id)
+                self._batch_running += 1
+                batch["counts"]["queued"] -= 1
+                batch["counts"]["in_progress"] += 1
+                check = self._active[check_id]
+                self._dispatch(check_id, check["target"], check["checks"], batch["executor"], batch["location"])
+        finally:
+            self._pumping = False
+    
+    def _on_batch_check_done(self, check: Dict[str, Any]):
+        batch = self._batches.get(self._batch_of.pop(check["id"], None))
+        if batch is None:
+            return
+        counts = batch["counts"]
+        if check["id"] in self._batch_pending:
+            self._batch_pending.discard(check["id"])
+            counts["queued"] -= 1
+        else:
+            counts["in_progress"] -= 1
+            self._batch_running -= 1
+        counts[check["status"]] += 1
+        if any(not r.get("success", False) for r in check["results"].values()):
+            counts["failed"] += 1
+        if counts["queued"] == 0 and counts["in_progress"] == 0:
+            self._finish_batch(batch)
+        self._pump_batches()
+    
+    @staticmethod
+    def _finish_batch(batch: Dict[str, Any]):
+        batch["finished_at"] = utc_now()
+        batch["finished_ts"] = time.monotonic()
+    
+    def _prune_batches(self):
+        """Забывает завершенные пакеты старше BATCH_RETENTION"""
+        cutoff = time.monotonic() - BATCH_RETENTION
+        for batch_id in [b["id"] for b in self._batches.values()
+                         if b["finished_ts"] is not None and b["finished_ts"] < cutoff]:
+            del self._batches[batch_id]
+    
+    def get_batch(self, batch_id: str) -> Dict[str, Any]:
+        """Сводный прогресс пакета или None"""
+        batch = self._batches.get(batch_id)
+        if batch is None:
+            return None
+        return {
+            "batchId": batch["id"],
+            "status": "completed" if batch["finished_at"] else "in_progress",
+            "total": batch["total"],
+            **batch["counts"],
+            "executor": batch["executor"],
+            "location": batch["location"],
+            "created_at": batch["created_at"],
+            "finished_at": batch["finished_at"],
+        }
+    
+    def _enqueue_for_agents(self, check_id: str, target: str, checks: List[str], location: str = None):
+        """Ставит пробы проверки в очередь агентов"""
+        check_types = [t for t in dict.fromkeys(checks) if t in CHECK_TIMEOUTS]
+        if not check_types:
+            self._finish(check_id, "completed")
+            return
+        self._remote[check_id] = set(check_types)
+        for check_type in check_types:
+            self.tasks.put(check_id, check_type, target, location)
+    
+    def _on_task_leased(self, task: Dict[str, Any]):
+        check = self._active.get(task["check_id"])
+        if check is not None and check["status"] == "queued":
+            self._set_status(task["check_id"], "in_progress")
+    
+    def _on_task_done(self, task: Dict[str, Any], result: Dict[str, Any]):
+        """Записывает результат пробы от агента, завершает проверку после последней пробы"""
+        check_id = task["check_id"]
+        self._publish_result(check_id, task["type"], result)
         
-        asyncio.create_task(self._execute_checks(check_id, target, checks))
-        return check_id
+        remaining = self._remote.get(check_id)
+        if remaining is None:
+            return
+        remaining.discard(task["type"])
+        if not remaining:
+            del self._remote[check_id]
+            self._finish(check_id, "completed")
     
-    async def _execute_checks(self, check_id: str, target: str, checks: List[str]):
-        """Выполняет все проверки"""
-        self.checks_storage[check_id]["status"] = "in_progress"
-        results = {}
+    def complete_task(self, task_id: str, lease_id: str, agent_id: int, result: Dict[str, Any]) -> bool:
+        """Принимает результат задачи от агента; False - аренда истекла или чужая"""
+        return self.tasks.complete(task_id, lease_id, agent_id, {**result, "agent_id": agent_id})
+    
+    def _check_coroutine(self, check_id: str, check_type: str, target: str):
+        """Возвращает корутину для типа проверки или None, если тип неизвестен"""
+        if check_type == "ping":
+            return self.run_ping_check(target)
+        elif check_type == "http":
+            return self.run_http_check(target, is_https=False)
+        elif check_type == "https":
+            return self.run_http_check(target, is_https=True)
+        elif check_type == "tcp":
+            return self.run_tcp_check(target)
+        elif check_type == "dns":
+            return self.run_dns_check(target)
+        elif check_type == "traceroute":
+            # Прыжки публикуются по мере прихода
+            return self.run_traceroute_check(
+                target, on_update=lambda partial: self._publish_result(check_id, check_type, partial)
+            )
+        return None
+    
+    async def _run_single_check(self, check_id: str, check_type: str, target: str):
+        """Выполняет одну проверку со своим дедлайном и сразу публикует результат"""
+        timeout = CHECK_TIMEOUTS.get(check_type, DEFAULT_CHECK_TIMEOUT)
+        try:
+            result = await asyncio.wait_for(self._check_coroutine(check_id, check_type, target), timeout)
+        except asyncio.TimeoutError:
+            result = {"success": False, "error": f"Превышен таймаут проверки ({timeout} с)"}
+        except asyncio.CancelledError:
+            self._publish_result(check_id, check_type, {"success": False, "error": "Проверка отменена"})
+            raise
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
         
-        for check_type in checks:
+        self._publish_result(check_id, check_type, result)
+    
+    def _publish_result(self, check_id: str, check_type: str, result: Dict[str, Any]):
+        """Записывает результат одного типа проверки в хранилище и сообщает подписчикам"""
+        check = self._active.get(check_id)
+        if check is not None:
+            check["results"][check_type] = result
+            self.store.save(check)
+            self.events.publish(check_id, {"event": "result", "type": check_type, "result": result})
+    
+    def _set_status(self, check_id: str, status: str):
+        check = self._active[check_id]
+        check["status"] = status
+        self.store.save(check)
+        self.events.publish(check_id, {"event": "status", "status": status})
+    
+    def _finish(self, check_id: str, status: str):
+        """Завершает проверку и сообщает подписчикам (completion_listeners)"""
+        self._set_status(check_id, status)
+        # Завершенная проверка живет только в хранилище
+        check = self._active.pop(check_id)
+        if check_id in self._batch_of:
+            self._on_batch_check_done(check)
+        for listener in self.completion_listeners:
             try:
-                if check_type == "ping":
-                    results["ping"] = await self.run_ping_check(target)
-                elif check_type == "http":
-                    results["http"] = await self.run_http_check(target, is_https=False)
-                elif check_type == "https":
-                    results["https"] = await self.run_http_check(target, is_https=True)
-                elif check_type == "tcp":
-                    results["tcp"] = await self.run_tcp_check(target)
-                elif check_type == "dns":
-                    results["dns"] = await self.run_dns_check(target)
-                elif check_type == "traceroute":
-                    results["traceroute"] = await self.run_traceroute_check(target)
+                listener(check)
             except Exception as e:
-                results[check_type] = {
-                    "success": False,
-                    "error": str(e)
-                }
+                logger.error(f"Ошибка обработчика завершения проверки: {e}")
+    
+    async def _execute_checks(self, check_id: str, target: str, checks: List[str]):
+        """Выполняет все проверки одного запроса параллельно"""
+        self._set_status(check_id, "in_progress")
+        
+        # Повторяющиеся и неизвестные типы пропускаем
+        check_types = [t for t in dict.fromkeys(checks) if t in CHECK_TIMEOUTS]
+        tasks = [
+            asyncio.create_task(self._run_single_check(check_id, check_type, target))
+            for check_type in check_types
+        ]
+        self._running[check_id] = tasks
         
-        self.checks_storage[check_id]["results"] = results
-        self.checks_storage[check_id]["status"] = "completed"
+        try:
+            outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            self._running.pop(check_id, None)
+        
+        cancelled = any(isinstance(o, asyncio.CancelledError) for o in outcomes)
+        self._finish(check_id, "cancelled" if cancelled else "completed")
     
-    def get_check_by_id(self, check_id: str) -> Dict[str, Any]:
+    def cancel_check(self, check_id: str) -> bool:
+        """Отменяет незавершенные проверки запроса, возвращает False если отменять нечего"""
+        if check_id in self._batch_pending:
+            # Проверка пакета еще не запущена
+            self._finish(check_id, "cancelled")
+            return True
+        
+        if check_id in self._remote:
+            for task in self.tasks.cancel(check_id):
+                self._publish_result(check_id, task["type"], {"success": False, "error": "Проверка отменена"})
+            del self._remote[check_id]
+            self._finish(check_id, "cancelled")
+            return True
+        
+        tasks = self._running.get(check_id)
+        if not tasks:
+            return False
+        for task in tasks:
+            task.cancel()
+        return True
+    
+    async def get_check_by_id(self, check_id: str) -> Dict[str, Any]:
         """Получает результат проверки по ID"""
-        return self.checks_storage.get(check_id)
+        check = self._active.get(check_id)
+        if check is not None:
+            return check
+        return await self.store.get(check_id)
+    
+    async def list_checks(self, status: str = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Получает последние проверки, опционально с фильтром по статусу"""
+        return await self.store.list(status, limit)
     
-    def get_all_checks(self) -> List[Dict[str, Any]]:
-        """Получает все проверки"""
-        return list(self.checks_storage.values())
\ No newline at end of file
+    async def shutdown(self):
+        """Освобождает ресурсы сервиса при остановке сервера"""
+        self.events.close()
+        for tasks in list(self._running.values()):
+            for task in tasks:
+                task.cancel()
+        await self.tasks.close()
+        await close_http_session()
+        close_pingers()
+        await self.store.close()
\ No newline at end of file
@@ -0,0 +1,127 @@
+"""
+Буфер heartbeat агентов.
+Heartbeat сразу виден при чтении (last_heartbeat, status), а в базу
+накопленные heartbeat пишутся одной транзакцией раз в HEARTBEAT_FLUSH_INTERVAL
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_FLUSH_INTERVAL = 0.5  # как часто сбрасывать heartbeat в базу, секунды
+HEARTBEAT_BATCH_SIZE = 5000  # максимум heartbeat в одной транзакции
+
+
+def db_timestamp() -> str:
+    """Время UTC в формате CURRENT_TIMESTAMP SQLite"""
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class HeartbeatBuffer:
+    """
+    Копит heartbeat в памяти и сбрасывает их пачками через db.async_update_heartbeats.
+    Для каждого агента хранится только последний heartbeat, поэтому размер буфера
+    ограничен числом агентов; при batch_size ожидающих сброс начинается сразу.
+    Если запись не удалась, пачка возвращается в буфер и будет записана
+    при следующем сбросе; при остановке буфер сбрасывается полностью
+    """
+
+    def __init__(self, db, flush_interval: float = HEARTBEAT_FLUSH_INTERVAL,
+                 batch_size: int = HEARTBEAT_BATCH_SIZE):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending = {}  # agent_id -> время последнего heartbeat, еще не записанного
+        self._recent = {}  # agent_id -> время последнего heartbeat (для чтения)
+        self.revision = 0  # растет, когда меняется видимое при чтении время heartbeat
+        self.listeners = []  # вызываются с agent_id на каждом heartbeat
+        self._flush_task = None
+        self._flush_needed = None
+        self._flush_lock = None
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_needed = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush_all()
+
+    def record(self, agent_id: int) -> str:
+        """Регистрирует heartbeat агента, возвращает его время"""
+        timestamp = db_timestamp()
+        self._pending[agent_id] = timestamp
+        if self._recent.get(agent_id) != timestamp:
+            self._recent[agent_id] = timestamp
+            self.revision += 1
+        for listener in self.listeners:
+            listener(agent_id)
+        if self._flush_needed is not None and len(self._pending) >= self.batch_size:
+            self._flush_needed.set()
+        return timestamp
+
+    def apply(self, agent: Dict[str, Any]) -> Dict[str, Any]:
+        """Дополняет запись агента из базы еще не записанным heartbeat"""
+        timestamp = self._recent.get(agent["id"])
+        if timestamp and (agent.get("last_heartbeat") or "") < timestamp:
+            agent["last_heartbeat"] = timestamp
+            agent["status"] = "active"
+        return agent
+
+    def forget(self, agent_id: int):
+        """Убирает агента из буфера (например, после пересоздания записи)"""
+        self._pending.pop(agent_id, None)
+        self._recent.pop(agent_id, None)
+
+    async def flush(self) -> bool:
+        """Записывает до batch_size heartbeat одной транзакцией, возвращает успех"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return True
+
+            batch = []
+            for agent_id in list(self._pending)[:self.batch_size]:
+                batch.append((agent_id, self._pending.pop(agent_id)))
+
+            try:
+                await self.db.async_update_heartbeats(batch)
+            except Exception as e:
+                logger.error(f"Ошибка записи heartbeat: {e}")
+                # Возвращаем пачку, не перетирая более свежие heartbeat
+                for agent_id, timestamp in batch:
+                    self._pending.setdefault(agent_id, timestamp)
+                return False
+
+            # Записанные в базу значения больше не нужно подмешивать при чтении
+            for agent_id, timestamp in batch:
+                if self._recent.get(agent_id) == timestamp and agent_id not in self._pending:
+                    del self._recent[agent_id]
+            return True
+
+    async def flush_all(self) -> bool:
+        """Записывает все накопленные heartbeat, возвращает успех"""
+        while self._pending:
+            if not await self.flush():
+                return False
+        return True
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_needed.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_needed.clear()
+            # Если накопилось больше одной пачки - пишем без паузы
+            while await self.flush() and len(self._pending) >= self.batch_size:
+                pass
@@ -0,0 +1,63 @@
+"""
+Ограничение частоты запросов по алгоритму GCRA (вариант token bucket).
+Для каждого ключа (класс лимита, клиент) хранится одно число - теоретическое
+время прихода следующего запроса (TAT). Окон нет, поэтому на их границе
+не бывает двойного всплеска. Таблица ключей - LRU ограниченного размера:
+при переполнении забывается ключ, к которому дольше всего не обращались
+"""
+
+import time
+from collections import OrderedDict
+from typing import Callable, Tuple
+
+MAX_RATE_KEYS = 100000  # максимум ключей в таблице лимитов
+
+
+class RateClass:
+    """Лимит: limit запросов за period секунд, всплеск до burst запросов подряд"""
+
+    __slots__ = ("name", "limit", "period", "burst", "interval", "tolerance")
+
+    def __init__(self, name: str, limit: int, period: float = 60, burst: int = None):
+        self.name = name
+        self.limit = limit
+        self.period = period
+        self.burst = burst or limit
+        self.interval = period / limit  # один запрос "стоит" столько секунд
+        self.tolerance = self.interval * (self.burst - 1)
+
+
+class RateLimiter:
+    """GCRA лимитер с LRU таблицей ключей и монотонным временем"""
+
+    def __init__(self, max_keys: int = MAX_RATE_KEYS, clock: Callable[[], float] = time.monotonic):
+        self.max_keys = max_keys
+        self._clock = clock
+        self._tat = OrderedDict()  # ключ -> теоретическое время прихода
+
+    def __len__(self):
+        return len(self._tat)
+
+    def hit(self, rate: RateClass, principal: str) -> Tuple[bool, float]:
+        """
+        Учитывает запрос клиента principal в классе rate.
+        Возвращает (разрешен, через сколько секунд повторить)
+        """
+        key = (rate.name, principal)
+        now = self._clock()
+        tat = self._tat.get(key, now)
+        if tat < now:
+            tat = now
+
+        if tat - now > rate.tolerance:
+            # Запрос отклонен, TAT не меняется
+            return False, tat - rate.tolerance - now
+
+        self._tat[key] = tat + rate.interval
+        self._tat.move_to_end(key)
+        if len(self._tat) > self.max_keys:
+            self._tat.popitem(last=False)
+        return True, 0.0
+
+    def clear(self):
+        self._tat.clear()
@@ -0,0 +1,335 @@
+"""
+Планировщик периодических проверок.
+Расписание - определение проверки (target, checks, executor, location)
+с интервалом или cron выражением. Ближайшие запуски всех расписаний лежат
+в одной куче, поэтому цикл планировщика просыпается только к ближайшему
+запуску, а не перебирает все расписания
+"""
+
+import asyncio
+import calendar
+import heapq
+import logging
+import math
+import random
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from app.services.check_store import TIME_FORMAT, utc_now
+
+logger = logging.getLogger(__name__)
+
+MIN_INTERVAL = 10  # минимальный интервал запуска, секунды
+MAX_SCHEDULES = 100000  # максимум расписаний на сервер
+MAX_SLEEP = 60  # цикл просыпается хотя бы раз в столько секунд
+DISPATCH_BATCH = 500  # после стольких запусков подряд отдаем управление event loop
+
+OVERLAP_POLICIES = ("skip", "coalesce")
+
+# Сокращения cron
+CRON_ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+}
+
+
+def _format_ts(ts: Optional[float]) -> Optional[str]:
+    return datetime.utcfromtimestamp(ts).strftime(TIME_FORMAT) if ts is not None else None
+
+
+class CronSchedule:
+    """
+    Cron выражение из 5 полей (минута, час, день месяца, месяц, день недели), время UTC.
+    Поддерживаются *, диапазоны a-b, списки через запятую и шаг /n.
+    День недели 0-7 (0 и 7 - воскресенье). Если ограничены и день месяца,
+    и день недели, подходит любой из них, как в cron
+    """
+
+    FIELDS = (
+        ("minute", 0, 59),
+        ("hour", 0, 23),
+        ("day of month", 1, 31),
+        ("month", 1, 12),
+        ("day of week", 0, 7),
+    )
+
+    def __init__(self, expression: str):
+        if not isinstance(expression, str):
+            raise ValueError("cron должен быть строкой")
+        self.expression = expression.strip()
+        fields = CRON_ALIASES.get(self.expression, self.expression).split()
+        if len(fields) != 5:
+            raise ValueError("cron должен состоять из 5 полей: минута час день месяц день_недели")
+
+        parsed = [self._parse_field(field, *spec) for field, spec in zip(fields, self.FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {0 if d == 7 else d for d in weekdays}
+        self._any_day = fields[2].startswith("*")
+        self._any_weekday = fields[4].startswith("*")
+
+    @staticmethod
+    def _parse_field(field: str, name: str, low: int, high: int) -> set:
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step_text = part.split("/", 1)
+                if not step_text.isdigit() or int(step_text) == 0:
+                    raise ValueError(f"Неверный шаг в поле cron '{name}': {field}")
+                step = int(step_text)
+
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start_text, end_text = part.split("-", 1)
+                if not (start_text.isdigit() and end_text.isdigit()):
+                    raise ValueError(f"Неверный диапазон в поле cron '{name}': {field}")
+                start, end = int(start_text), int(end_text)
+            elif part.isdigit():
+                start = int(part)
+                # "5/15" - с 5 до конца диапазона с шагом 15
+                end = high if step > 1 else start
+            else:
+                raise ValueError(f"Неверное значение поля cron '{name}': {field}")
+
+            if not low <= start <= end <= high:
+                raise ValueError(f"Поле cron '{name}' должно быть от {low} до {high}: {field}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, day: datetime) -> bool:
+        in_month = day.day in self.days
+        # weekday(): понедельник = 0, в cron воскресенье = 0
+        in_week = (day.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return in_month and in_week
+        return in_month or in_week
+
+    def next_after(self, ts: float) -> float:
+        """Ближайший момент срабатывания строго после ts (unix time)"""
+        moment = datetime.utcfromtimestamp(ts).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # 29 февраля в воскресенье встречается раз в 28 лет
+        limit = moment + timedelta(days=366 * 28)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return float(calendar.timegm(moment.timetuple()))
+        raise ValueError(f"cron выражение никогда не срабатывает: {self.expression}")
+
+
+class Scheduler:
+    """
+    Запускает периодические проверки через CheckService.
+    Запуски с интервалом разнесены по фазе: фаза расписания вычисляется из
+    его id, поэтому множество целей с одинаковым интервалом не стартует
+    в одну секунду, и сетка запусков сохраняется после перезапуска сервера.
+    jitter добавляет случайную задержку к каждому запуску.
+    Если предыдущий запуск еще выполняется, overlap="skip" пропускает запуск,
+    overlap="coalesce" выполняет один отложенный запуск сразу после завершения
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.store = service.store
+        self._schedules = {}  # schedule_id -> определение
+        self._state = {}  # schedule_id -> состояние запусков
+        self._crons = {}  # schedule_id -> CronSchedule
+        self._heap = []  # куча (время запуска, schedule_id), удаление ленивое
+        self._inflight = {}  # check_id -> schedule_id
+        self._wakeup = None
+        self._loop_task = None
+        service.completion_listeners.append(self._on_check_done)
+
+    def __len__(self):
+        return len(self._schedules)
+
+    async def start(self):
+        """Загружает сохраненные расписания и запускает цикл"""
+        if self._loop_task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        now = time.time()
+        for definition in await self.store.load_schedules():
+            try:
+                self._register(definition, now)
+            except ValueError as e:
+                logger.error(f"Пропущено расписание {definition.get('id')}: {e}")
+        if self._schedules:
+            logger.info(f"Загружено расписаний: {len(self._schedules)}")
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        if self._on_check_done in self.service.completion_listeners:
+            self.service.completion_listeners.remove(self._on_check_done)
+
+    async def add(self, definition: Dict[str, Any]) -> Dict[str, Any]:
+        """Добавляет расписание (определение уже проверено), возвращает его описание"""
+        if len(self._schedules) >= MAX_SCHEDULES:
+            raise ValueError(f"Слишком много расписаний (максимум {MAX_SCHEDULES})")
+        definition = {**definition, "id": str(uuid.uuid4()), "created_at": utc_now()}
+        self._register(definition, time.time())
+        await self.store.save_schedule(definition)
+        return self.get(definition["id"])
+
+    async def remove(self, schedule_id: str) -> bool:
+        """Удаляет расписание; уже запущенная проверка выполняется до конца"""
+        if schedule_id not in self._schedules:
+            return False
+        del self._schedules[schedule_id]
+        del self._state[schedule_id]
+        self._crons.pop(schedule_id, None)
+        await self.store.delete_schedule(schedule_id)
+        return True
+
+    def get(self, schedule_id: str) -> Optional[Dict[str, Any]]:
+        definition = self._schedules.get(schedule_id)
+        if definition is None:
+            return None
+        state = self._state[schedule_id]
+        return {
+            **definition,
+            "next_run": _format_ts(state["next_run"]),
+            "last_run": _format_ts(state["last_run"]),
+            "last_check_id": state["last_check_id"],
+            "last_status": state["last_status"],
+            "running": state["check_id"] is not None,
+            "runs": state["runs"],
+            "skipped": state["skipped"],
+            "coalesced": state["coalesced"],
+        }
+
+    def list(self, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        ids = list(self._schedules)[offset:offset + limit]
+        return [self.get(schedule_id) for schedule_id in ids]
+
+    def _register(self, definition: Dict[str, Any], now: float):
+        schedule_id = definition["id"]
+        if definition.get("cron"):
+            self._crons[schedule_id] = CronSchedule(definition["cron"])
+        self._schedules[schedule_id] = definition
+        self._state[schedule_id] = {
+            "due": None,
+            "next_run": None,
+            "last_run": None,
+            "last_check_id": None,
+            "last_status": None,
+            "check_id": None,
+            "pending": False,
+            "runs": 0,
+            "skipped": 0,
+            "coalesced": 0,
+        }
+        try:
+            self._schedule_next(schedule_id, now)
+        except ValueError:
+            # Cron, который никогда не срабатывает, - расписание не добавляется
+            del self._schedules[schedule_id]
+            del self._state[schedule_id]
+            self._crons.pop(schedule_id, None)
+            raise
+
+    def _next_due(self, schedule_id: str, after: float) -> float:
+        """Ближайший плановый запуск после after (без jitter)"""
+        cron = self._crons.get(schedule_id)
+        if cron is not None:
+            return cron.next_after(after)
+        interval = self._schedules[schedule_id]["interval"]
+        # Фаза расписания постоянна: запуски идут по сетке phase + k * interval
+        phase = zlib.crc32(schedule_id.encode()) % int(interval * 1000) / 1000
+        return math.floor((after - phase) / interval) * interval + phase + interval
+
+    def _schedule_next(self, schedule_id: str, now: float):
+        state = self._state[schedule_id]
+        # Следующий запуск считаем от планового времени, а не от фактического
+        # (с jitter), чтобы не терять запуски; отставание больше периода не догоняем
+        due = self._next_due(schedule_id, state["due"] if state["due"] is not None else now)
+        if due <= now:
+            due = self._next_due(schedule_id, now)
+        state["due"] = due
+
+        jitter = self._schedules[schedule_id].get("jitter") or 0
+        fire_at = due + random.uniform(0, jitter) if jitter else due
+        state["next_run"] = fire_at
+        heapq.heappush(self._heap, (fire_at, schedule_id))
+        # Новый запуск раньше текущего ожидания цикла - будим его
+        if self._wakeup is not None and self._heap[0][1] == schedule_id:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            fired = 0
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                fire_at, schedule_id = heapq.heappop(self._heap)
+                state = self._state.get(schedule_id)
+                if state is None or state["next_run"] != fire_at:
+                    continue  # расписание удалено или перенесено
+                self._schedule_next(schedule_id, now)
+                await self._fire(schedule_id)
+                fired += 1
+                if fired % DISPATCH_BATCH == 0:
+                    await asyncio.sleep(0)
+                    now = time.time()
+
+            timeout = self._heap[0][0] - time.time() if self._heap else MAX_SLEEP
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), min(max(timeout, 0), MAX_SLEEP))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, schedule_id: str):
+        """Запускает проверку расписания с учетом политики overlap"""
+        definition = self._schedules.get(schedule_id)
+        if definition is None:
+            return
+        state = self._state[schedule_id]
+        if state["check_id"] is not None:
+            if definition.get("overlap") == "coalesce":
+                # Сколько бы запусков ни пропало, после завершения выполняется один
+                state["pending"] = True
+                state["coalesced"] += 1
+            else:
+                state["skipped"] += 1
+            return
+
+        try:
+            check_id = await self.service.create_check(
+                definition["target"], definition["checks"],
+                definition.get("executor", "local"), definition.get("location")
+            )
+        except Exception as e:
+            logger.error(f"Ошибка запуска расписания {schedule_id}: {e}")
+            return
+        state["check_id"] = check_id
+        state["last_check_id"] = check_id
+        state["last_run"] = time.time()
+        state["runs"] += 1
+        self._inflight[check_id] = schedule_id
+
+    def _on_check_done(self, check: Dict[str, Any]):
+        schedule_id = self._inflight.pop(check["id"], None)
+        state = self._state.get(schedule_id)
+        if state is None:
+            return
+        state["check_id"] = None
+        state["last_status"] = check["status"]
+        if state["pending"]:
+            state["pending"] = False
+            asyncio.ensure_future(self._fire(schedule_id))
@@ -0,0 +1,284 @@
+"""
+Очередь задач для агентов.
+Задача - одна проба (тип проверки) одного запроса. Агент забирает задачи
+в аренду (lease): пока аренда не истекла, задача не видна другим агентам.
+Если результат не пришел вовремя, задача возвращается в очередь, после
+TASK_MAX_ATTEMPTS попыток уходит в dead-letter. Туда же уходит задача,
+которую ни один агент не взял за QUEUE_TIMEOUT (нет агента нужной локации
+или с нужным типом проверки)
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+LEASE_GRACE = 15  # запас аренды сверх таймаута проверки, секунды
+TASK_MAX_ATTEMPTS = 3  # сколько раз выдавать задачу, прежде чем признать ее мертвой
+QUEUE_TIMEOUT = 120  # сколько задача может ждать агента в очереди, секунды
+DEAD_LETTER_SIZE = 1000  # сколько мертвых задач хранить для диагностики
+REAPER_INTERVAL = 1.0  # как часто проверять истекшие аренды, секунды
+WAITERS_COMPACT_THRESHOLD = 10000  # после скольких ожиданий чистить завершенные future
+
+
+def _route(location: Optional[str]) -> Optional[str]:
+    return location.strip().lower() if location else None
+
+
+class TaskQueue:
+    """
+    Очереди готовых задач разложены по (тип, локация), поэтому выдача задачи
+    агенту - pop из deque без перебора всех проверок. Аренды лежат в куче
+    по времени истечения, сроки ожидания в очереди - в своей куче.
+    on_lease(task) и on_done(task, result) - обратные вызовы сервиса проверок
+    """
+
+    def __init__(self, lease_timeouts: Dict[str, float], default_lease: float,
+                 on_lease: Callable, on_done: Callable, max_attempts: int = TASK_MAX_ATTEMPTS,
+                 queue_timeout: float = QUEUE_TIMEOUT):
+        self.lease_timeouts = lease_timeouts
+        self.default_lease = default_lease
+        self.max_attempts = max_attempts
+        self.queue_timeout = queue_timeout
+        self._on_lease = on_lease
+        self._on_done = on_done
+        self._tasks = {}  # task_id -> задача (ожидающая или в аренде)
+        self._by_check = {}  # check_id -> task_id задач запроса
+        self._ready = {}  # (тип, локация) -> deque task_id
+        self._leases = []  # куча (истекает, task_id, lease_id)
+        self._queued = []  # куча (срок ожидания, task_id, время постановки в очередь)
+        self.dead_letter = deque(maxlen=DEAD_LETTER_SIZE)
+        self._waiters = {}  # (тип, локация) -> deque future агентов, ждущих задач
+        self._stale_waiters = 0
+        self.cancel_listeners = []  # вызываются со списком отмененных задач
+        self._reaper = None
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def start(self):
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+            self._reaper = None
+
+    def put(self, check_id: str, check_type: str, target: str, location: Optional[str] = None):
+        """Ставит пробу в очередь"""
+        task_id = f"{check_id}_{check_type}"
+        task = {
+            "id": task_id,
+            "check_id": check_id,
+            "type": check_type,
+            "target": target,
+            "location": _route(location),
+            "attempts": 0,
+            "lease_id": None,
+            "agent_id": None,
+            "queued_at": None,
+        }
+        self._tasks[task_id] = task
+        self._by_check.setdefault(check_id, set()).add(task_id)
+        self._enqueue(task)
+
+    def _remove(self, task: Dict[str, Any]):
+        del self._tasks[task["id"]]
+        task_ids = self._by_check.get(task["check_id"])
+        if task_ids is not None:
+            task_ids.discard(task["id"])
+            if not task_ids:
+                del self._by_check[task["check_id"]]
+
+    def _enqueue(self, task: Dict[str, Any], retry: bool = False):
+        # Срок ожидания агента отсчитывается заново при каждой постановке в очередь
+        now = time.monotonic()
+        task["queued_at"] = now
+        heapq.heappush(self._queued, (now + self.queue_timeout, task["id"], now))
+        queue = self._ready.setdefault((task["type"], task["location"]), deque())
+        # Повторные попытки идут первыми, чтобы не голодать за новыми задачами
+        if retry:
+            queue.appendleft(task["id"])
+        else:
+            queue.append(task["id"])
+        self._wake((task["type"], task["location"]))
+
+    def _wake(self, route):
+        """Будит одного ждущего агента, который может взять задачу этого маршрута"""
+        waiters = self._waiters.get(route)
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                break
+        if waiters is not None and not waiters:
+            del self._waiters[route]
+
+    async def wait(self, location: Optional[str], capabilities: Iterable[str]):
+        """Ждет появления задачи, которую агент может взять (push доставка)"""
+        location = _route(location)
+        future = asyncio.get_event_loop().create_future()
+        for check_type in capabilities:
+            self._waiters.setdefault((check_type, None), deque()).append(future)
+            if location:
+                self._waiters.setdefault((check_type, location), deque()).append(future)
+        try:
+            await future
+        finally:
+            future.cancel()
+            # Завершенный future остается в deque других маршрутов, периодически их чистим
+            self._stale_waiters += 1
+            if self._stale_waiters > WAITERS_COMPACT_THRESHOLD:
+                self._compact_waiters()
+
+    def _compact_waiters(self):
+        for route in list(self._waiters):
+            live = deque(f for f in self._waiters[route] if not f.done())
+            if live:
+                self._waiters[route] = live
+            else:
+                del self._waiters[route]
+        self._stale_waiters = 0
+
+    def claim(self, agent_id: int, location: Optional[str], capabilities: Iterable[str],
+              limit: int = 1, type_limits: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+        """
+        Выдает агенту до limit задач, которые он умеет выполнять: сначала
+        привязанные к его локации, затем без привязки.
+        type_limits - сколько задач каждого типа агент может начать сразу
+        (тип без записи ограничен только limit)
+        """
+        location = _route(location)
+        claimed = []
+        now = time.monotonic()
+        for check_type in capabilities:
+            type_limit = len(claimed) + (type_limits or {}).get(check_type, limit)
+            for route in ((check_type, location), (check_type, None)) if location else ((check_type, None),):
+                queue = self._ready.get(route)
+                while queue and len(claimed) < min(limit, type_limit):
+                    task = self._tasks.get(queue.popleft())
+                    # Отмененные задачи удаляются из deque лениво
+                    if task is None or task["lease_id"] is not None:
+                        continue
+                    claimed.append(self._lease(task, agent_id, now))
+                if queue is not None and not queue:
+                    del self._ready[route]
+            if len(claimed) >= limit:
+                break
+        return claimed
+
+    def _lease(self, task: Dict[str, Any], agent_id: int, now: float) -> Dict[str, Any]:
+        timeout = self.lease_timeouts.get(task["type"], self.default_lease) + LEASE_GRACE
+        task["attempts"] += 1
+        task["lease_id"] = uuid.uuid4().hex
+        task["agent_id"] = agent_id
+        heapq.heappush(self._leases, (now + timeout, task["id"], task["lease_id"]))
+        self._on_lease(task)
+        return {
+            "id": task["id"],
+            "check_id": task["check_id"],
+            "type": task["type"],
+            "target": task["target"],
+            "lease_id": task["lease_id"],
+            "lease_timeout": timeout,
+            "attempt": task["attempts"],
+        }
+
+    def complete(self, task_id: str, lease_id: str, agent_id: int, result: Dict[str, Any]) -> bool:
+        """
+        Принимает результат задачи. Результат по чужой или истекшей аренде
+        отбрасывается, поэтому каждая проба записывается ровно один раз
+        """
+        task = self._tasks.get(task_id)
+        if task is None or task["lease_id"] is None or task["lease_id"] != lease_id \
+                or task["agent_id"] != agent_id:
+            return False
+        self._remove(task)
+        self._on_done(task, result)
+        return True
+
+    def release(self, task_id: str, lease_id: str) -> bool:
+        """Возвращает задачу в очередь до истечения аренды (агент ее не получил)"""
+        task = self._tasks.get(task_id)
+        if task is None or task["lease_id"] is None or task["lease_id"] != lease_id:
+            return False
+        task["attempts"] -= 1
+        task["lease_id"] = None
+        task["agent_id"] = None
+        self._enqueue(task, retry=True)
+        return True
+
+    def release_agent(self, agent_id: int, keep: Iterable[str] = ()) -> int:
+        """Возвращает в очередь задачи агента, кроме keep (он их еще выполняет)"""
+        keep = set(keep)
+        leased = [
+            task for task in self._tasks.values()
+            if task["agent_id"] == agent_id and task["id"] not in keep
+        ]
+        for task in leased:
+            self.release(task["id"], task["lease_id"])
+        return len(leased)
+
+    def cancel(self, check_id: str) -> List[Dict[str, Any]]:
+        """Убирает из очереди все задачи запроса, возвращает их"""
+        cancelled = [self._tasks[task_id] for task_id in self._by_check.get(check_id, ())]
+        for task in cancelled:
+            self._remove(task)
+        for listener in self.cancel_listeners:
+            listener(cancelled)
+        return cancelled
+
+    def expire(self, now: Optional[float] = None):
+        """
+        Возвращает в очередь задачи с истекшей арендой, отправляет в dead-letter
+        задачи, которые слишком долго ждут агента
+        """
+        now = time.monotonic() if now is None else now
+        while self._queued and self._queued[0][0] <= now:
+            _, task_id, queued_at = heapq.heappop(self._queued)
+            task = self._tasks.get(task_id)
+            if task is None or task["lease_id"] is not None or task["queued_at"] != queued_at:
+                continue  # выполнена, отменена, в аренде или поставлена в очередь заново
+
+            logger.warning(f"Задача {task_id} не взята агентами за {self.queue_timeout} с")
+            self._remove(task)
+            self.dead_letter.append(task)
+            self._on_done(task, {
+                "success": False,
+                "error": f"Нет агента для задачи: не взята за {self.queue_timeout} с"
+            })
+
+        while self._leases and self._leases[0][0] <= now:
+            _, task_id, lease_id = heapq.heappop(self._leases)
+            task = self._tasks.get(task_id)
+            if task is None or task["lease_id"] != lease_id:
+                continue  # уже выполнена или отменена
+
+            logger.warning(f"Аренда задачи {task_id} агентом {task['agent_id']} истекла "
+                           f"(попытка {task['attempts']})")
+            task["lease_id"] = None
+            task["agent_id"] = None
+            if task["attempts"] >= self.max_attempts:
+                self._remove(task)
+                self.dead_letter.append(task)
+                self._on_done(task, {
+                    "success": False,
+                    "error": f"Задача не выполнена агентами за {task['attempts']} попыток"
+                })
+            else:
+                self._enqueue(task, retry=True)
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(REAPER_INTERVAL)
+            try:
+                self.expire()
+            except Exception as e:
+                logger.error(f"Ошибка обработки истекших аренд: {e}")
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# Пакет app и agent_database лежат в корне restApi, модули проверок - в app/checks
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app', 'checks'))
+
+
+@pytest.fixture
+def app_env(tmp_path, monkeypatch):
+    """Базы агентов и проверок во временном каталоге, пустая таблица лимитов"""
+    from app import server
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("CHECKS_DB", str(tmp_path / "checks.db"))
+    server.rate_limiter.clear()
+    yield tmp_path
+    server.rate_limiter.clear()
+
+
+@pytest.fixture
+async def client(aiohttp_client, app_env):
+    from app.server import create_app
+
+    return await aiohttp_client(create_app())
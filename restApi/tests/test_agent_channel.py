@@ -0,0 +1,71 @@
+import asyncio
+import json
+
+import pytest
+
+
+@pytest.fixture
+async def ws(client):
+    response = await client.post("/api/agents", json={"name": "a", "location": "Here", "ip": "127.0.0.1", "token": "tok"})
+    assert response.status == 201
+    ws = await client.ws_connect("/api/agent/ws", params={"token": "tok"})
+    yield ws
+    await ws.close()
+
+
+async def create_check(client, check_type="tcp"):
+    response = await client.post("/api/check", json={"target": "127.0.0.1:9", "checks": [check_type], "executor": "agent"})
+    return (await response.json())["checkId"]
+
+
+async def test_task_is_pushed_and_result_acked(client, ws):
+    await ws.send_json({"type": "hello", "types": ["tcp"], "credits": 1})
+    check_id = await create_check(client)
+
+    message = await ws.receive_json(timeout=5)
+    assert message["type"] == "task"
+    task = message["task"]
+    assert task["check_id"] == check_id
+
+    await ws.send_json({"type": "result", "task_id": task["id"], "lease_id": task["lease_id"],
+                        "results": {"success": True}})
+    assert await ws.receive_json(timeout=5) == {"type": "ack", "task_id": task["id"], "status": "received"}
+    response = await client.get(f"/api/check/{check_id}")
+    assert (await response.json())["status"] == "completed"
+
+
+async def test_credits_limit_pushed_tasks(client, ws):
+    await ws.send_json({"type": "hello", "types": ["tcp", "ping"], "credits": 5, "type_credits": {"tcp": 1}})
+    for _ in range(2):
+        await create_check(client)
+
+    assert (await ws.receive_json(timeout=5))["task"]["type"] == "tcp"
+    with pytest.raises(asyncio.TimeoutError):
+        await ws.receive_json(timeout=0.3)
+
+    await ws.send_json({"type": "credit", "credits": 1, "type_credits": {"tcp": 1}})
+    assert (await ws.receive_json(timeout=5))["task"]["type"] == "tcp"
+
+
+@pytest.mark.parametrize("frame", [
+    "{bad",
+    "[]",
+    "1",
+    '"x"',
+    json.dumps({"type": "hello", "inflight": [{}]}),
+    json.dumps({"type": "hello", "types": "tcp"}),
+    json.dumps({"type": "result", "task_id": {}, "results": {}}),
+    json.dumps({"type": "release", "tasks": 5}),
+])
+async def test_malformed_message_keeps_channel_open(client, ws, frame):
+    await ws.send_str(frame)
+    assert (await ws.receive_json(timeout=5))["type"] == "error"
+
+    await ws.send_json({"type": "hello", "types": ["tcp"], "credits": 1})
+    await create_check(client)
+    assert (await ws.receive_json(timeout=5))["type"] == "task"
+
+
+async def test_unknown_token_is_refused(client):
+    response = await client.get("/api/agent/ws", params={"token": "nope"})
+    assert response.status == 400
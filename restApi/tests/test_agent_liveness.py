@@ -0,0 +1,83 @@
+import asyncio
+
+from app.services.agent_liveness import ACTIVE, OFFLINE, STALE, AgentLiveness
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_liveness():
+    clock = Clock()
+    liveness = AgentLiveness(db=None, stale_after=60, offline_after=120, clock=clock)
+    events = []
+    liveness.listeners.append(events.append)
+    return liveness, clock, events
+
+
+def test_deadlines_move_agent_to_stale_then_offline():
+    liveness, clock, events = make_liveness()
+    liveness.add(1)
+    liveness.seen(1)
+    assert liveness.status(1) == ACTIVE
+    assert liveness.count(ACTIVE) == 1
+
+    clock.now += 60
+    assert liveness.expire() == 1
+    assert liveness.status(1) == STALE
+    clock.now += 60
+    assert liveness.expire() == 1
+    assert liveness.status(1) == OFFLINE
+    assert liveness.summary() == {"total": 1, "healthy": 0, "statuses": {OFFLINE: 1}}
+    assert [(e["from"], e["to"]) for e in events] == [
+        ("awaiting_heartbeat", ACTIVE), (ACTIVE, STALE), (STALE, OFFLINE)]
+
+
+def test_heartbeat_postpones_deadline():
+    liveness, clock, _ = make_liveness()
+    liveness.add(1)
+    liveness.seen(1)
+    clock.now += 50
+    liveness.seen(1)
+    clock.now += 20
+    assert liveness.expire() == 0
+    assert liveness.status(1) == ACTIVE
+    clock.now += 40
+    assert liveness.expire() == 1
+    assert liveness.status(1) == STALE
+
+
+def test_readded_agent_keeps_one_heap_entry():
+    liveness, clock, _ = make_liveness()
+    liveness.add(1)
+    liveness.seen(1)
+    liveness.add(1)
+    liveness.seen(1)
+    clock.now += 60
+    assert liveness.expire() == 1
+    assert len(liveness._heap) == 1
+
+
+async def test_transitions_are_streamed(client):
+    from app.handlers.agent_handler import get_liveness
+
+    response = await client.post("/api/agents", json={"name": "a", "location": "Here", "ip": "127.0.0.1", "token": "tok"})
+    agent_id = (await response.json())["agent_id"]
+    liveness = get_liveness()
+    liveness.stale_after, liveness.offline_after = 0.2, 0.4
+
+    stream = await client.get("/api/agents/events")
+    assert stream.headers["Content-Type"] == "text/event-stream"
+    await client.post("/api/agents/heartbeat", json={"agent_id": agent_id, "token": "tok"})
+
+    body = b""
+    while body.count(b"event: transition") < 3:
+        body += await asyncio.wait_for(stream.content.readany(), 5)
+    text = body.decode()
+    assert text.startswith("event: snapshot")
+    assert text.index('"to":"active"') < text.index('"to":"stale"') < text.index('"to":"offline"')
+    stream.close()
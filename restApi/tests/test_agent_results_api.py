@@ -0,0 +1,88 @@
+import gzip
+import json
+
+import pytest
+
+
+def ndjson(items):
+    return "".join(json.dumps(item) + "\n" for item in items).encode()
+
+
+@pytest.fixture
+async def leased(client):
+    """Зарегистрированный агент и задача tcp у него в аренде"""
+    response = await client.post("/api/agents", json={"name": "a", "location": "Here", "ip": "127.0.0.1", "token": "tok"})
+    assert response.status == 201
+    response = await client.post("/api/check", json={"target": "127.0.0.1:9", "checks": ["tcp"], "executor": "agent"})
+    check_id = (await response.json())["checkId"]
+    response = await client.get("/api/agent/tasks", params={"token": "tok", "limit": "10"})
+    tasks = (await response.json())["tasks"]
+    assert len(tasks) == 1
+    return check_id, tasks[0]
+
+
+async def post_batch(client, body, **headers):
+    return await client.post("/api/agent/results/batch", params={"token": "tok"}, data=body,
+                             headers={"Content-Type": "application/x-ndjson", **headers})
+
+
+async def test_batch_is_applied_and_persisted(client, leased):
+    check_id, task = leased
+    body = ndjson([
+        {"task_id": task["id"], "lease_id": task["lease_id"], "results": {"success": True, "sent": 1}},
+        {"task_id": "unknown_tcp", "lease_id": "x", "results": {"success": True}},
+    ])
+
+    response = await post_batch(client, gzip.compress(body), **{"Content-Encoding": "gzip"})
+    assert response.status == 200
+    data = await response.json()
+    assert (data["received"], data["rejected"]) == (1, 1)
+
+    from app.handlers.check_handler import get_check_service
+    stored = await get_check_service().store._get(check_id)
+    assert stored["status"] == "completed"
+    assert stored["results"]["tcp"]["success"] is True
+
+    # Повторная отправка по той же аренде отклоняется
+    response = await post_batch(client, body)
+    assert (await response.json())["received"] == 0
+
+
+async def test_invalid_batch_is_not_applied(client, leased):
+    check_id, task = leased
+
+    response = await post_batch(client, b'{"task_id": 1}\n{bad\n')
+    assert response.status == 400
+
+    body = ndjson([{"task_id": task["id"], "lease_id": task["lease_id"], "results": {"success": True}}]) + b"[]\n"
+    response = await post_batch(client, body)
+    assert response.status == 400
+    response = await client.get(f"/api/check/{check_id}")
+    assert (await response.json())["status"] != "completed"
+
+
+async def test_unknown_token_is_rejected(client, leased):
+    response = await client.post("/api/agent/results/batch", params={"token": "nope"}, data=b"",
+                                 headers={"Content-Type": "application/x-ndjson"})
+    assert response.status == 400
+
+
+async def test_failed_write_returns_5xx(client, leased):
+    _, task = leased
+    from app.handlers.check_handler import get_check_service
+    store = get_check_service().store
+
+    async def failing_write(rows):
+        raise RuntimeError("disk I/O error")
+
+    store._write = failing_write
+    body = ndjson([{"task_id": task["id"], "lease_id": task["lease_id"], "results": {"success": True}}])
+    response = await post_batch(client, body)
+    assert response.status == 500
+    # Записи остаются в очереди хранилища и будут записаны при следующем сбросе
+    assert store._dirty
+
+
+async def test_oversized_batch_returns_413(client, leased):
+    response = await post_batch(client, b"x" * (2 * 1024 * 1024))
+    assert response.status == 413
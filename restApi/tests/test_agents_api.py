@@ -0,0 +1,63 @@
+async def create_agents(client, count, location="Here"):
+    for i in range(count):
+        response = await client.post("/api/agents", json={"name": f"a{i}", "location": location,
+                                                          "ip": "127.0.0.1", "token": f"{location}-{i}"})
+        assert response.status == 201
+
+
+async def test_pagination_and_filters(client):
+    await create_agents(client, 3)
+    await create_agents(client, 2, location="There")
+
+    response = await client.get("/api/agents", params={"limit": "2"})
+    page = await response.json()
+    assert len(page["agents"]) == 2
+    assert page["total"] == 5
+
+    response = await client.get("/api/agents", params={"limit": "2", "after": str(page["next_after"])})
+    second = await response.json()
+    assert {a["id"] for a in page["agents"]}.isdisjoint(a["id"] for a in second["agents"])
+
+    response = await client.get("/api/agents", params={"location": "There"})
+    assert (await response.json())["total"] == 2
+
+    response = await client.get("/api/agents", params={"status": "awaiting_heartbeat", "limit": "1"})
+    filtered = await response.json()
+    assert filtered["total"] == 5 and len(filtered["agents"]) == 1
+
+    response = await client.get("/api/agents", params={"limit": "x"})
+    assert response.status == 400
+
+
+async def test_etag_revalidation(client):
+    await create_agents(client, 2)
+
+    response = await client.get("/api/agents")
+    assert response.status == 200
+    etag = response.headers["ETag"]
+
+    response = await client.get("/api/agents", headers={"If-None-Match": etag})
+    assert response.status == 304
+    assert await response.read() == b""
+
+    # Другие параметры запроса - другой ETag
+    response = await client.get("/api/agents", params={"limit": "1"}, headers={"If-None-Match": etag})
+    assert response.status == 200
+
+    # Heartbeat меняет список: статус и last_heartbeat
+    agent_id = (await (await client.get("/api/agents")).json())["agents"][0]["id"]
+    response = await client.post("/api/agents/heartbeat", json={"agent_id": agent_id, "token": "Here-0"})
+    assert response.status == 200
+    response = await client.get("/api/agents", headers={"If-None-Match": etag})
+    assert response.status == 200
+    assert response.headers["ETag"] != etag
+    statuses = {a["id"]: a["status"] for a in (await response.json())["agents"]}
+    assert statuses[agent_id] == "active"
+
+
+async def test_summary_counts_statuses(client):
+    await create_agents(client, 2)
+    response = await client.get("/api/agents/summary")
+    summary = await response.json()
+    assert summary["total"] == 2
+    assert summary["statuses"] == {"awaiting_heartbeat": 2}
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from app.services.check_store import SQLiteCheckStore, utc_now
+
+
+def make_check(check_id, status="queued", results=None):
+    return {
+        "id": check_id,
+        "target": "127.0.0.1",
+        "checks": ["tcp"],
+        "status": status,
+        "results": results or {},
+        "created_at": utc_now(),
+    }
+
+
+@pytest.fixture
+async def store(tmp_path):
+    store = SQLiteCheckStore(str(tmp_path / "checks.db"))
+    await store.start()
+    yield store
+    await store.close()
+
+
+async def test_results_survive_restart(tmp_path):
+    path = str(tmp_path / "checks.db")
+    store = SQLiteCheckStore(path)
+    await store.start()
+    store.save(make_check("a"))
+    store.save(make_check("a", "completed", {"tcp": {"success": True}}))
+    await store.save_schedule({"id": "s1", "target": "127.0.0.1", "interval": 60})
+    await store.close()
+
+    reopened = SQLiteCheckStore(path)
+    await reopened.start()
+    try:
+        check = await reopened.get("a")
+        assert check["status"] == "completed"
+        assert check["results"] == {"tcp": {"success": True}}
+        assert await reopened.load_schedules() == [{"id": "s1", "target": "127.0.0.1", "interval": 60}]
+    finally:
+        await reopened.close()
+
+
+async def test_unflushed_check_is_readable(store):
+    store.save(make_check("a"))
+    assert (await store.get("a"))["status"] == "queued"
+    assert await store.get("missing") is None
+
+
+async def test_list_filters_by_status(store):
+    store.save(make_check("a", "completed"))
+    store.save(make_check("b"))
+
+    assert [check["id"] for check in await store.list(status="completed")] == ["a"]
+    assert {check["id"] for check in await store.list()} == {"a", "b"}
+
+
+async def test_failed_flush_keeps_rows_for_retry(store):
+    write = store._write
+
+    async def failing_write(rows):
+        raise RuntimeError("disk I/O error")
+
+    store.save(make_check("a"))
+    store._write = failing_write
+    assert await store.flush() is False
+    with pytest.raises(RuntimeError):
+        await store.flush(raise_errors=True)
+
+    # Более новая версия, сохраненная после ошибки, не перетирается старой
+    store.save(make_check("a", "completed"))
+    store._write = write
+    assert await store.flush() is True
+    assert (await store._get("a"))["status"] == "completed"
+
+
+async def test_concurrent_flushes_do_not_drop_rows(store):
+    write = store._write
+
+    async def slow_write(rows):
+        await asyncio.sleep(0.05)
+        await write(rows)
+
+    store._write = slow_write
+    store.save(make_check("a"))
+    first = asyncio.ensure_future(store.flush())
+    await asyncio.sleep(0.01)
+    store.save(make_check("b"))
+    # Пока первая запись идет, обе проверки видны
+    assert await store.get("a") is not None
+    await asyncio.gather(first, store.flush())
+
+    assert await store._get("a") is not None
+    assert await store._get("b") is not None
@@ -0,0 +1,47 @@
+import socket
+
+import pytest
+from aiohttp import web
+
+from HTTP import async_http_ping_check, close_http_session
+
+
+@pytest.fixture
+async def site(aiohttp_server):
+    async def ok(request):
+        return web.Response(body=b"x" * 1000)
+
+    async def missing(request):
+        return web.Response(status=404)
+
+    app = web.Application()
+    app.router.add_get("/", ok)
+    app.router.add_get("/missing", missing)
+    server = await aiohttp_server(app)
+    yield f"127.0.0.1:{server.port}"
+    await close_http_session()
+
+
+async def test_http_check_counts_statuses_and_size(site):
+    result = await async_http_ping_check(site, count=3, interval=0)
+    assert result.success
+    assert (result.sent, result.received) == (3, 3)
+    assert result.codes == {"200": 3}
+    assert all(sample["size"] == 1000 for sample in result.samples)
+
+
+async def test_http_error_status_is_a_reply(site):
+    result = await async_http_ping_check(f"http://{site}/missing", count=1, interval=0)
+    assert result.codes == {"404": 1}
+
+
+async def test_http_connection_refused_is_failure():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    try:
+        result = await async_http_ping_check(f"127.0.0.1:{port}", count=2, interval=0)
+    finally:
+        await close_http_session()
+    assert result.received == 0
+    assert not result.success
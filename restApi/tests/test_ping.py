@@ -0,0 +1,36 @@
+import pytest
+
+from PING import async_ping_check, close_pingers
+
+
+@pytest.fixture
+async def pingers():
+    yield
+    close_pingers()
+
+
+async def test_ping_localhost(pingers):
+    result = await async_ping_check("127.0.0.1", count=3, interval=0.05, timeout=1)
+    if result.error and result.error.startswith("ICMP сокет недоступен"):
+        pytest.skip(result.error)
+
+    assert result.success
+    assert result.address == "127.0.0.1"
+    assert (result.sent, result.received, result.loss) == (3, 3, 0.0)
+    assert sorted(sample["seq"] for sample in result.samples) == [1, 2, 3]
+    assert result.rtt["min"] <= result.rtt["avg"] <= result.rtt["max"]
+
+
+async def test_ping_url_target(pingers):
+    result = await async_ping_check("http://127.0.0.1/path", count=1, timeout=1)
+    if result.error and result.error.startswith("ICMP сокет недоступен"):
+        pytest.skip(result.error)
+
+    assert result.host == "127.0.0.1"
+    assert result.success
+
+
+async def test_ping_unknown_host(pingers):
+    result = await async_ping_check("no-such-host.invalid", count=1)
+    assert not result.success
+    assert "cannot resolve" in result.error
@@ -0,0 +1,100 @@
+from app.services.rate_limiter import RateClass, RateLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_burst_then_steady_rate():
+    clock = Clock()
+    limiter = RateLimiter(clock=clock)
+    rate = RateClass("test", 60, 60, burst=5)
+
+    assert all(limiter.hit(rate, "client")[0] for _ in range(5))
+    allowed, retry_after = limiter.hit(rate, "client")
+    assert not allowed
+    assert retry_after == 1.0
+
+    # Лимит 60 в минуту - один запрос в секунду
+    clock.now += 1
+    assert limiter.hit(rate, "client")[0]
+    assert not limiter.hit(rate, "client")[0]
+
+
+def test_rejected_requests_do_not_extend_the_wait():
+    clock = Clock()
+    limiter = RateLimiter(clock=clock)
+    rate = RateClass("test", 1, 10)
+
+    assert limiter.hit(rate, "client")[0]
+    for _ in range(100):
+        assert not limiter.hit(rate, "client")[0]
+    clock.now += 10
+    assert limiter.hit(rate, "client")[0]
+
+
+def test_no_double_burst_at_window_edge():
+    clock = Clock()
+    limiter = RateLimiter(clock=clock)
+    rate = RateClass("test", 10, 60)
+
+    allowed = sum(limiter.hit(rate, "client")[0] for _ in range(20))
+    clock.now += 1
+    allowed += sum(limiter.hit(rate, "client")[0] for _ in range(20))
+    assert allowed == 10
+
+
+def test_keys_are_per_class_and_client():
+    limiter = RateLimiter(clock=Clock())
+    read, write = RateClass("read", 1, 60), RateClass("write", 1, 60)
+
+    assert limiter.hit(read, "a")[0]
+    assert limiter.hit(read, "b")[0]
+    assert limiter.hit(write, "a")[0]
+    assert not limiter.hit(read, "a")[0]
+
+
+def test_key_table_is_bounded_lru():
+    limiter = RateLimiter(max_keys=3, clock=Clock())
+    rate = RateClass("test", 1, 60)
+
+    for client in ("a", "b", "c"):
+        limiter.hit(rate, client)
+    limiter.hit(rate, "a")  # отклоненный запрос не освежает ключ
+    limiter.hit(rate, "d")
+    assert len(limiter) == 3
+    # Вытеснен самый давний ключ "a": он снова начинает с полного всплеска
+    assert limiter.hit(rate, "a")[0]
+
+
+async def test_api_returns_429_with_retry_after(client):
+    from app.server import RATE_CLASSES
+
+    bulk = RATE_CLASSES["bulk"]
+    statuses = []
+    for _ in range(bulk.burst + 1):
+        response = await client.post("/api/tcp/sweep", json={})
+        statuses.append(response.status)
+    assert statuses[:-1] == [400] * bulk.burst
+    assert statuses[-1] == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+async def test_agent_token_gives_agent_limit_only_on_agent_routes(client):
+    from app.server import RATE_CLASSES
+
+    response = await client.post("/api/agents", json={"name": "a", "location": "Here", "ip": "127.0.0.1", "token": "tok"})
+    assert response.status == 201
+
+    headers = {"X-Agent-Token": "tok"}
+    statuses = [(await client.post("/api/tcp/sweep", json={}, headers=headers)).status
+                for _ in range(RATE_CLASSES["bulk"].burst + 1)]
+    assert statuses[-1] == 429
+
+    statuses = [(await client.get("/api/agent/tasks", headers=headers, params={"token": "tok"})).status
+                for _ in range(RATE_CLASSES["bulk"].burst + 1)]
+    assert 429 not in statuses
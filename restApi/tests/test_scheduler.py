@@ -0,0 +1,75 @@
+import calendar
+from datetime import datetime
+
+import pytest
+
+from app.services.scheduler import CronSchedule
+
+
+def ts(*args):
+    return float(calendar.timegm(datetime(*args).timetuple()))
+
+
+def test_every_minute_fires_on_next_minute():
+    assert CronSchedule("* * * * *").next_after(ts(2024, 1, 1, 12, 0, 30)) == ts(2024, 1, 1, 12, 1)
+
+
+def test_next_after_is_strictly_after():
+    cron = CronSchedule("*/15 * * * *")
+    assert cron.next_after(ts(2024, 1, 1, 12, 15)) == ts(2024, 1, 1, 12, 30)
+
+
+def test_daily_alias_rolls_over_month_and_year():
+    assert CronSchedule("@daily").next_after(ts(2024, 12, 31, 23, 59)) == ts(2025, 1, 1)
+
+
+def test_day_of_month_or_day_of_week():
+    # 13-е число или пятница, как в cron: 2024-09-06 - пятница, раньше 13-го
+    cron = CronSchedule("0 9 13 * 5")
+    assert cron.next_after(ts(2024, 9, 1)) == ts(2024, 9, 6, 9)
+    assert cron.next_after(ts(2024, 9, 12, 10)) == ts(2024, 9, 13, 9)
+
+
+def test_sunday_as_seven():
+    # 2024-06-02 - воскресенье
+    assert CronSchedule("30 6 * * 7").next_after(ts(2024, 6, 1)) == ts(2024, 6, 2, 6, 30)
+
+
+def test_february_29():
+    assert CronSchedule("0 0 29 2 *").next_after(ts(2025, 1, 1)) == ts(2028, 2, 29)
+
+
+def test_never_fires():
+    cron = CronSchedule("0 0 31 2 *")
+    with pytest.raises(ValueError, match="никогда не срабатывает"):
+        cron.next_after(ts(2024, 1, 1))
+
+
+@pytest.mark.parametrize("expression", ["* * * *", "60 * * * *", "*/0 * * * *", "a * * * *", "5-1 * * * *", None])
+def test_invalid_expression(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+async def test_never_firing_schedule_is_rejected(client):
+    response = await client.post("/api/schedules", json={"target": "127.0.0.1", "checks": ["tcp"], "cron": "0 0 30 2 *"})
+    assert response.status == 400
+    assert "никогда не срабатывает" in (await response.json())["error"]
+
+    response = await client.get("/api/schedules")
+    assert (await response.json())["schedules"] == []
+
+
+async def test_interval_schedule_round_trip(client):
+    response = await client.post("/api/schedules", json={"target": "127.0.0.1", "checks": ["tcp"], "interval": 60})
+    assert response.status == 201
+    schedule_id = (await response.json())["id"]
+
+    response = await client.get(f"/api/schedules/{schedule_id}")
+    assert response.status == 200
+    assert (await response.json())["next_run"] is not None
+
+    response = await client.delete(f"/api/schedules/{schedule_id}")
+    assert response.status == 200
+    response = await client.get(f"/api/schedules/{schedule_id}")
+    assert response.status == 404
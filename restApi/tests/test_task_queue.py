@@ -0,0 +1,104 @@
+import pytest
+
+from app.services.task_queue import TaskQueue
+
+
+@pytest.fixture
+def done():
+    return []
+
+
+@pytest.fixture
+def queue(done):
+    return TaskQueue({"tcp": 10, "ping": 10}, 10, on_lease=lambda task: None,
+                     on_done=lambda task, result: done.append((task["id"], result)),
+                     max_attempts=2, queue_timeout=30)
+
+
+def test_claim_leases_each_task_once(queue):
+    queue.put("c1", "tcp", "127.0.0.1")
+    queue.put("c1", "ping", "127.0.0.1")
+
+    claimed = queue.claim(1, None, ["tcp", "ping"], limit=10)
+    assert {task["id"] for task in claimed} == {"c1_tcp", "c1_ping"}
+    assert all(task["lease_id"] for task in claimed)
+    assert queue.claim(2, None, ["tcp", "ping"], limit=10) == []
+
+
+def test_claim_respects_capabilities_and_type_limits(queue):
+    for i in range(5):
+        queue.put(f"c{i}", "tcp", "127.0.0.1")
+    queue.put("p", "ping", "127.0.0.1")
+
+    assert queue.claim(1, None, ["dns"], limit=10) == []
+    claimed = queue.claim(1, None, ["tcp", "ping"], limit=10, type_limits={"tcp": 2})
+    assert sorted(task["type"] for task in claimed) == ["ping", "tcp", "tcp"]
+
+
+def test_location_tasks_go_only_to_that_location(queue):
+    queue.put("c1", "tcp", "127.0.0.1", location="Moscow")
+
+    assert queue.claim(1, "Berlin", ["tcp"]) == []
+    assert [task["id"] for task in queue.claim(2, "moscow", ["tcp"])] == ["c1_tcp"]
+
+
+def test_complete_accepts_only_current_lease(queue, done):
+    queue.put("c1", "tcp", "127.0.0.1")
+    task = queue.claim(1, None, ["tcp"])[0]
+
+    assert not queue.complete(task["id"], "other-lease", 1, {"success": True})
+    assert not queue.complete(task["id"], task["lease_id"], 2, {"success": True})
+    assert queue.complete(task["id"], task["lease_id"], 1, {"success": True})
+    assert done == [("c1_tcp", {"success": True})]
+    assert len(queue) == 0
+    # Повторный результат по той же аренде не записывается
+    assert not queue.complete(task["id"], task["lease_id"], 1, {"success": True})
+
+
+def test_expired_lease_is_retried_then_dead_lettered(queue, done):
+    queue.put("c1", "tcp", "127.0.0.1")
+    first = queue.claim(1, None, ["tcp"])[0]
+    queue.expire(now=float("inf"))
+
+    second = queue.claim(2, None, ["tcp"])[0]
+    assert second["attempt"] == 2
+    assert second["lease_id"] != first["lease_id"]
+    # Результат по истекшей аренде отклоняется
+    assert not queue.complete(first["id"], first["lease_id"], 1, {"success": True})
+
+    queue.expire(now=float("inf"))
+    assert len(queue) == 0
+    assert [task["id"] for task in queue.dead_letter] == ["c1_tcp"]
+    assert done[0][0] == "c1_tcp" and done[0][1]["success"] is False
+
+
+def test_unclaimed_task_is_dead_lettered_after_queue_timeout(queue, done):
+    queue.put("c1", "tcp", "127.0.0.1", location="Nowhere")
+    queue.expire()
+    assert len(queue) == 1
+
+    queue.expire(now=float("inf"))
+    assert len(queue) == 0
+    assert "Нет агента для задачи" in done[0][1]["error"]
+    assert queue.claim(1, "Nowhere", ["tcp"]) == []
+
+
+def test_release_returns_task_without_spending_attempt(queue):
+    queue.put("c1", "tcp", "127.0.0.1")
+    task = queue.claim(1, None, ["tcp"])[0]
+
+    assert queue.release(task["id"], task["lease_id"])
+    again = queue.claim(2, None, ["tcp"])[0]
+    assert again["attempt"] == 1
+
+
+def test_cancel_removes_tasks_of_check(queue):
+    cancelled = []
+    queue.cancel_listeners.append(cancelled.extend)
+    queue.put("c1", "tcp", "127.0.0.1")
+    queue.put("c1", "ping", "127.0.0.1")
+    queue.put("c2", "tcp", "127.0.0.1")
+
+    assert {task["id"] for task in queue.cancel("c1")} == {"c1_tcp", "c1_ping"}
+    assert len(cancelled) == 2
+    assert [task["id"] for task in queue.claim(1, None, ["tcp", "ping"], limit=10)] == ["c2_tcp"]
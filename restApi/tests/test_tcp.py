@@ -0,0 +1,54 @@
+import asyncio
+import socket
+
+import pytest
+
+from TCP_connect import async_tcp_ping, parse_tcp_target, tcp_sweep
+
+
+@pytest.fixture
+async def listener():
+    """Локальный TCP сервер, принимающий подключения; возвращает его порт"""
+    server = await asyncio.start_server(lambda reader, writer: writer.close(), "127.0.0.1", 0)
+    yield server.sockets[0].getsockname()[1]
+    server.close()
+    await server.wait_closed()
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def test_open_port(listener):
+    result = await async_tcp_ping(f"127.0.0.1:{listener}", count=3, interval=0.01, timeout=1)
+    assert result.success
+    assert (result.port, result.sent, result.received) == (listener, 3, 3)
+
+
+async def test_closed_port_is_failure():
+    result = await async_tcp_ping("127.0.0.1", count=2, port=closed_port(), interval=0.01, timeout=1)
+    assert result.error is None
+    assert result.received == 0
+    assert result.loss == 100.0
+    # Все попытки неудачны - проверка не успешна
+    assert not result.success
+
+
+async def test_sweep_keeps_target_order(listener):
+    closed = closed_port()
+    results = await tcp_sweep(["127.0.0.1"], [listener, closed], timeout=1)
+    assert [(r.port, r.success) for r in results] == [(listener, True), (closed, False)]
+
+
+@pytest.mark.parametrize("target, expected", [
+    ("example.com", ("example.com", 80)),
+    ("example.com:8080", ("example.com", 8080)),
+    ("https://example.com", ("example.com", 443)),
+    ("http://example.com:8000/path", ("example.com", 8000)),
+    ("[::1]:22", ("::1", 22)),
+    ("::1", ("::1", 80)),
+])
+def test_parse_tcp_target(target, expected):
+    assert parse_tcp_target(target) == expected